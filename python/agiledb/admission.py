@@ -0,0 +1,184 @@
+import json
+import threading
+import time
+
+
+class Rejected(Exception):
+    """
+    A request which is not admitted, with its HTTP status.
+    """
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+class AdmittedBody:
+    """
+    The response of an admitted request. The slot is released when the
+    server closes the response, so streamed responses keep their slot until
+    they are sent completely.
+    """
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.release()
+
+
+class AgileAdmission:
+    """
+    WSGI middleware bounding the requests executing at the same time.
+
+    At most ``maxConcurrent`` requests execute, further requests wait in a
+    queue of ``maxQueue`` requests for at most ``queueTimeout`` seconds. A
+    full queue and an expired wait are answered at once with 503, so an
+    overloaded server sheds load instead of queueing without limit. A
+    client, identified by its address or by ``clientHeader``, can have at
+    most ``perClient`` requests executing or waiting, more are answered
+    with 429. Both answers carry Retry-After.
+
+    ``/metrics`` shows the executing and waiting requests and the
+    rejections in the Prometheus text format.
+    """
+
+    metrics_path = "/metrics"
+
+    def __init__(self, app, options=None):
+        """
+        Args:
+            app (function): The WSGI application.
+            options (dict): The admission setting of the server.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        self.app = app
+        self.max_concurrent = int(options.get("maxConcurrent", 8))
+        self.max_queue = int(options.get("maxQueue", 64))
+        self.queue_timeout = float(options.get("queueTimeout", 1))
+        self.per_client = int(options.get("perClient", 0))
+        self.retry_after = str(int(options.get("retryAfter", 1)))
+        self.client_header = options.get("clientHeader")
+        self.condition = threading.Condition()
+        self.executing = 0
+        self.waiting = 0
+        self.clients = {}
+        self.counters = {
+            "admitted": 0,
+            "rejected_queue_full": 0,
+            "rejected_queue_timeout": 0,
+            "rejected_client_limit": 0,
+        }
+
+    def get_client(self, environ):
+        if self.client_header:
+            key = "HTTP_" + self.client_header.upper().replace("-", "_")
+            client = environ.get(key)
+            if client:
+                return client.split(",")[0].strip()
+        return environ.get("REMOTE_ADDR", "")
+
+    def admit(self, client):
+        """
+        Waits for a free slot.
+
+        Raises:
+            Rejected: If the client has too many requests, the queue is full
+            or the wait expired.
+        """
+        with self.condition:
+            if self.per_client > 0 and self.clients.get(client, 0) >= self.per_client:
+                self.counters["rejected_client_limit"] += 1
+                raise Rejected("429 Too Many Requests", "Too many concurrent requests of the client")
+            if self.executing >= self.max_concurrent or self.waiting > 0:
+                if self.waiting >= self.max_queue:
+                    self.counters["rejected_queue_full"] += 1
+                    raise Rejected("503 Service Unavailable", "The server is overloaded")
+                self.clients[client] = self.clients.get(client, 0) + 1
+                self.waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.executing >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self.condition.wait(remaining):
+                            if self.executing < self.max_concurrent:
+                                break
+                            self.counters["rejected_queue_timeout"] += 1
+                            self.release_client(client)
+                            raise Rejected("503 Service Unavailable", "The server is overloaded")
+                finally:
+                    self.waiting -= 1
+            else:
+                self.clients[client] = self.clients.get(client, 0) + 1
+            self.executing += 1
+            self.counters["admitted"] += 1
+
+    def release_client(self, client):
+        count = self.clients.get(client, 0) - 1
+        if count > 0:
+            self.clients[client] = count
+        else:
+            self.clients.pop(client, None)
+
+    def release(self, client):
+        with self.condition:
+            self.executing -= 1
+            self.release_client(client)
+            self.condition.notify()
+
+    def create_metrics(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        with self.condition:
+            values = [
+                ("agile_requests_executing", "gauge", self.executing),
+                ("agile_requests_waiting", "gauge", self.waiting),
+                ("agile_requests_max_concurrent", "gauge", self.max_concurrent),
+                ("agile_requests_max_queue", "gauge", self.max_queue),
+            ]
+            for name, value in self.counters.items():
+                values.append(("agile_requests_" + name + "_total", "counter", value))
+        lines = []
+        for name, metric_type, value in values:
+            lines.append("# TYPE " + name + " " + metric_type)
+            lines.append(name + " " + str(value))
+        return "\n".join(lines) + "\n"
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") == self.metrics_path:
+            start_response("200 OK", [
+                ("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            ])
+            return [self.create_metrics().encode("utf-8")]
+        client = self.get_client(environ)
+        try:
+            self.admit(client)
+        except Rejected as rejected:
+            start_response(rejected.status, [
+                ("Content-Type", "application/json"),
+                ("Retry-After", self.retry_after),
+            ])
+            return [json.dumps({"error": rejected.reason}).encode("utf-8")]
+        released = []
+
+        def release():
+            if len(released) == 0:
+                released.append(True)
+                self.release(client)
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            release()
+            raise
+        return AdmittedBody(body, release)
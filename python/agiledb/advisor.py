@@ -0,0 +1,320 @@
+import copy
+import threading
+
+
+class FieldStats:
+    """
+    The use of one field of a type by the GETs.
+    """
+
+    def __init__(self):
+        self.compared = 0
+        self.unindexed_time = 0.0
+        self.projected = 0
+        self.projected_time = 0.0
+        self.value_types = {}
+
+
+class AgileAdvisor:
+    """
+    Suggests promoted columns and indexes from the GETs the server runs.
+
+    With ``advisor`` in ``server`` every GET records which fields of its
+    type it compares and projects and how long it took. The time of a GET
+    is split between the compared fields without an index and, separately,
+    between its projected fields which are read from the document. The
+    estimated savings of an index are ``indexBenefit`` of the time of its
+    field, of a promoted column ``columnBenefit`` of the projection time.
+    On Postgres fields are indexed by their expression, MariaDB and MSSQL
+    only index promoted columns, so a compared field becomes a column with
+    an index there.
+
+    With ``autoApply`` the suggestions saving more than ``minSavings``
+    seconds are applied every ``interval`` seconds through a reload of the
+    configuration, so indexes are built online. Columns are only added
+    with ``applyColumns``, adding a generated column rewrites the table.
+    """
+
+    index_benefit = 0.9
+    column_benefit = 0.2
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.types = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def get_options(self):
+        """
+        Returns the advisor setting of the server or None if disabled.
+        """
+        server = self.database.config.get("server") or {}
+        options = server.get("advisor")
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        return options
+
+    def collect_comparisons(self, where, comparisons, operator="="):
+        """
+        Collects the compared fields of a where list with their values and
+        operators, including nested groups.
+        """
+        if isinstance(where, list):
+            for condition in where:
+                self.collect_comparisons(condition, comparisons)
+            return
+        if not isinstance(where, dict):
+            return
+        operator = str(where.get("operator", operator)).upper()
+        for key, value in where.items():
+            if key == "operator" or key == "where":
+                continue
+            if key.lower() in self.database.query.group_list:
+                self.collect_comparisons(value, comparisons)
+            else:
+                comparisons.append((key, value, operator))
+
+    def is_candidate(self, agile_type, field):
+        """
+        Checks if a field can become a column or get an index of its own.
+        """
+        query = self.database.query
+        return query.simple_name.match(field) is not None and \
+            field not in query.table_columns
+
+    def observe(self, json_object, duration):
+        """
+        Records the fields of a GET and its duration. Does nothing without
+        advisor.
+
+        Args:
+            json_object (dict): The body of the GET.
+            duration (float): The time of its query in seconds.
+        """
+        options = self.get_options()
+        if options is None:
+            return
+        agile_type = json_object["type"]
+        query = self.database.query
+        comparisons = []
+        self.collect_comparisons(self.database.get_from_json("where", json_object), comparisons)
+        indexed = self.database.explainer.get_indexed_fields(agile_type)
+        unindexed = []
+        for field, value, operator in comparisons:
+            # LIKE compares the text and can't use the index of a typed field
+            if field not in indexed and field not in unindexed and \
+                    operator not in ["LIKE", "NOT LIKE"] and self.is_candidate(agile_type, field):
+                unindexed.append(field)
+        projected = [
+            column for column in (self.database.get_from_json("columns", json_object) or [])
+            if self.is_candidate(agile_type, column) and not query.is_column(agile_type, column)
+        ]
+        max_fields = int(options.get("maxFields", 1000))
+        with self.lock:
+            fields = self.types.setdefault(agile_type, {})
+
+            def get_stats(field):
+                if field not in fields and len(fields) >= max_fields:
+                    return None
+                return fields.setdefault(field, FieldStats())
+            for field, value, operator in comparisons:
+                stats = get_stats(field)
+                if stats is None:
+                    continue
+                stats.compared += 1
+                value_type = query.infer_type(value) if operator not in ["LIKE", "NOT LIKE"] else None
+                value_type = value_type or "TEXT"
+                stats.value_types[value_type] = stats.value_types.get(value_type, 0) + 1
+            for field in unindexed:
+                stats = get_stats(field)
+                if stats is not None:
+                    stats.unindexed_time += duration / len(unindexed)
+            for field in projected:
+                stats = get_stats(field)
+                if stats is not None:
+                    stats.projected += 1
+                    stats.projected_time += duration / len(projected)
+
+    def get_column_type(self, agile_type, stats, field):
+        """
+        Returns the type of a suggested column or field, the declared type
+        or the type of most compared values.
+        """
+        declared_type = self.database.query.get_declared_type(agile_type, field)
+        if declared_type is not None:
+            return declared_type
+        value_type = "TEXT"
+        if len(stats.value_types) > 0:
+            value_type = max(stats.value_types.items(), key=lambda item: item[1])[0]
+        if self.database.type == "mariaDb":
+            return {"DOUBLE": "DOUBLE", "BOOLEAN": "BOOLEAN"}.get(value_type, "VARCHAR(255)")
+        if self.database.type == "mssql":
+            return {"DOUBLE": "FLOAT", "BOOLEAN": "BIT"}.get(value_type, "NVARCHAR(450)")
+        return {"DOUBLE": "DOUBLE PRECISION"}.get(value_type, value_type)
+
+    def get_suggestions(self):
+        """
+        Ranks the suggested columns and indexes by their estimated savings.
+
+        Returns:
+            list: The type, field and action of every suggestion with the
+            counted GETs, the attributed time, the estimated savings and
+            the settings to add to the type.
+        """
+        options = self.get_options() or {}
+        min_queries = int(options.get("minQueries", 100))
+        index_benefit = float(options.get("indexBenefit", self.index_benefit))
+        column_benefit = float(options.get("columnBenefit", self.column_benefit))
+        query = self.database.query
+        with self.lock:
+            types = {
+                agile_type: {field: copy.copy(stats) for field, stats in fields.items()}
+                for agile_type, fields in self.types.items()
+            }
+        suggestions = []
+        for agile_type, fields in types.items():
+            if agile_type not in (self.database.config.get("types") or {}):
+                continue
+            indexed = self.database.explainer.get_indexed_fields(agile_type)
+            for field, stats in fields.items():
+                if stats.compared + stats.projected < min_queries:
+                    continue
+                is_column = query.is_column(agile_type, field)
+                add_index = field not in indexed and stats.unindexed_time > 0
+                # MariaDB and MSSQL only index promoted columns
+                add_column = not is_column and (
+                    stats.projected_time > 0 or
+                    add_index and self.database.type != "postgres"
+                )
+                if not add_index and not add_column:
+                    continue
+                settings = {}
+                savings = 0.0
+                column_type = self.get_column_type(agile_type, stats, field)
+                if add_column:
+                    settings["columns"] = {field: column_type}
+                    savings += column_benefit * stats.projected_time
+                if add_index:
+                    settings["indices"] = {field: ""}
+                    savings += index_benefit * stats.unindexed_time
+                    if not add_column and not is_column and \
+                            query.get_declared_type(agile_type, field) is None and \
+                            column_type != "TEXT":
+                        # The index has to use the type the GETs compare with
+                        settings["fields"] = {field: column_type}
+                suggestions.append({
+                    "type": agile_type,
+                    "field": field,
+                    "action": "+".join(
+                        action for action, added in [("column", add_column), ("index", add_index)]
+                        if added
+                    ),
+                    "compared": stats.compared,
+                    "projected": stats.projected,
+                    "unindexedSeconds": round(stats.unindexed_time, 3),
+                    "projectedSeconds": round(stats.projected_time, 3),
+                    "estimatedSavings": round(savings, 3),
+                    "settings": settings,
+                })
+        return sorted(suggestions, key=lambda suggestion: -suggestion["estimatedSavings"])
+
+    def get_report(self):
+        """
+        Returns the suggestions and the counted fields of every type.
+        """
+        with self.lock:
+            fields = {
+                agile_type: {
+                    field: {
+                        "compared": stats.compared,
+                        "projected": stats.projected,
+                        "valueTypes": dict(stats.value_types),
+                    }
+                    for field, stats in type_fields.items()
+                }
+                for agile_type, type_fields in self.types.items()
+            }
+        return {
+            "enabled": self.get_options() is not None,
+            "suggestions": self.get_suggestions(),
+            "fields": fields,
+        }
+
+    def create_config(self, suggestions):
+        """
+        Creates the configuration with the settings of suggestions added.
+        """
+        config = copy.deepcopy(self.database.config)
+        for suggestion in suggestions:
+            type_object = config["types"][suggestion["type"]]
+            for key, values in suggestion["settings"].items():
+                if not isinstance(type_object.get(key), dict):
+                    type_object[key] = {}
+                type_object[key].update(values)
+        return config
+
+    def apply(self):
+        """
+        Applies the suggestions saving more than minSavings through a
+        reload and forgets the fields of the applied suggestions.
+
+        Returns:
+            list: The applied suggestions.
+        """
+        options = self.get_options() or {}
+        min_savings = float(options.get("minSavings", 1))
+        suggestions = [
+            suggestion for suggestion in self.get_suggestions()
+            if suggestion["estimatedSavings"] >= min_savings and
+            ("columns" not in suggestion["settings"] or options.get("applyColumns") is True)
+        ]
+        if len(suggestions) == 0:
+            return []
+        self.database.reload(self.create_config(suggestions))
+        with self.lock:
+            for suggestion in suggestions:
+                self.types.get(suggestion["type"], {}).pop(suggestion["field"], None)
+        for suggestion in suggestions:
+            print("Advisor applied", suggestion["action"], "of", suggestion["field"],
+                  "to", suggestion["type"] + ", add it to the config file:", suggestion["settings"])
+        return suggestions
+
+    def run(self, interval):
+        """
+        Applies the suggestions until the advisor is stopped.
+        """
+        while not self.stopped.wait(interval):
+            options = self.get_options()
+            if options is None or options.get("autoApply") is not True:
+                continue
+            try:
+                self.apply()
+            except Exception as error:
+                print("Advisor failed to apply its suggestions:", error)
+
+    def start(self):
+        """
+        Starts applying the suggestions if autoApply is set.
+        """
+        options = self.get_options()
+        if options is None or options.get("autoApply") is not True or \
+                self.thread is not None or self.stopped.is_set():
+            return
+        self.thread = threading.Thread(
+            target=self.run, args=(float(options.get("interval", 300)),),
+            name="agile_advisor", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops applying the suggestions.
+        """
+        self.stopped.set()
@@ -0,0 +1,375 @@
+import functools
+import io
+import json
+import queue
+import threading
+import uuid
+
+
+class AgileBulk:
+    """
+    Streams whole types out of and into the database.
+
+    Two formats are supported. ``ndjson`` writes one record per line as
+    ``{"agile_id": ..., "agile_type": ..., "data": {...}}``. ``copy`` is
+    the tab separated text format of the Postgres COPY command with the
+    columns agile_id, agile_type and data. Postgres reads and writes it
+    natively, on MariaDB and MSSQL it is produced and parsed row by row.
+    """
+
+    formats = ["ndjson", "copy"]
+    join_timeout = 10
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+
+    def check_format(self, data_format):
+        """
+        Raises:
+            ValueError: If the format is not supported.
+        """
+        if data_format not in self.formats:
+            raise ValueError("Format not supported: " + str(data_format))
+        return data_format
+
+    def create_export_sql(self, agile_type, where):
+        """
+        Creates the SELECT of an export. The id and the document are read
+        as text, so they are written without decoding them.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        db_type = self.database.type
+        if db_type == "postgres":
+            document = self.database.storage.create_document_expression(
+                agile_type, self.database.get_table_name(agile_type)
+            )
+            columns = "CAST(agile_id AS TEXT), agile_type, CAST(" + document + " AS TEXT)"
+        elif db_type == "mariaDb":
+            columns = "CAST(agile_id AS CHAR CHARACTER SET utf8), " \
+                "agile_type, data"
+        else:
+            columns = "CAST(agile_id AS varchar(36)), agile_type, data"
+        table, table_tuple = self.database.migrator.create_read_table(agile_type)
+        sql = "SELECT " + columns + " FROM " + table + " WHERE agile_type=%s"
+        sql_tuple = table_tuple + (agile_type,)
+        where_sql, where_tuple = self.database.query.compile_where(
+            agile_type, where
+        )
+        if where_sql != "":
+            sql += " AND " + where_sql
+            sql_tuple += where_tuple
+        return sql, sql_tuple
+
+    def open_stream_cursor(self, connection):
+        """
+        Opens a cursor which fetches the result in batches instead of
+        loading it completely.
+        """
+        if self.database.type == "postgres":
+            return connection.cursor(name="agile_export_" + uuid.uuid4().hex)
+        if self.database.type == "mariaDb":
+            return connection.cursor(buffered=False)
+        return connection.cursor()
+
+    def escape_copy(self, value):
+        """
+        Escapes a value for the COPY text format.
+        """
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t") \
+            .replace("\n", "\\n").replace("\r", "\\r")
+
+    def unescape_copy(self, value):
+        """
+        Reads a value of the COPY text format.
+        """
+        if value == "\\N":
+            return None
+        result = []
+        escaped = False
+        escapes = {"t": "\t", "n": "\n", "r": "\r", "\\": "\\"}
+        for char in value:
+            if escaped:
+                result.append(escapes.get(char, char))
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            else:
+                result.append(char)
+        return "".join(result)
+
+    def format_row(self, row, data_format):
+        """
+        Formats one exported row as line of the format.
+        """
+        agile_id, agile_type, data = row
+        if data_format == "copy":
+            return self.escape_copy(agile_id) + "\t" + \
+                self.escape_copy(agile_type) + "\t" + \
+                self.escape_copy(data) + "\n"
+        if data is None:
+            data = "null"
+        return '{"agile_id": ' + json.dumps(agile_id) + \
+            ', "agile_type": ' + json.dumps(agile_type) + \
+            ', "data": ' + data + "}\n"
+
+    def export(self, agile_type, where=None, data_format="ndjson",
+               batch_size=1000):
+        """
+        Streams all records of a type with constant memory.
+
+        Args:
+            agile_type (str): The type of the records.
+            where (list): Optional where conditions.
+            data_format (str): ndjson or copy.
+            batch_size (int): The number of rows fetched at once.
+
+        Returns:
+            function: Streams the lines of the export from a connection,
+            one string per batch.
+        """
+        self.check_format(data_format)
+        sql, sql_tuple = self.create_export_sql(agile_type, where)
+        if data_format == "copy" and self.database.type == "postgres":
+            return functools.partial(self.export_postgres_copy, sql, sql_tuple, batch_size)
+        return functools.partial(self.export_rows, sql, sql_tuple, data_format, batch_size)
+
+    def export_rows(self, sql, sql_tuple, data_format, batch_size, connection):
+        """
+        Streams the rows of an export query formatted line by line.
+        """
+        cursor = self.open_stream_cursor(connection)
+        try:
+            cursor.execute(sql, sql_tuple)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                yield "".join(
+                    self.format_row(row, data_format) for row in rows
+                )
+        finally:
+            cursor.close()
+
+    def export_postgres_copy(self, sql, sql_tuple, batch_size, connection):
+        """
+        Streams an export with COPY TO STDOUT. The copy runs in its own
+        thread and hands its output over a bounded queue, so a slow client
+        slows the copy down instead of filling the memory. If the client
+        goes away the copy is cancelled, a copy which doesn't end within
+        ``join_timeout`` seconds is cancelled on the server.
+        """
+        cursor = connection.cursor()
+        select_sql = cursor.mogrify(sql, sql_tuple).decode("utf-8")
+        copy_sql = "COPY (" + select_sql + ") TO STDOUT"
+        chunks = queue.Queue(maxsize=16)
+        cancelled = threading.Event()
+        end = object()
+
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        class QueueWriter:
+            def write(self, chunk):
+                if not put(chunk):
+                    raise IOError("Export cancelled")
+                return len(chunk)
+
+        def copy():
+            try:
+                cursor.copy_expert(copy_sql, QueueWriter(), batch_size * 256)
+                connection.commit()
+                put(end)
+            except Exception as error:
+                connection.rollback()
+                put(error)
+
+        thread = threading.Thread(target=copy, daemon=True)
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is end:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode("utf-8")
+                yield chunk
+        finally:
+            cancelled.set()
+            thread.join(self.join_timeout)
+            if thread.is_alive():
+                connection.cancel()
+                thread.join(self.join_timeout)
+            if thread.is_alive():
+                print("Export copy did not end after it was cancelled")
+            else:
+                cursor.close()
+
+    def parse_line(self, agile_type, line, data_format):
+        """
+        Parses one line of an import.
+
+        Records without agile_id get a new id, the type of the import is
+        used for every record.
+
+        Returns:
+            tuple: agile_id, agile_type and the document as JSON text, or
+            None for empty lines.
+        """
+        line = line.rstrip("\r\n")
+        if line.strip() == "":
+            return None
+        if data_format == "copy":
+            values = line.split("\t")
+            if len(values) != 3:
+                raise ValueError("Invalid COPY line: " + line[:100])
+            agile_id = self.unescape_copy(values[0])
+            data = self.unescape_copy(values[2])
+        else:
+            record = json.loads(line)
+            if "data" not in record:
+                raise ValueError("Record without data: " + line[:100])
+            agile_id = record.get("agile_id")
+            data = json.dumps(record["data"])
+        if agile_id is None:
+            agile_id = str(uuid.uuid4())
+        return agile_id, agile_type, data
+
+    def strip_row(self, agile_type, row, expires=False):
+        """
+        Keeps the stripped columns of a type out of the document of a parsed
+        line, their values are appended to the row, followed by the expiry
+        time for types with a ttl.
+        """
+        agile_id, agile_type, data = row
+        document = json.loads(data)
+        stored, columns, values = self.database.storage.strip(
+            agile_type, document
+        )
+        row = (agile_id, agile_type, json.dumps(stored)) + values
+        if expires:
+            row += (self.database.ttl.compute_expiry(agile_type, document),)
+        return row
+
+    def insert_chunk(self, connection, table_name, rows, columns=None):
+        """
+        Inserts one chunk of rows and commits it.
+
+        Args:
+            connection (obj): The connection of the import.
+            table_name (str): The table of the type.
+            rows (list): The id, type and document of every row, followed
+            by the values of the columns.
+            columns (list): The columns following the document.
+        """
+        names = ["agile_id", "agile_type", "data"] + (columns or [])
+        column_list = ", ".join(names)
+        placeholders = "(" + ", ".join(["%s"] * len(names)) + ")"
+        cursor = connection.cursor()
+        try:
+            if self.database.type == "postgres":
+                copy_data = io.StringIO("".join(
+                    "\t".join(self.escape_copy(value) for value in row) + "\n"
+                    for row in rows
+                ))
+                cursor.copy_expert(
+                    "COPY " + table_name + " (" + column_list + ") FROM STDIN",
+                    copy_data
+                )
+            elif self.database.type == "mariaDb":
+                cursor.executemany(
+                    "INSERT INTO " + table_name +
+                    " (" + column_list + ") VALUES " + placeholders,
+                    rows
+                )
+            else:
+                # MSSQL allows fewer than 2100 parameters and at most
+                # 1000 row values per statement
+                step = max(1, min(1000, 2099 // len(names)))
+                for start in range(0, len(rows), step):
+                    part = rows[start:start + step]
+                    values = ",".join([placeholders] * len(part))
+                    sql_tuple = ()
+                    for row in part:
+                        sql_tuple += row
+                    cursor.execute(
+                        "INSERT INTO " + table_name +
+                        " (" + column_list + ") VALUES " + values,
+                        sql_tuple
+                    )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def import_data(self, connection, agile_type, stream,
+                    data_format="ndjson", chunk_size=5000, progress=None):
+        """
+        Imports the lines of a stream in chunks. Every chunk is inserted
+        with COPY FROM STDIN (Postgres), a bulk executemany (MariaDB) or
+        multi row INSERTs (MSSQL) and committed on its own, so a failed
+        import keeps all chunks before the failing one. Records of types
+        with a ttl get their expiry time like a POST.
+
+        Args:
+            connection (obj): The connection of the import.
+            agile_type (str): The type of the records.
+            stream (file): A binary or text stream with one record per line.
+            data_format (str): ndjson or copy.
+            chunk_size (int): The number of rows per transaction.
+            progress (function): Called with the number of imported rows
+            after every chunk is committed.
+
+        Returns:
+            dict: The number of imported rows and chunks.
+        """
+        self.check_format(data_format)
+        table_name = self.database.get_table_name(agile_type)
+        columns = list(self.database.storage.get_stripped_columns(agile_type))
+        expires = self.database.ttl.has_ttl(agile_type)
+        complete = len(columns) > 0 or expires
+        if expires:
+            columns.append("agile_expires")
+        imported = 0
+        chunks = 0
+        rows = []
+        for line in stream:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            row = self.parse_line(agile_type, line, data_format)
+            if row is None:
+                continue
+            if complete:
+                row = self.strip_row(agile_type, row, expires)
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                self.insert_chunk(connection, table_name, rows, columns)
+                imported += len(rows)
+                chunks += 1
+                rows = []
+                if progress is not None:
+                    progress(imported)
+        if len(rows) > 0:
+            self.insert_chunk(connection, table_name, rows, columns)
+            imported += len(rows)
+            chunks += 1
+            if progress is not None:
+                progress(imported)
+        return {"imported": imported, "chunks": chunks}
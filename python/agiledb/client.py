@@ -0,0 +1,630 @@
+"""
+Client of the AgileDb server.
+
+Keeps a pool of keep-alive connections, gathers POSTs and DELETEs of
+concurrent callers into batch requests, decodes large GET results while
+they are read and retries idempotent requests with backoff. Only the
+standard library is needed.
+
+Examples:
+    client = AgileClient("http://localhost:1338")
+    agile_id = client.post("house", {"Address": "Blubberdi"})
+    for house in client.iter_get({"type": "house", "columns": ["Address"]}):
+        print(house)
+
+    async with AsyncAgileClient("http://localhost:1338") as client:
+        houses = await client.get({"type": "house"})
+"""
+import asyncio
+import codecs
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class AgileError(Exception):
+    """
+    An error of a request, with the status and body of the response.
+    """
+
+    def __init__(self, message, status=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to one server. At most ``size`` requests use a
+    connection at the same time, idle connections are reused.
+    """
+
+    def __init__(self, url, size=8, timeout=30):
+        """
+        Args:
+            url (str): The base URL of the server.
+            size (int): The maximum number of connections.
+            timeout (float): The socket timeout in seconds.
+        """
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        """
+        Waits for a free slot and returns an idle or a new connection.
+
+        Returns:
+            tuple: The connection and True if it was used before.
+        """
+        self.slots.acquire()
+        with self.lock:
+            if len(self.idle) > 0:
+                return self.idle.pop(), True
+        return self.connect(), False
+
+    def release(self, connection, reuse=True):
+        """
+        Returns a connection to the pool, it is closed unless it can be
+        reused.
+        """
+        if reuse:
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for connection in idle:
+            connection.close()
+
+
+class PendingCall:
+    """
+    A POST or DELETE waiting in a batcher for its batch request.
+    """
+
+    def __init__(self, agile_type, value):
+        self.agile_type = agile_type
+        self.value = value
+        self.future = Future()
+
+
+class AgileBatcher:
+    """
+    Gathers the POSTs or DELETEs of concurrent callers into batch requests.
+
+    A batch is sent when it has ``batch_size`` calls or ``batch_delay``
+    seconds after its first call, one request per type: the records of
+    POSTs in ``records``, the ids of DELETEs in a list of ``agile_id``.
+    While a batch is sent the next one is gathered, at most ``pipeline``
+    batches are sent at the same time. Every call gets its own result, a
+    failing batch request fails all of its calls.
+    """
+
+    def __init__(self, client, operation, batch_size=100, batch_delay=0.005, pipeline=2):
+        """
+        Args:
+            client (AgileClient): The client sending the batches.
+            operation (str): post or delete.
+            batch_size (int): The maximum number of calls of a batch.
+            batch_delay (float): How long a batch waits for more calls.
+            pipeline (int): The number of batches sent at the same time.
+        """
+        self.client = client
+        self.operation = operation
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.senders = ThreadPoolExecutor(max_workers=pipeline)
+
+    def submit(self, agile_type, value):
+        """
+        Adds a call to the next batch.
+
+        Args:
+            agile_type (str): The type of the call.
+            value (obj): The record of a POST or the id of a DELETE.
+
+        Returns:
+            Future: The result of the call, the new ID for POSTs.
+        """
+        call = PendingCall(agile_type, value)
+        with self.condition:
+            if self.stopped:
+                raise AgileError("The client is closed")
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run,
+                    name="agile_client_" + self.operation,
+                    daemon=True
+                )
+                self.thread.start()
+            self.pending.append(call)
+            self.condition.notify()
+        return call.future
+
+    def take_batch(self):
+        """
+        Waits for the first call and then until the batch is full or the
+        delay is over.
+
+        Returns:
+            list: The calls of the batch, None if the batcher is stopped.
+        """
+        with self.condition:
+            while len(self.pending) == 0:
+                if self.stopped:
+                    return None
+                self.condition.wait()
+            deadline = time.monotonic() + self.batch_delay
+            while len(self.pending) < self.batch_size and not self.stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.batch_size]
+            self.pending = self.pending[self.batch_size:]
+        return batch
+
+    def run(self):
+        """
+        Sends batches until the batcher is stopped and empty.
+        """
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            calls = {}
+            for call in batch:
+                calls.setdefault(call.agile_type, []).append(call)
+            for agile_type, type_calls in calls.items():
+                self.senders.submit(self.send, agile_type, type_calls)
+
+    def send(self, agile_type, calls):
+        try:
+            values = [call.value for call in calls]
+            if self.operation == "post":
+                ids = self.client.post_many(agile_type, values)
+                if not isinstance(ids, list) or len(ids) != len(calls):
+                    raise AgileError("The server returned no ids of the batch")
+                for call, agile_id in zip(calls, ids):
+                    call.future.set_result(agile_id)
+            else:
+                self.client.delete_many(agile_type, values)
+                for call in calls:
+                    call.future.set_result(None)
+        except Exception as error:
+            for call in calls:
+                if not call.future.done():
+                    call.future.set_exception(error)
+
+    def close(self):
+        """
+        Sends the pending calls and stops the batcher.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+            thread = self.thread
+        if thread is not None:
+            thread.join()
+        self.senders.shutdown(wait=True)
+
+
+class AgileClient:
+    """
+    Synchronous client of the AgileDb server, safe to share between
+    threads.
+
+    ``post`` and ``delete`` of single records are gathered into batch
+    requests with the calls of other threads, ``post_many`` and
+    ``delete_many`` send their records at once. GET, PUT, DELETE and
+    upsert are repeated up to ``retries`` times after connection errors
+    with exponential backoff. Every request is repeated after 429 and 503
+    answers of the admission control, which rejects requests before they
+    execute, and once if a reused keep-alive connection was closed by the
+    server meanwhile.
+    """
+
+    retry_errors = (http.client.HTTPException, OSError)
+    stale_errors = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+    def __init__(self, url, pool_size=8, timeout=30, retries=3, backoff=0.1,
+                 batch_size=100, batch_delay=0.005, pipeline=2, tenant=None):
+        """
+        Args:
+            url (str): The base URL of the server.
+            pool_size (int): The maximum number of connections.
+            timeout (float): The socket timeout in seconds.
+            retries (int): How often a request is repeated.
+            backoff (float): The first delay before a repetition in seconds,
+            it doubles with every repetition.
+            batch_size (int): The maximum number of POSTs or DELETEs per batch.
+            batch_delay (float): How long a batch waits for more calls.
+            pipeline (int): The number of batches sent at the same time.
+            tenant (str): The tenant sent in the X-Tenant header.
+        """
+        self.pool = ConnectionPool(url, pool_size, timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.headers = {"Connection": "keep-alive", "Content-Type": "application/json"}
+        if tenant is not None:
+            self.headers["X-Tenant"] = tenant
+        self.batchers = {
+            operation: AgileBatcher(self, operation, batch_size, batch_delay, pipeline)
+            for operation in ["post", "delete"]
+        }
+
+    def get_delay(self, attempt, retry_after=None):
+        """
+        Returns the delay before a repetition, with jitter so clients
+        rejected together don't return together.
+        """
+        delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def open(self, method, path, body=None, idempotent=False):
+        """
+        Sends a request and returns the response once its headers are read.
+        The connection has to be released with ``finish``.
+
+        Returns:
+            tuple: The response and its connection.
+
+        Raises:
+            AgileError: If the server answered with an error status.
+        """
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        attempt = 0
+        while True:
+            connection, reused = self.pool.acquire()
+            try:
+                connection.request(method, self.pool.base_path + path, data, self.headers)
+                response = connection.getresponse()
+            except self.retry_errors as error:
+                self.pool.release(connection, False)
+                if reused and isinstance(error, self.stale_errors):
+                    # The server closed the idle connection, the request
+                    # was not read
+                    continue
+                if not idempotent or attempt >= self.retries:
+                    raise
+                time.sleep(self.get_delay(attempt))
+                attempt += 1
+                continue
+            if response.status in (429, 503) and attempt < self.retries:
+                retry_after = response.getheader("Retry-After")
+                self.finish(response, connection)
+                time.sleep(self.get_delay(attempt, retry_after))
+                attempt += 1
+                continue
+            if response.status >= 400:
+                content = response.read()
+                self.finish(response, connection)
+                raise AgileError(self.get_error(content), response.status, content)
+            return response, connection
+
+    def finish(self, response, connection):
+        """
+        Reads the rest of a response and releases its connection.
+        """
+        try:
+            response.read()
+            self.pool.release(connection, not response.will_close)
+        except self.retry_errors:
+            self.pool.release(connection, False)
+
+    def get_error(self, content):
+        text = content.decode("utf-8", "replace").strip()
+        try:
+            error = json.loads(text)
+            if isinstance(error, dict) and "error" in error:
+                return str(error["error"])
+        except ValueError:
+            pass
+        if text == "":
+            # The server only returns its errors with showDbErrors
+            return "The server returned no result, see its log or enable showDbErrors"
+        return text
+
+    def request(self, method, path, body=None, idempotent=False):
+        """
+        Sends a request and decodes its JSON response.
+
+        Raises:
+            AgileError: If the server returned an error instead of JSON.
+        """
+        response, connection = self.open(method, path, body, idempotent)
+        try:
+            content = response.read()
+        except self.retry_errors:
+            self.pool.release(connection, False)
+            raise
+        self.pool.release(connection, not response.will_close)
+        try:
+            result = json.loads(content)
+        except ValueError:
+            raise AgileError(self.get_error(content), response.status, content)
+        if isinstance(result, dict) and "error" in result:
+            raise AgileError(str(result["error"]), response.status, content)
+        return result
+
+    def write(self, method, path, body, idempotent):
+        """
+        Sends a write, the server answers it with result OK.
+        """
+        result = self.request(method, path, body, idempotent)
+        if not isinstance(result, dict) or result.get("result") != "OK":
+            raise AgileError("Unexpected response: " + json.dumps(result))
+        return result
+
+    def get(self, query):
+        """
+        Selects records.
+
+        Args:
+            query (dict): The body of the GET with the type, columns, where,
+            search and limit.
+
+        Returns:
+            list: The records.
+        """
+        return self.request("GET", "/", query, True)
+
+    def iter_get(self, query, chunk_size=65536):
+        """
+        Selects records and decodes them while the response is read, so
+        large results don't have to fit into memory as text.
+
+        Args:
+            query (dict): The body of the GET.
+            chunk_size (int): The bytes read at once.
+
+        Returns:
+            generator: The records.
+        """
+        response, connection = self.open("GET", "/", query, True)
+        complete = False
+        try:
+            for record in self.decode_array(response, chunk_size):
+                yield record
+            complete = True
+        finally:
+            if complete:
+                self.finish(response, connection)
+            else:
+                self.pool.release(connection, False)
+
+    def decode_array(self, response, chunk_size):
+        """
+        Decodes the elements of the JSON array of a response chunk by chunk.
+        """
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        position = 0
+        started = False
+        while True:
+            chunk = response.read(chunk_size)
+            buffer = buffer[position:] + text_decoder.decode(chunk, final=not chunk)
+            position = 0
+            while True:
+                while position < len(buffer) and (buffer[position] in " \t\r\n" or
+                                                  started and buffer[position] == ","):
+                    position += 1
+                if position >= len(buffer):
+                    break
+                if not started:
+                    if buffer[position] != "[":
+                        content = (buffer[position:] + response.read().decode("utf-8", "replace"))
+                        raise AgileError(self.get_error(content.encode("utf-8")), response.status)
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if not chunk:
+                        raise AgileError("Incomplete response", response.status)
+                    break
+                if end == len(buffer) and chunk:
+                    # A number at the end of the chunk can go on in the next
+                    break
+                yield value
+                position = end
+            if not chunk:
+                if not started:
+                    raise AgileError(self.get_error(b""), response.status)
+                raise AgileError("Incomplete response", response.status)
+
+    def post(self, agile_type, data):
+        """
+        Inserts a record in a batch with the POSTs of other threads.
+
+        Returns:
+            str: The ID of the new record.
+        """
+        return self.batchers["post"].submit(agile_type, data).result()
+
+    def post_many(self, agile_type, records):
+        """
+        Inserts records in one request and transaction.
+
+        Returns:
+            list: The IDs of the new records.
+        """
+        return self.write("POST", "/", {"type": agile_type, "records": records}, False)["id"]
+
+    def put(self, agile_type, agile_id, data):
+        """
+        Updates the data of a record.
+        """
+        self.write("PUT", "/", {"type": agile_type, "agile_id": agile_id, "data": data}, True)
+
+    def delete(self, agile_type, agile_id):
+        """
+        Deletes a record in a batch with the DELETEs of other threads.
+        """
+        self.batchers["delete"].submit(agile_type, agile_id).result()
+
+    def delete_many(self, agile_type, agile_ids):
+        """
+        Deletes records in one request and transaction.
+        """
+        self.write("DELETE", "/", {"type": agile_type, "agile_id": agile_ids}, True)
+
+    def upsert(self, agile_type, data):
+        """
+        Inserts or updates a record or a list of records by the natural key
+        of their type.
+
+        Returns:
+            obj: The ID or the list of IDs.
+        """
+        return self.write("POST", "/upsert", {"type": agile_type, "data": data}, True)["id"]
+
+    def patch(self, sql):
+        """
+        Executes raw SQL, the server needs enableRawSQL.
+
+        Returns:
+            list: The rows of the statement.
+        """
+        return self.request("PATCH", "/", {"sql": sql})
+
+    def summary(self, agile_type, name):
+        """
+        Reads a summary of a type.
+
+        Returns:
+            list: The groups of the summary.
+        """
+        return self.request("GET", "/summary", {"type": agile_type, "summary": name}, True)
+
+    def close(self):
+        """
+        Sends the pending batches and closes the connections.
+        """
+        for batcher in self.batchers.values():
+            batcher.close()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
+        return False
+
+
+class AsyncAgileClient:
+    """
+    Asynchronous client of the AgileDb server for asyncio.
+
+    The requests are sent by an AgileClient in a thread pool of
+    ``pool_size`` threads. Batched POSTs and DELETEs wait for their batch
+    without taking a thread, so many coroutines share one batch request.
+    """
+
+    def __init__(self, url, pool_size=8, **options):
+        """
+        Args:
+            url (str): The base URL of the server.
+            pool_size (int): The maximum number of connections and threads.
+            options: The further arguments of AgileClient.
+        """
+        self.client = AgileClient(url, pool_size=pool_size, **options)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    async def call(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, *args)
+
+    async def get(self, query):
+        return await self.call(self.client.get, query)
+
+    async def iter_get(self, query, batch_size=1000):
+        """
+        Selects records and decodes them while the response is read.
+
+        Returns:
+            async generator: The records.
+        """
+        records = self.client.iter_get(query)
+        try:
+            while True:
+                batch = await self.call(list, itertools.islice(records, batch_size))
+                for record in batch:
+                    yield record
+                if len(batch) < batch_size:
+                    return
+        finally:
+            await self.call(records.close)
+
+    async def post(self, agile_type, data):
+        future = self.client.batchers["post"].submit(agile_type, data)
+        return await asyncio.wrap_future(future)
+
+    async def post_many(self, agile_type, records):
+        return await self.call(self.client.post_many, agile_type, records)
+
+    async def put(self, agile_type, agile_id, data):
+        await self.call(self.client.put, agile_type, agile_id, data)
+
+    async def delete(self, agile_type, agile_id):
+        future = self.client.batchers["delete"].submit(agile_type, agile_id)
+        await asyncio.wrap_future(future)
+
+    async def delete_many(self, agile_type, agile_ids):
+        await self.call(self.client.delete_many, agile_type, agile_ids)
+
+    async def upsert(self, agile_type, data):
+        return await self.call(self.client.upsert, agile_type, data)
+
+    async def patch(self, sql):
+        return await self.call(self.client.patch, sql)
+
+    async def summary(self, agile_type, name):
+        return await self.call(self.client.summary, agile_type, name)
+
+    async def close(self):
+        await self.call(self.client.close)
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, error_type, error, traceback):
+        await self.close()
+        return False
@@ -0,0 +1,112 @@
+import json
+import threading
+
+
+class Flight:
+    """
+    A GET executing for all identical requests which arrived meanwhile.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AgileCoalescer:
+    """
+    Lets identical concurrent GETs share one execution.
+
+    Requests are identical if their normalized bodies are equal. The first
+    request of a body executes the query, requests arriving while it runs
+    wait for its serialized result instead of executing the same SQL again.
+    Followers wait at most ``maxWait`` seconds and execute the query
+    themselves afterwards.
+
+    The executions are kept per type. A committed write of a type
+    invalidates them, so requests arriving after the write never get a
+    result read before it. Requests which already wait keep the result of
+    the running execution, they arrived before the write completed.
+    """
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def get_options(self):
+        """
+        Returns the coalesce setting of the server or None if disabled.
+        """
+        server = self.database.config.get("server") or {}
+        options = server.get("coalesce")
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        return options
+
+    def create_key(self, json_object):
+        """
+        Normalizes the body of a GET, the order of its keys doesn't matter.
+        """
+        return json.dumps(json_object, sort_keys=True, separators=(",", ":"), default=str)
+
+    def run(self, json_object, execute):
+        """
+        Executes a GET or waits for the identical GET which is running.
+
+        Args:
+            json_object (dict): The body of the GET.
+            execute (function): Executes the GET and returns its result.
+
+        Returns:
+            obj: The result of the execution.
+        """
+        options = self.get_options()
+        if options is None:
+            return execute()
+        agile_type = json_object.get("type")
+        key = self.create_key(json_object)
+        with self.lock:
+            flights = self.flights.setdefault(agile_type, {})
+            flight = flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                flights[key] = flight
+        if not leader:
+            if flight.done.wait(float(options.get("maxWait", 5))):
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+            return execute()
+        try:
+            flight.result = execute()
+            return flight.result
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self.lock:
+                flights = self.flights.get(agile_type) or {}
+                if flights.get(key) is flight:
+                    del flights[key]
+                    if len(flights) == 0:
+                        del self.flights[agile_type]
+            flight.done.set()
+
+    def invalidate(self, agile_type=None):
+        """
+        Stops new requests from joining the running GETs of a type, of all
+        types without a type. Called after a write is committed.
+        """
+        with self.lock:
+            if agile_type is None:
+                self.flights = {}
+            else:
+                self.flights.pop(agile_type, None)
@@ -0,0 +1,237 @@
+import datetime
+import decimal
+import functools
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ChunkSink:
+    """
+    File object collecting the bytes written by an Arrow writer until
+    they are taken for the response.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class AgileColumnar:
+    """
+    Returns GET results as Arrow IPC stream or Parquet file.
+
+    Every requested column is selected as its own typed SQL expression,
+    so the rows are fetched as plain tuples in batches and turned into
+    Arrow arrays column by column without building a dict per row. The
+    Arrow types are taken from the declared types of the columns and
+    fields, undeclared fields are strings. Every fetched batch becomes
+    one record batch of the stream or one row group of the Parquet file.
+
+    Needs the pyarrow package.
+    """
+
+    formats = {
+        "arrow": "application/vnd.apache.arrow.stream",
+        "parquet": "application/vnd.apache.parquet",
+    }
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+
+    def is_columnar(self, json_object):
+        """
+        Checks if a GET request asks for a columnar format.
+        """
+        return isinstance(json_object, dict) and \
+            json_object.get("format") in self.formats
+
+    def get_content_type(self, data_format):
+        """
+        Returns the content type of a format.
+        """
+        return self.formats[data_format]
+
+    def get_arrow_type(self, declared_type):
+        """
+        Maps a declared column type to an Arrow type.
+        """
+        if declared_type is None:
+            return pyarrow.string()
+        declared_type = declared_type.strip().upper().split("(")[0].strip()
+        if declared_type in ["INTEGER", "INT", "BIGINT", "SMALLINT"]:
+            return pyarrow.int64()
+        if declared_type in ["FLOAT", "DOUBLE", "DOUBLE PRECISION", "REAL"]:
+            return pyarrow.float64()
+        if declared_type in ["NUMERIC", "DECIMAL"]:
+            return pyarrow.decimal128(38, 10)
+        if declared_type in ["BOOL", "BOOLEAN", "BIT"]:
+            return pyarrow.bool_()
+        if declared_type == "DATE":
+            return pyarrow.date32()
+        if declared_type in ["DATETIME", "DATETIME2", "TIMESTAMP"]:
+            return pyarrow.timestamp("us")
+        if declared_type == "TIME":
+            return pyarrow.time64("us")
+        return pyarrow.string()
+
+    def create_schema(self, columns):
+        """
+        Creates the Arrow schema of the compiled columns.
+        """
+        return pyarrow.schema([
+            pyarrow.field(name, self.get_arrow_type(declared_type))
+            for name, expression, declared_type in columns
+        ])
+
+    def convert_value(self, value, arrow_type):
+        """
+        Converts a value read as text, e.g. an undeclared cast on MariaDB,
+        to the Python type of an Arrow type.
+        """
+        if value is None:
+            return None
+        if pyarrow.types.is_string(arrow_type):
+            return value if isinstance(value, str) else str(value)
+        if not isinstance(value, str):
+            return value
+        if pyarrow.types.is_integer(arrow_type):
+            return int(value)
+        if pyarrow.types.is_floating(arrow_type):
+            return float(value)
+        if pyarrow.types.is_decimal(arrow_type):
+            return decimal.Decimal(value)
+        if pyarrow.types.is_boolean(arrow_type):
+            return value.lower() in ["true", "1"]
+        if pyarrow.types.is_date(arrow_type):
+            return datetime.date.fromisoformat(value[:10])
+        if pyarrow.types.is_timestamp(arrow_type):
+            return datetime.datetime.fromisoformat(value.replace("Z", ""))
+        if pyarrow.types.is_time(arrow_type):
+            return datetime.time.fromisoformat(value)
+        return value
+
+    def create_array(self, values, arrow_type):
+        """
+        Builds the Arrow array of one column of a batch. The values are only
+        converted one by one if the driver returned them as text.
+        """
+        if pyarrow.types.is_string(arrow_type) or any(
+                isinstance(value, str) for value in values):
+            values = [self.convert_value(value, arrow_type) for value in values]
+        return pyarrow.array(values, type=arrow_type)
+
+    def create_batch(self, rows, schema):
+        """
+        Builds one record batch from the fetched rows.
+        """
+        columns = list(zip(*rows))
+        return pyarrow.RecordBatch.from_arrays([
+            self.create_array(list(values), field.type)
+            for values, field in zip(columns, schema)
+        ], schema=schema)
+
+    def create_projection(self, json_object):
+        """
+        Compiles the columns of a request into the selected expressions.
+
+        Returns:
+            tuple: The compiled columns and the SQL string of the projection.
+        """
+        agile_type = json_object["type"]
+        columns = self.database.query.compile_columns(
+            agile_type, self.database.get_from_json("columns", json_object)
+        )
+        if self.database.storage.is_stripped(agile_type):
+            document = self.database.storage.create_document_expression(
+                agile_type, self.database.get_table_name(agile_type)
+            )
+            columns = [
+                (name, "CAST(" + document + " AS TEXT)", declared_type)
+                if name == "data" else (name, expression, declared_type)
+                for name, expression, declared_type in columns
+            ]
+        projection = ", ".join(
+            expression + " AS agile_c" + str(index)
+            for index, (name, expression, declared_type) in enumerate(columns)
+        )
+        return columns, projection
+
+    def get(self, json_object):
+        """
+        Selects the records of a GET request in a columnar format.
+
+        Args:
+            json_object (dict): The GET request with the format arrow or
+            parquet, the columns, where, search, limit and batch_size.
+
+        Returns:
+            function: Streams the binary chunks of the result from a
+            connection.
+
+        Raises:
+            ValueError: If pyarrow is not installed or the format is unknown.
+        """
+        if pyarrow is None:
+            raise ValueError("The arrow and parquet formats need pyarrow")
+        data_format = json_object.get("format")
+        if data_format not in self.formats:
+            raise ValueError("Format not supported: " + str(data_format))
+        columns, projection = self.create_projection(json_object)
+        sql, sql_tuple = self.database.create_get_sql(json_object, projection)
+        return functools.partial(
+            self.stream, sql, sql_tuple, self.create_schema(columns), data_format,
+            int(json_object.get("batch_size", 10000))
+        )
+
+    def stream(self, sql, sql_tuple, schema, data_format, batch_size, connection):
+        """
+        Fetches the rows in batches and writes every batch to the result.
+        """
+        sink = ChunkSink()
+        cursor = self.database.bulk.open_stream_cursor(connection)
+        try:
+            cursor.execute(sql, sql_tuple)
+            if data_format == "parquet":
+                writer = pyarrow.parquet.ParquetWriter(sink, schema)
+            else:
+                writer = pyarrow.ipc.new_stream(sink, schema)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if len(rows) == 0:
+                    break
+                writer.write_batch(self.create_batch(rows, schema))
+                yield sink.take()
+            writer.close()
+            yield sink.take()
+        finally:
+            cursor.close()
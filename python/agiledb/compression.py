@@ -0,0 +1,274 @@
+import functools
+import tempfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class DecompressionError(Exception):
+    pass
+
+
+class RequestBody:
+    """
+    Reads a request body up to its Content-Length.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        if size == 0:
+            return b""
+        chunk = self.stream.read(size)
+        if not chunk:
+            self.remaining = 0
+        else:
+            self.remaining -= len(chunk)
+        return chunk
+
+
+class AgileCompression:
+    """
+    WSGI middleware compressing responses and decompressing request bodies.
+
+    Responses are compressed with zstd or gzip as negotiated through
+    Accept-Encoding. Bodies smaller than ``minSize`` stay uncompressed.
+    Streamed responses are compressed chunk by chunk and flushed after
+    every chunk, so streams keep arriving while they are produced.
+
+    Request bodies with Content-Encoding gzip or zstd are decompressed
+    into a spooled temporary file before the application reads them.
+    zstd is only offered if the zstandard package is installed.
+    """
+
+    # The size of the read chunks and of the decompressed parts of the body
+    chunk_size = 64 * 1024
+    compressible_types = [
+        "application/json",
+        "application/x-ndjson",
+        "text/",
+    ]
+
+    def __init__(self, app, options=None):
+        """
+        Args:
+            app (function): The WSGI application.
+            options (dict): The compression setting of the server.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        self.app = app
+        self.min_size = int(options.get("minSize", 1024))
+        self.level = int(options.get("level", 6))
+        self.max_request_size = int(
+            options.get("maxRequestSize", 1024 * 1024 * 1024)
+        )
+        encodings = options.get("encodings", ["zstd", "gzip"])
+        self.encodings = [
+            encoding for encoding in encodings
+            if encoding == "gzip" or
+            (encoding == "zstd" and zstandard is not None)
+        ]
+
+    def __call__(self, environ, start_response):
+        try:
+            self.decompress_request(environ)
+        except DecompressionError as error:
+            start_response("400 Bad Request", [
+                ("Content-Type", "text/plain; charset=utf-8")
+            ])
+            return [str(error).encode("utf-8")]
+        encoding = self.negotiate(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return self.app(environ, start_response)
+        state = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            state["status"] = status
+            state["headers"] = headers
+            state["exc_info"] = exc_info
+            return lambda data: None
+
+        body = self.app(environ, capture_start_response)
+        return self.compress_response(body, state, encoding, start_response)
+
+    def negotiate(self, accept_encoding):
+        """
+        Picks the first configured encoding accepted by the client.
+
+        Returns:
+            str: gzip, zstd or None.
+        """
+        accepted = {}
+        for part in accept_encoding.split(","):
+            values = part.strip().split(";")
+            name = values[0].strip().lower()
+            if name == "":
+                continue
+            quality = 1.0
+            for value in values[1:]:
+                value = value.strip()
+                if value.startswith("q="):
+                    try:
+                        quality = float(value[2:])
+                    except ValueError:
+                        quality = 0.0
+            accepted[name] = quality
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if quality > 0:
+                return encoding
+        return None
+
+    def is_compressible(self, headers):
+        """
+        Checks the content type and existing encoding of a response.
+        """
+        content_type = ""
+        for name, value in headers:
+            name = name.lower()
+            if name == "content-encoding":
+                return False
+            if name == "content-type":
+                content_type = value.lower()
+        return any(
+            content_type.startswith(compressible)
+            for compressible in self.compressible_types
+        )
+
+    def create_compressor(self, encoding):
+        """
+        Creates a streaming compressor.
+
+        Returns:
+            tuple: The compress and the flush function.
+        """
+        if encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self.level) \
+                .compressobj()
+            return compressor.compress, \
+                lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), \
+                compressor.flush
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress, \
+            lambda: compressor.flush(zlib.Z_SYNC_FLUSH), \
+            compressor.flush
+
+    def compress_response(self, body, state, encoding, start_response):
+        """
+        Compresses the body of a response if it is large enough.
+        """
+        headers = state["headers"]
+        sized = isinstance(body, (list, tuple))
+        if not self.is_compressible(headers) or \
+                (sized and sum(len(chunk) for chunk in body) < self.min_size):
+            start_response(state["status"], headers, state["exc_info"])
+            return body
+        headers = [
+            (name, value) for name, value in headers
+            if name.lower() != "content-length"
+        ]
+        headers.append(("Content-Encoding", encoding))
+        headers.append(("Vary", "Accept-Encoding"))
+        start_response(state["status"], headers, state["exc_info"])
+        if sized:
+            compress, flush, finish = self.create_compressor(encoding)
+            data = b"".join(compress(chunk) for chunk in body) + finish()
+            return [data]
+        return self.compress_stream(body, encoding)
+
+    def compress_stream(self, body, encoding):
+        """
+        Compresses a streamed body and flushes after every chunk.
+        """
+        compress, flush, finish = self.create_compressor(encoding)
+        try:
+            for chunk in body:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                data = compress(chunk) + flush()
+                if len(data) > 0:
+                    yield data
+            yield finish()
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    def create_decompressor(self, encoding):
+        """
+        Creates a streaming decompressor. It reads a body and yields the
+        decompressed data in parts of at most chunk_size bytes, so a small
+        compressed chunk never expands at once.
+
+        Raises:
+            DecompressionError: If the encoding is not supported.
+        """
+        if encoding == "gzip":
+            return functools.partial(self.inflate, zlib.decompressobj(47))
+        if encoding == "deflate":
+            return functools.partial(self.inflate, zlib.decompressobj())
+        if encoding == "zstd" and zstandard is not None:
+            return functools.partial(
+                zstandard.ZstdDecompressor().read_to_iter,
+                read_size=self.chunk_size,
+                write_size=self.chunk_size
+            )
+        raise DecompressionError("Content-Encoding not supported: " + encoding)
+
+    def inflate(self, decompressor, body):
+        """
+        Decompresses a gzip or deflate body part by part. The input a part
+        doesn't consume is kept in unconsumed_tail for the next one.
+        """
+        while True:
+            chunk = body.read(self.chunk_size)
+            if not chunk:
+                return
+            while True:
+                data = decompressor.decompress(chunk, self.chunk_size)
+                yield data
+                chunk = decompressor.unconsumed_tail
+                if not chunk and len(data) < self.chunk_size:
+                    break
+
+    def decompress_request(self, environ):
+        """
+        Replaces a compressed request body with the decompressed body.
+
+        Raises:
+            DecompressionError: If the body can't be decompressed or gets
+            larger than maxRequestSize.
+        """
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ["", "identity"]:
+            return
+        decompress = self.create_decompressor(encoding)
+        request_body = RequestBody(
+            environ["wsgi.input"], int(environ.get("CONTENT_LENGTH") or 0)
+        )
+        body = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        size = 0
+        try:
+            for data in decompress(request_body):
+                size += len(data)
+                if size > self.max_request_size:
+                    raise DecompressionError("Request body too large")
+                body.write(data)
+        except (zlib.error, ValueError) as error:
+            raise DecompressionError("Invalid request body: " + str(error))
+        except Exception as error:
+            if zstandard is not None and \
+                    isinstance(error, zstandard.ZstdError):
+                raise DecompressionError("Invalid request body: " + str(error))
+            raise
+        body.seek(0)
+        environ["wsgi.input"] = body
+        environ["CONTENT_LENGTH"] = str(size)
+        del environ["HTTP_CONTENT_ENCODING"]
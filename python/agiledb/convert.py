@@ -0,0 +1,197 @@
+import base64
+import datetime
+import decimal
+import uuid
+
+
+def convert_decimal(value):
+    """
+    Converts a decimal to an integer if it has no fraction, otherwise to a
+    float, e.g. the sums of integers Postgres returns as NUMERIC. JSON has
+    no Infinity and NaN, they are converted to None.
+    """
+    if not value.is_finite():
+        return None
+    if value == value.to_integral_value():
+        return int(value)
+    return float(value)
+
+
+def convert_time(value):
+    return value.isoformat()
+
+
+def convert_timedelta(value):
+    return value.total_seconds()
+
+
+def convert_binary(value):
+    return base64.b64encode(bytes(value)).decode("ascii")
+
+
+class AgileRowConverter:
+    """
+    Converts the values of result rows JSON can't serialize.
+
+    The plan of a result set is built once: its columns are taken from the
+    cursor description and the type of every column from its type code,
+    where the code tells the type of the values of the driver, otherwise
+    from its first value which is not NULL. Only the columns of types JSON
+    can't serialize are in the plan, with their conversion, and only those
+    cells are touched. A result without UUIDs, decimals, times or binary
+    values is returned as it is. The drivers return rows as dicts, tuple
+    rows are converted to lists.
+    """
+
+    converters = {
+        uuid.UUID: str,
+        decimal.Decimal: convert_decimal,
+        datetime.datetime: convert_time,
+        datetime.date: convert_time,
+        datetime.time: convert_time,
+        datetime.timedelta: convert_timedelta,
+        bytes: convert_binary,
+        bytearray: convert_binary,
+        memoryview: convert_binary,
+    }
+    # The conversions of the type codes of the drivers. Codes missing here,
+    # e.g. of MariaDB TIME (timedelta) or MSSQL BINARY (bytes or UUIDs),
+    # are looked up from their values.
+    type_code_converters = {
+        "postgres": {
+            17: convert_binary,
+            1082: convert_time,
+            1083: convert_time,
+            1114: convert_time,
+            1184: convert_time,
+            1186: convert_timedelta,
+            1266: convert_time,
+            1700: convert_decimal,
+            2950: str,
+        },
+        "mariaDb": {
+            0: convert_decimal,
+            7: convert_time,
+            10: convert_time,
+            12: convert_time,
+            246: convert_decimal,
+        },
+        "mssql": {
+            4: convert_time,
+            5: convert_decimal,
+        },
+    }
+    # The type codes of values JSON serializes: text, numbers, booleans and
+    # JSON
+    plain_type_codes = {
+        "postgres": {16, 18, 19, 20, 21, 23, 25, 26, 114, 700, 701, 1042, 1043, 3802},
+        "mariaDb": {1, 2, 3, 4, 5, 8, 9, 13},
+        "mssql": {1, 3},
+    }
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The database of the results.
+        """
+        self.database = database
+
+    def get_converter(self, value):
+        """
+        Returns the conversion of the type of a value, None if JSON
+        serializes it.
+        """
+        value_type = type(value)
+        if value_type in self.converters:
+            return self.converters[value_type]
+        if isinstance(value, (str, int, float, bool, list, dict)):
+            return None
+        for converter_type, converter in self.converters.items():
+            if isinstance(value, converter_type):
+                return converter
+        return None
+
+    def get_keys(self, rows, description=None):
+        """
+        Returns the keys of the columns of the rows, the names for dict rows
+        and the positions for tuple rows. Columns of the same name share
+        one key of a dict row, so only the first of them is kept.
+        """
+        if isinstance(rows[0], dict):
+            if description is not None:
+                return list(dict.fromkeys(column[0] for column in description))
+            return list(rows[0])
+        return list(range(len(rows[0])))
+
+    def get_type_codes(self, rows, description):
+        """
+        Returns the type code of every key of the rows. A dict row keeps the
+        value of the last column of a name.
+        """
+        if isinstance(rows[0], dict):
+            return {column[0]: column[1] for column in description}
+        return {index: column[1] for index, column in enumerate(description)}
+
+    def create_plan(self, rows, description=None):
+        """
+        Finds the columns of a result set which need a conversion.
+
+        Args:
+            rows (list): The rows of the result set.
+            description (tuple): The description of the cursor.
+
+        Returns:
+            list: The key and the conversion of every such column.
+        """
+        if len(rows) == 0:
+            return []
+        unresolved = self.get_keys(rows, description)
+        plan = []
+        if description is not None:
+            converters = self.type_code_converters.get(self.database.type, {})
+            plain = self.plain_type_codes.get(self.database.type, set())
+            codes = self.get_type_codes(rows, description)
+            remaining = []
+            for key in unresolved:
+                if codes.get(key) in converters:
+                    plan.append((key, converters[codes[key]]))
+                elif codes.get(key) not in plain:
+                    remaining.append(key)
+            unresolved = remaining
+        for row in rows:
+            if len(unresolved) == 0:
+                break
+            remaining = []
+            for key in unresolved:
+                value = row[key]
+                if value is None:
+                    remaining.append(key)
+                    continue
+                converter = self.get_converter(value)
+                if converter is not None:
+                    plan.append((key, converter))
+            unresolved = remaining
+        return plan
+
+    def convert(self, rows, description=None):
+        """
+        Converts the values of a result set in place.
+
+        Args:
+            rows (list): The rows of the result set.
+            description (tuple): The description of the cursor.
+
+        Returns:
+            list: The converted rows.
+        """
+        plan = self.create_plan(rows, description)
+        if len(plan) == 0:
+            return rows
+        if not isinstance(rows[0], dict):
+            rows = [list(row) for row in rows]
+        for row in rows:
+            for key, converter in plan:
+                value = row[key]
+                if value is not None:
+                    row[key] = converter(value)
+        return rows
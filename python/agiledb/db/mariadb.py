@@ -1,294 +1,574 @@
-import mariadb
-
-class AgileMariaDb:
-    def __init__(self, config, config_database):
-        """
-        Initialize the AgileMariaDb class with configuration and database configuration.
-
-        Parameters:
-        config (dict): The configuration dictionary.
-        config_database (dict): The database configuration dictionary.
-        """
-        self.connection = None
-        self.cursor = None
-        self.type = None
-        self.host = None
-        self.port = None
-        self.name = None    
-        self.user = None
-        self.password = None
-        self.config = config
-        self.config_database = config_database 
-
-    def configure_maria_db(self):
-        """
-        Configure the MariaDB database using the provided configuration.
-        """
-        self.host = self.config_database["host"]
-        try:
-            self.port = int(self.config_database["port"])
-        except ValueError:
-            print(f"Invalid port number: {self.config_database['port']}")
-            self.port = None  # or set a default port number
-        self.name = self.config_database["name"]
-        self.user = self.config_database["user"]
-        self.password = self.config_database["password"]
-        conn_params = {
-            "user" : self.user,
-            "password" : self.password,
-            "host" : self.host,
-            "database" : self.name,
-            "port":self.port,
-        }
-
-        self.connection = mariadb.connect(**conn_params)
-        self.cursor = self.connection.cursor(dictionary=True)
-        self.initialize_database_maria_db()
-        self.initialize_maria_db_tables()
-        self.initialize_maria_db_types()
-        self.initialize_maria_db_types_columns()
-        self.initialize_maria_db_types_indexes()
-
-    def execute_and_commit(self, sql):
-        """
-        Execute the given SQL query and commit the transaction.
-
-        Parameters:
-        sql (str): The SQL query to execute.
-        """
-        self.cursor.execute(sql)
-        self.connection.commit()
-
-    def create_create_main_table_sql_string(self):
-        """
-        Create an SQL query string for creating the main table.
-        """
-        return """CREATE TABLE IF NOT EXISTS agile_main ( 
-            agile_id UUID NOT NULL DEFAULT UUID() primary key,
-            agile_type TEXT,
-            data JSON
-        );"""
-
-    def initialize_database_maria_db(self):
-        """
-        Initialize the MariaDB database by creating the main table.
-        """
-        sql = self.create_create_main_table_sql_string()
-        self.execute_and_commit(sql)
-        
-    def create_create_table_string(self, table):
-        """
-        Create an SQL query string for creating a table.
-
-        Parameters:
-        table (str): The name of the table.
-        """
-        return f"""CREATE TABLE IF NOT EXISTS agile_{table} ( 
-                agile_id UUID NOT NULL DEFAULT UUID() primary key,
-                agile_type TEXT,
-                data JSON);"""
-
-    def initialize_maria_db_tables(self):
-        """
-        Initialize the MariaDB tables as per the configuration.
-        """
-        if self.config['tables'] is None:
-            return
-            
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            sql = self.create_create_table_string(table)
-            self.execute_and_commit(sql)
-        
-    def initialize_maria_db_types(self):
-        """
-        Initialize the MariaDB types as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-            
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            type_table = self.get_type_table(db_type)
-            db_type_object["table"] = type_table
-            self.move_types_to_right_table(type_table, db_type)
-
-    def create_get_column_name_string(self, change_table):
-        """
-        Create an SQL query string to get all column names of a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        """
-        return f"""SELECT column_name 
-        FROM information_schema.columns
-        WHERE TABLE_NAME = '{change_table}'"""
-
-    def get_all_column_names(self, change_table):
-        """
-        Get all column names of a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        """
-        column_sql = self.create_get_column_name_string(change_table)
-        self.execute_and_commit(column_sql)
-        all_columns = self.cursor.fetchall()
-        all_columns_list = []
-        for item in all_columns :
-            all_columns_list.append(item['column_name'])
-        return all_columns_list
-
-    def create_add_column_sql(self, change_table, column, column_type):
-        """
-        Create an SQL query string to add a new column to a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        column (str): The name of the column.
-        column_type (str): The type of the column.
-        """
-        return f"""ALTER TABLE {change_table} 
-        ADD COLUMN IF NOT EXISTS {column} {column_type} as (JSON_VALUE(data,'$.{column}')) STORED;"""
-    
-    def create_column_update_sql(self, change_table, column, column_type):
-        """
-        Create an SQL query string to update a column in a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        column (str): The name of the column.
-        column_type (str): The type of the column.
-        """
-        return f"""UPDATE {change_table} SET
-        {column} = CAST(JSON_VALUE(data,'$.{column}') AS {column_type})"""  
-
-    def change_table_columns_due_to_config(self, db_type_object):
-        """
-        Change the table columns as per the configuration.
-
-        Parameters:
-        db_type_object (dict): The database type object from the configuration.
-        """
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        columns = db_type_object['columns']
-        all_columns = self.get_all_column_names(change_table)
-        for column, column_type in columns.items():
-            if column not in all_columns:
-                sql = self.create_add_column_sql(change_table, column, column_type)
-                print(sql)
-                self.execute_and_commit(sql)
-
-    def initialize_maria_db_types_columns(self):
-        """
-        Initialize the MariaDB types columns as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            self.change_table_columns_due_to_config(db_type_object)
-
-    def create_index_sql(self, change_table, index):
-        """
-        Create an SQL query string to create an index.
-
-        Parameters:
-        change_table (str): The name of the table.
-        index (str): The name of the index.
-        """
-        index_name = index.replace(",","_") 
-        return f"""CREATE INDEX IDX_{change_table}{index_name} ON {change_table}(agile_id)"""
-        
-    def create_maria_db_indices(self, db_type, db_type_object):
-        """
-        Create MariaDB indices for a type.
-
-        Parameters:
-        db_type (str): The database type.
-        db_type_object (dict): The database type object from the configuration.
-        """
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        indices = db_type_object['indices']
-        for index, index_string in indices.items():
-            sql = self.create_index_sql(change_table, index)     
-            try:
-                self.execute_and_commit(sql)
-            except mariadb.Error as e:
-                print("Index already exists or an Error occured: ",e)
-            
-    def initialize_maria_db_types_indexes(self):
-        """
-        Initialize the MariaDB types indices as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            self.create_maria_db_indices(db_type, db_type_object)
-    
-    def create_agile_table_sql(self):
-        """
-        Create an SQL query string to select all tables that start with 'agile_' and do not end with '_index'.
-        """
-        return """select * from information_schema.tables 
-        where table_name like 'agile_%' 
-        and table_name not like '%_index'"""
-
-    def create_insert_agile_data_sql(self, type_table, agile_table):
-        """
-        Create an SQL query string to insert data from one table to another.
-
-        Parameters:
-        type_table (str): The name of the table to insert data into.
-        agile_table (str): The name of the table to get data from.
-        """
-        return f"""INSERT INTO {str(type_table)}
-        (agile_id, agile_type, data) 
-        SELECT agile_id, agile_type, data FROM {agile_table['TABLE_NAME']}                
-        WHERE agile_type=%s"""
-
-    def move_types_to_right_table(self, type_table, db_type):
-        """
-        Move types to the right table.
-
-        Parameters:
-        type_table (str): The name of the table to move types to.
-        db_type (str): The database type.
-        """
-        if type_table == None:
-            return 
-        sql = self.create_agile_table_sql()
-        self.execute_and_commit(sql)
-        self.cursor.execute(sql)
-        agile_tables = self.cursor.fetchall()
-        for agile_table in agile_tables:
-            if type_table != agile_table['TABLE_NAME']:
-                sql = self.create_insert_agile_data_sql(type_table, agile_table)
-                print(sql)
-                self.cursor.execute(sql, (db_type,))
-                sql = f"""Delete FROM {agile_table['TABLE_NAME']} WHERE agile_type=%s"""
-                self.cursor.execute(sql, (db_type,))
-                self.connection.commit()
-
-    def get_type_table(self, requested_type):
-        """
-        Get the table of a requested type.
-
-        Parameters:
-        requested_type (str): The requested type.
-        """
-        if self.config['tables'] == None:
-            return None
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            types = table_object['types']
-            for table_type, table_object in types.items():
-                if table_type == requested_type:
+import mariadb
+from agiledb.query import AgileQuery
+from agiledb.summary import AgileSummary
+from agiledb.schema import AgileSchema
+from agiledb.storage import AgileStorage
+
+class AgileMariaDb:
+    def __init__(self, config, config_database):
+        """
+        Initialize the AgileMariaDb class with configuration and database configuration.
+
+        Parameters:
+        config (dict): The configuration dictionary.
+        config_database (dict): The database configuration dictionary.
+        """
+        self.connection = None
+        self.cursor = None
+        self.type = None
+        self.host = None
+        self.port = None
+        self.name = None    
+        self.user = None
+        self.password = None
+        self.config = config
+        self.config_database = config_database 
+        self.query = AgileQuery(config, "mariaDb")
+        self.summary = AgileSummary(self.query)
+        self.schema = AgileSchema(config, "mariaDb")
+        self.storage = AgileStorage(self.query)
+        self.online_indexes = False
+        self.ddl = None
+        self.table_columns = None
+
+    def configure_maria_db(self):
+        """
+        Configure the MariaDB database using the provided configuration.
+        Provisioning is skipped if the stored schema fingerprint matches the configuration, otherwise the
+        DDL is batched and the new fingerprint is stored at the end.
+        """
+        self.connect_maria_db()
+        fingerprint = self.schema.create_fingerprint()
+        if self.read_schema_fingerprint() == fingerprint:
+            self.initialize_maria_db_types()
+            return
+        self.ddl = []
+        self.initialize_database_maria_db()
+        self.initialize_maria_db_tables()
+        self.initialize_maria_db_types()
+        self.initialize_maria_db_types_columns()
+        self.initialize_maria_db_types_indexes()
+        self.initialize_maria_db_types_search()
+        self.initialize_maria_db_types_summaries()
+        self.initialize_maria_db_types_ttl()
+        self.initialize_maria_db_types_storage()
+        for sql in self.schema.create_save_sql(fingerprint):
+            self.execute_and_commit(sql)
+        self.flush_ddl()
+        self.ddl = None
+
+    def reconfigure_maria_db(self, changes):
+        """
+        Apply only the changed DDL of a reloaded configuration on an own connection, so the server
+        keeps serving requests. Indexes are built with LOCK=NONE, so writes continue during the build.
+
+        Parameters:
+        changes (dict): The changed tables and types of every step, see AgileReload.diff.
+        """
+        self.connect_maria_db()
+        self.online_indexes = True
+        try:
+            self.initialize_maria_db_tables(changes["tables"])
+            self.initialize_maria_db_types()
+            self.initialize_maria_db_types_columns(changes["columns"])
+            self.initialize_maria_db_types_indexes(changes["indexes"])
+            self.initialize_maria_db_types_search(changes["search"])
+            self.initialize_maria_db_types_summaries(changes["summaries"])
+            self.initialize_maria_db_types_ttl(changes["ttl"])
+            self.initialize_maria_db_types_storage(changes["storage"])
+            for sql in self.schema.create_save_sql(self.schema.create_fingerprint()):
+                self.execute_and_commit(sql)
+        finally:
+            self.connection.close()
+
+    def connect_maria_db(self):
+        """
+        Open the connection to the MariaDB database.
+        """
+        self.host = self.config_database["host"]
+        try:
+            self.port = int(self.config_database["port"])
+        except ValueError:
+            print(f"Invalid port number: {self.config_database['port']}")
+            self.port = None  # or set a default port number
+        self.name = self.config_database["name"]
+        self.user = self.config_database["user"]
+        self.password = self.config_database["password"]
+        conn_params = {
+            "user" : self.user,
+            "password" : self.password,
+            "host" : self.host,
+            "database" : self.name,
+            "port":self.port,
+        }
+
+        self.connection = mariadb.connect(**conn_params)
+        self.cursor = self.connection.cursor(dictionary=True)
+
+    def execute_and_commit(self, sql):
+        """
+        Execute the given SQL query and commit the transaction. While the DDL is batched the query
+        is queued until flush_ddl.
+
+        Parameters:
+        sql (str): The SQL query to execute.
+        """
+        if self.ddl is not None:
+            self.ddl.append(sql)
+            return
+        self.cursor.execute(sql)
+        self.connection.commit()
+
+    def flush_ddl(self):
+        """
+        Execute the batched DDL with one commit. MariaDB commits DDL implicitly, so the statements
+        are sent one by one.
+        """
+        if not self.ddl:
+            return
+        statements = self.ddl
+        self.ddl = []
+        for sql in statements:
+            self.cursor.execute(sql)
+        self.connection.commit()
+
+    def read_schema_fingerprint(self):
+        """
+        Read the fingerprint of the provisioned schema, None if the schema was never provisioned.
+        """
+        try:
+            self.cursor.execute(self.schema.create_read_sql())
+            rows = self.cursor.fetchall()
+            self.connection.commit()
+        except mariadb.Error:
+            self.connection.rollback()
+            return None
+        if len(rows) == 0:
+            return None
+        return rows[0]['fingerprint']
+
+    def get_index_option(self):
+        """
+        Return the lock option of CREATE INDEX for online builds.
+        """
+        if self.online_indexes:
+            return " LOCK=NONE"
+        return ""
+
+    def create_create_main_table_sql_string(self):
+        """
+        Create an SQL query string for creating the main table.
+        """
+        return """CREATE TABLE IF NOT EXISTS agile_main ( 
+            agile_id UUID NOT NULL DEFAULT UUID() primary key,
+            agile_type TEXT,
+            data JSON
+        );"""
+
+    def initialize_database_maria_db(self):
+        """
+        Initialize the MariaDB database by creating the main table.
+        """
+        sql = self.create_create_main_table_sql_string()
+        self.execute_and_commit(sql)
+        
+    def create_create_table_string(self, table):
+        """
+        Create an SQL query string for creating a table.
+
+        Parameters:
+        table (str): The name of the table.
+        """
+        return f"""CREATE TABLE IF NOT EXISTS agile_{table} ( 
+                agile_id UUID NOT NULL DEFAULT UUID() primary key,
+                agile_type TEXT,
+                data JSON);"""
+
+    def initialize_maria_db_tables(self, only_tables=None):
+        """
+        Initialize the MariaDB tables as per the configuration.
+
+        Parameters:
+        only_tables (list): Only these tables, all tables if None.
+        """
+        if self.config['tables'] is None:
+            return
+            
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            if only_tables is not None and table not in only_tables:
+                continue
+            sql = self.create_create_table_string(table)
+            self.execute_and_commit(sql)
+        
+    def initialize_maria_db_types(self):
+        """
+        Initialize the MariaDB types as per the configuration. The records of moved
+        types are moved by the AgileMigrator of the server in the background.
+        """
+        if self.config['types'] is None:
+            return
+            
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            type_table = self.get_type_table(db_type)
+            db_type_object["table"] = type_table
+
+    def create_get_column_name_string(self, change_tables):
+        """
+        Create an SQL query string to get all column names of tables.
+
+        Parameters:
+        change_tables (list): The names of the tables.
+        """
+        tables = ",".join(f"'{table}'" for table in change_tables)
+        return f"""SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name 
+        FROM information_schema.columns
+        WHERE TABLE_SCHEMA = DATABASE()
+        AND TABLE_NAME IN ({tables})"""
+
+    def get_all_column_names(self, change_table):
+        """
+        Get all column names of a table. The columns of all tables are read with one query
+        the first time, added columns are remembered afterwards.
+
+        Parameters:
+        change_table (str): The name of the table.
+        """
+        if self.table_columns is None:
+            self.table_columns = {}
+            tables = ["agile_main"] + ["agile_" + table for table in (self.config['tables'] or {})]
+            self.cursor.execute(self.create_get_column_name_string(tables))
+            for item in self.cursor.fetchall():
+                self.table_columns.setdefault(item['table_name'], []).append(item['column_name'])
+            self.connection.commit()
+        return self.table_columns.setdefault(change_table, [])
+
+    def create_add_column_sql(self, change_table, column, column_type):
+        """
+        Create an SQL query string to add a new column to a table.
+
+        Parameters:
+        change_table (str): The name of the table.
+        column (str): The name of the column.
+        column_type (str): The type of the column.
+        """
+        return f"""ALTER TABLE {change_table} 
+        ADD COLUMN IF NOT EXISTS {column} {column_type} as (JSON_VALUE(data,'$.{column}')) STORED;"""
+    
+    def create_column_update_sql(self, change_table, column, column_type):
+        """
+        Create an SQL query string to update a column in a table.
+
+        Parameters:
+        change_table (str): The name of the table.
+        column (str): The name of the column.
+        column_type (str): The type of the column.
+        """
+        return f"""UPDATE {change_table} SET
+        {column} = CAST(JSON_VALUE(data,'$.{column}') AS {column_type})"""  
+
+    def change_table_columns_due_to_config(self, db_type_object):
+        """
+        Change the table columns as per the configuration.
+
+        Parameters:
+        db_type_object (dict): The database type object from the configuration.
+        """
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        columns = db_type_object['columns']
+        all_columns = self.get_all_column_names(change_table)
+        for column, column_type in columns.items():
+            if column not in all_columns:
+                sql = self.create_add_column_sql(change_table, column, column_type)
+                print(sql)
+                self.execute_and_commit(sql)
+                all_columns.append(column)
+
+    def initialize_maria_db_types_columns(self, only_types=None):
+        """
+        Initialize the MariaDB types columns as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.change_table_columns_due_to_config(db_type_object)
+
+    def create_index_column(self, db_type, column):
+        """
+        Create the index part of a promoted column. TEXT columns are indexed
+        with a prefix, since MariaDB can't index them completely.
+
+        Parameters:
+        db_type (str): The database type.
+        column (str): The name of the column.
+        """
+        column = column.strip()
+        columns = self.config['types'][db_type].get('columns') or {}
+        if column not in columns:
+            return None
+        if columns[column].strip().upper() in ["TEXT", "JSON"]:
+            return f"{column}(255)"
+        return column
+
+    def create_index_sql(self, change_table, index, db_type=None):
+        """
+        Create an SQL query string to create an index.
+        MariaDB has no expression indexes, so only promoted columns
+        can be indexed.
+
+        Parameters:
+        change_table (str): The name of the table.
+        index (str): The name of the index.
+        db_type (str): The database type.
+
+        Returns:
+        str: The SQL query string or None if a column is not promoted.
+        """
+        index_name = index.replace(",","_") 
+        index_columns = []
+        for column in index.split(","):
+            index_column = self.create_index_column(db_type, column)
+            if index_column is None:
+                print(f"Index {index} skipped, {column} is no column of {db_type}")
+                return None
+            index_columns.append(index_column)
+        index_columns = ",".join(index_columns)
+        return f"""CREATE INDEX IF NOT EXISTS IDX_{change_table}{index_name} ON {change_table}({index_columns}){self.get_index_option()}"""
+        
+    def create_maria_db_indices(self, db_type, db_type_object):
+        """
+        Create MariaDB indices for a type.
+
+        Parameters:
+        db_type (str): The database type.
+        db_type_object (dict): The database type object from the configuration.
+        """
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        indices = db_type_object['indices']
+        for index, index_string in indices.items():
+            sql = self.create_index_sql(change_table, index, db_type)
+            if sql is None:
+                continue
+            try:
+                self.execute_and_commit(sql)
+            except mariadb.Error as e:
+                print("Index already exists or an Error occured: ",e)
+        natural_key = self.query.get_natural_key(db_type)
+        if natural_key is not None:
+            # The unique index of earlier versions was unique in the whole table
+            self.execute_and_commit(f"DROP INDEX IF EXISTS UIDX_{change_table}{natural_key} ON {change_table}")
+            self.execute_and_commit(self.create_natural_key_column_sql(change_table, db_type, natural_key))
+            sql = self.create_natural_key_index_sql(change_table, db_type)
+            self.execute_and_commit(sql)
+
+    def create_natural_key_column_sql(self, change_table, db_type, natural_key):
+        """
+        Create an SQL query string to add the generated column holding the hashed natural key
+        of a type. MariaDB has no partial indexes, so the column is NULL for the other types.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The database type.
+        natural_key (str): The promoted column of the natural key.
+        """
+        column = self.query.get_natural_key_column(db_type)
+        key_hash = self.query.create_natural_key_hash(db_type, natural_key)
+        return f"""ALTER TABLE {change_table} 
+        ADD COLUMN IF NOT EXISTS {column} CHAR(64) as ({key_hash}) STORED;"""
+
+    def create_natural_key_index_sql(self, change_table, db_type):
+        """
+        Create an SQL query string for the unique index of the hashed natural key of a type,
+        so the whole key is unique within the type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The database type.
+        """
+        column = self.query.get_natural_key_column(db_type)
+        return f"""CREATE UNIQUE INDEX IF NOT EXISTS UIDX_{change_table}{column} ON {change_table}({column}){self.get_index_option()}"""
+            
+    def initialize_maria_db_types_indexes(self, only_types=None):
+        """
+        Initialize the MariaDB types indices as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.create_maria_db_indices(db_type, db_type_object)
+    
+    def create_search_column_sql(self, change_table, db_type):
+        """
+        Create an SQL query string to add the generated column holding the searched
+        fields of a type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The database type.
+        """
+        column = self.query.get_search_column(db_type)
+        document = self.query.create_search_document(db_type)
+        return f"""ALTER TABLE {change_table} 
+        ADD COLUMN IF NOT EXISTS {column} TEXT as ({document}) STORED;"""
+
+    def create_search_index_sql(self, change_table, db_type):
+        """
+        Create an SQL query string to create the FULLTEXT index of the searched fields
+        of a type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The database type.
+        """
+        column = self.query.get_search_column(db_type)
+        return f"""CREATE FULLTEXT INDEX IF NOT EXISTS FT_{change_table}{column} ON {change_table}({column})"""
+
+    def initialize_maria_db_types_search(self, only_types=None):
+        """
+        Initialize the full text search of the MariaDB types as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if self.query.get_search(db_type) is None:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(self.create_search_column_sql(change_table, db_type))
+            self.execute_and_commit(self.create_search_index_sql(change_table, db_type))
+
+    def initialize_maria_db_types_summaries(self, only_types=None):
+        """
+        Initialize the summary tables of the MariaDB types as per the configuration.
+        New summary tables are computed once from the existing records, afterwards triggers keep them up to date.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            for name in self.summary.get_summaries(db_type):
+                self.initialize_maria_db_summary(db_type, name, change_table)
+
+    def initialize_maria_db_summary(self, db_type, name, change_table):
+        """
+        Create the table and the triggers of a summary and compute a new summary while the table
+        of the type is locked with LOCK TABLES. MariaDB commits DDL implicitly, so the lock keeps
+        the writes of a running server out until the triggers exist and the summary is computed.
+
+        Parameters:
+        db_type (str): The database type.
+        name (str): The name of the summary.
+        change_table (str): The table of the type.
+        """
+        self.execute_and_commit(self.summary.create_table_sql(db_type, name))
+        self.flush_ddl()
+        try:
+            for sql in self.summary.create_lock_sql(db_type, name, change_table):
+                self.cursor.execute(sql)
+            self.cursor.execute(self.summary.create_is_empty_sql(db_type, name))
+            is_empty = len(self.cursor.fetchall()) == 0
+            for sql in self.summary.create_trigger_sql(db_type, name, change_table):
+                self.cursor.execute(sql)
+            if is_empty:
+                self.cursor.execute(self.summary.create_populate_sql(db_type, name, change_table))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.cursor.execute("UNLOCK TABLES")
+
+    def initialize_maria_db_types_ttl(self, only_types=None):
+        """
+        Add the expiry column and its index to the tables of the MariaDB types with a ttl.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if not db_type_object.get("ttl"):
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(f"""ALTER TABLE {change_table} ADD COLUMN IF NOT EXISTS agile_expires DATETIME NULL""")
+            self.execute_and_commit(f"""CREATE INDEX IF NOT EXISTS IDX_{change_table}agile_expires ON {change_table}(agile_expires){self.get_index_option()}""")
+
+    def initialize_maria_db_types_storage(self, only_types=None):
+        """
+        Compress the tables of the MariaDB types with a compression. Changing the row format rebuilds the
+        table, so tables which are compressed already are skipped.
+
+        Parameters:
+        only_types (list): Only the tables of these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        for db_type in self.config['types']:
+            # stripColumns is only supported by Postgres
+            self.storage.is_stripped(db_type)
+        for table, (compression, storage) in self.storage.get_table_compressions(only_types).items():
+            self.flush_ddl()
+            self.cursor.execute(self.storage.create_row_format_sql(), (table,))
+            rows = self.cursor.fetchall()
+            self.connection.commit()
+            if len(rows) > 0 and rows[0]['row_format'] == "Compressed":
+                continue
+            self.execute_and_commit(
+                self.storage.create_compression_sql(table, compression, storage, self.online_indexes)
+            )
+
+    def get_type_table(self, requested_type):
+        """
+        Get the table of a requested type.
+
+        Parameters:
+        requested_type (str): The requested type.
+        """
+        if self.config['tables'] == None:
+            return None
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            types = table_object['types']
+            for table_type, table_object in types.items():
+                if table_type == requested_type:
                     return "agile_" + table
\ No newline at end of file
@@ -1,182 +1,372 @@
-import pymssql
-
-class AgileMssql:
-    def __init__(self, config, config_database):
-        self.connection = None
-        self.cursor = None
-        self.type = None
-        self.host = None
-        self.port = None
-        self.name = None    
-        self.user = None
-        self.password = None
-        self.config = config
-        self.config_database = config_database 
-
-    def configure_mssql(self):
-        self.host = self.config_database["host"]
-        self.port = self.config_database["port"]
-        self.name = self.config_database["name"]
-        self.user = self.config_database["user"]
-        self.password = self.config_database["password"]
-        self.connection = pymssql.connect(self.host + ":" + self.port, self.user, self.password, self.name)
-        self.cursor = self.connection.cursor(as_dict=True)
-        self.initialize_database_mssql()
-        self.initialize_mssql_tables()
-        self.initialize_mssql_types()
-        self.initialize_mssql_types_columns()
-        self.initialize_mssql_types_indexes()
-
-    def execute_and_commit(self, sql):
-        self.cursor.execute(sql)
-        self.connection.commit()
-
-    def create_create_main_table_sql_string(self):
-        return """if not exists (select * from sysobjects where name='agile_main' and xtype='U')
-            CREATE TABLE agile_main ( 
-                agile_id uniqueidentifier DEFAULT NEWID(),
-                agile_type nvarchar(max),
-                data nvarchar(max)
-            )"""
-
-    def create_create_main_table_index_sql_string(self):
-        return """IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_NC_id_data')
-        CREATE NONCLUSTERED INDEX IDX_NC_id_data ON agile_main(agile_id) INCLUDE(data)"""
-    
-    def initialize_database_mssql(self):
-        sql = self.create_create_main_table_sql_string()
-        self.execute_and_commit(sql)
-        sql = self.create_create_main_table_index_sql_string()
-        self.execute_and_commit(sql)
-
-    def create_create_table_string(self, table):
-        return f"""if not exists (select * from sysobjects where name='agile_{table}' and xtype='U')
-                CREATE TABLE agile_{table} ( 
-                agile_id uniqueidentifier DEFAULT NEWID(),
-                agile_type nvarchar(max),
-                data  nvarchar(max));"""
-
-    def initialize_mssql_tables(self):
-        if self.config['tables'] is None:
-            return
-            
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            sql = self.create_create_table_string(table)
-            self.execute_and_commit(sql)
-        
-    def initialize_mssql_types(self):
-        if self.config['types'] is None:
-            return
-            
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            type_table = self.get_type_table(db_type)
-            db_type_object["table"] = type_table
-            self.move_types_to_right_table(type_table, db_type)
-
-    def create_get_column_name_string(self, change_table):
-        return f"""SELECT column_name 
-        FROM information_schema.columns
-        WHERE TABLE_NAME = '{change_table}'"""
-
-    def get_all_column_names(self, change_table):
-        column_sql = self.create_get_column_name_string(change_table)
-        print(column_sql)
-        self.execute_and_commit(column_sql)
-        all_columns = self.cursor.fetchall()
-        all_columns_list = []
-        for item in all_columns :
-            all_columns_list.append(item['column_name'])
-        return all_columns_list
-
-    def create_add_column_sql(self, change_table, column, column_type):
-        if column_type == "TEXT":
-            column_type = "nvarchar(max)"
-        return f"""IF COL_LENGTH('{change_table}' , '{column}') IS NULL
-BEGIN
-    ALTER TABLE {change_table} ADD a AS CAST(JSON_VALUE(data,'$.{column}') as {column_type}) PERSISTED
-END"""
-
-    def create_column_update_sql(self, change_table, column, column_type):
-        return f"""UPDATE {change_table} SET
-        {column} = CAST(JSON_VALUE(data,'$.{column}') AS {column_type})"""  
-
-    def change_table_columns_due_to_config(self, db_type_object):
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        columns = db_type_object['columns']
-        all_columns = self.get_all_column_names(change_table)
-        for column, column_type in columns.items():
-            if column not in all_columns:
-                sql = self.create_add_column_sql(change_table, column, column_type)
-                print(sql)
-                self.execute_and_commit(sql)
-
-    def initialize_mssql_types_columns(self):
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            self.change_table_columns_due_to_config(db_type_object)
-
-    def create_index_sql(self, change_table, index):
-        index_name = index.replace(",", "_")
-        return f"""IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_{change_table}{index_name}')
-        CREATE NONCLUSTERED INDEX IDX_{change_table}{index_name} ON {change_table}(agile_id) INCLUDE({index})"""
-
-    def create_mssql_indices(self, db_type, db_type_object):
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        indices = db_type_object['indices']
-        for index, index_string in indices.items():
-            sql = self.create_index_sql(change_table, index)     
-            print(sql)
-            self.execute_and_commit(sql)
-            
-    def initialize_mssql_types_indexes(self):
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type, db_type_object in db_types.items():
-            self.create_mssql_indices(db_type, db_type_object)
-    
-    def create_agile_table_sql(self):
-        return """select * from information_schema.tables 
-        where table_name like 'agile_%' 
-        and table_name not like '%_index'"""
-
-    def create_insert_agile_data_sql(self, type_table, agile_table):
-        return f"""INSERT INTO {str(type_table)}
-        (agile_id, agile_type, data) 
-        SELECT agile_id, agile_type, data FROM {agile_table['TABLE_NAME']}                
-        WHERE agile_type=%s"""
-
-    def move_types_to_right_table(self, type_table, db_type):
-        if type_table == None:
-            return 
-        sql = self.create_agile_table_sql()
-        self.execute_and_commit
-        self.cursor.execute(sql)
-        agile_tables = self.cursor.fetchall()
-        for agile_table in agile_tables:
-            if type_table != agile_table['TABLE_NAME']:
-                sql = self.create_insert_agile_data_sql(type_table, agile_table)
-                self.cursor.execute(sql, (db_type,))
-                sql = f"""Delete FROM {agile_table['TABLE_NAME']} WHERE agile_type=%s"""
-                self.cursor.execute(sql, (db_type,))
-                self.connection.commit()
-
-    def get_type_table(self, requested_type):
-        if self.config['tables'] == None:
-            return None
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            types = table_object['types']
-            for table_type, table_object in types.items():
-                if table_type == requested_type:
+import pymssql
+from agiledb.query import AgileQuery
+from agiledb.summary import AgileSummary
+from agiledb.schema import AgileSchema
+from agiledb.storage import AgileStorage
+
+class AgileMssql:
+    def __init__(self, config, config_database):
+        self.connection = None
+        self.cursor = None
+        self.type = None
+        self.host = None
+        self.port = None
+        self.name = None    
+        self.user = None
+        self.password = None
+        self.config = config
+        self.config_database = config_database 
+        self.query = AgileQuery(config, "mssql")
+        self.summary = AgileSummary(self.query)
+        self.schema = AgileSchema(config, "mssql")
+        self.storage = AgileStorage(self.query)
+        self.online_indexes = False
+        self.ddl = None
+        self.table_columns = None
+
+    def configure_mssql(self):
+        # Provisioning is skipped while the stored fingerprint matches the config
+        self.connect_mssql()
+        fingerprint = self.schema.create_fingerprint()
+        if self.read_schema_fingerprint() == fingerprint:
+            self.initialize_mssql_types()
+            return
+        self.ddl = []
+        self.initialize_database_mssql()
+        self.initialize_mssql_tables()
+        self.initialize_mssql_types()
+        self.initialize_mssql_types_columns()
+        self.initialize_mssql_types_indexes()
+        self.initialize_mssql_types_search()
+        self.initialize_mssql_types_summaries()
+        self.initialize_mssql_types_ttl()
+        self.initialize_mssql_types_storage()
+        for sql in self.schema.create_save_sql(fingerprint):
+            self.execute_and_commit(sql)
+        self.flush_ddl()
+        self.ddl = None
+
+    def reconfigure_mssql(self, changes):
+        # ONLINE index builds need the Enterprise edition, so they are opt-in
+        self.connect_mssql()
+        self.online_indexes = self.config_database.get("onlineIndexes") is True
+        try:
+            self.initialize_mssql_tables(changes["tables"])
+            self.initialize_mssql_types()
+            self.initialize_mssql_types_columns(changes["columns"])
+            self.initialize_mssql_types_indexes(changes["indexes"])
+            self.initialize_mssql_types_search(changes["search"])
+            self.initialize_mssql_types_summaries(changes["summaries"])
+            self.initialize_mssql_types_ttl(changes["ttl"])
+            self.initialize_mssql_types_storage(changes["storage"])
+            for sql in self.schema.create_save_sql(self.schema.create_fingerprint()):
+                self.execute_and_commit(sql)
+        finally:
+            self.connection.close()
+
+    def connect_mssql(self):
+        self.host = self.config_database["host"]
+        self.port = self.config_database["port"]
+        self.name = self.config_database["name"]
+        self.user = self.config_database["user"]
+        self.password = self.config_database["password"]
+        self.connection = pymssql.connect(self.host + ":" + self.port, self.user, self.password, self.name)
+        self.cursor = self.connection.cursor(as_dict=True)
+
+    def get_index_option(self):
+        if self.online_indexes:
+            return " WITH (ONLINE = ON)"
+        return ""
+
+    def execute_and_commit(self, sql):
+        if self.ddl is not None:
+            self.ddl.append(sql)
+            return
+        self.cursor.execute(sql)
+        self.connection.commit()
+
+    def flush_ddl(self):
+        # IF ... BEGIN blocks and triggers need their own batch, so only the commit is shared
+        if not self.ddl:
+            return
+        statements = self.ddl
+        self.ddl = []
+        for sql in statements:
+            self.cursor.execute(sql)
+        self.connection.commit()
+
+    def read_schema_fingerprint(self):
+        try:
+            self.cursor.execute(self.schema.create_read_sql())
+            rows = self.cursor.fetchall()
+            self.connection.commit()
+        except pymssql.Error:
+            self.connection.rollback()
+            return None
+        if len(rows) == 0:
+            return None
+        return rows[0]['fingerprint']
+
+    def create_create_main_table_sql_string(self):
+        return """if not exists (select * from sysobjects where name='agile_main' and xtype='U')
+            CREATE TABLE agile_main ( 
+                agile_id uniqueidentifier DEFAULT NEWID(),
+                agile_type nvarchar(max),
+                data nvarchar(max)
+            )"""
+
+    def create_create_main_table_index_sql_string(self):
+        return """IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_NC_id_data')
+        CREATE NONCLUSTERED INDEX IDX_NC_id_data ON agile_main(agile_id) INCLUDE(data)"""
+    
+    def initialize_database_mssql(self):
+        sql = self.create_create_main_table_sql_string()
+        self.execute_and_commit(sql)
+        sql = self.create_create_main_table_index_sql_string()
+        self.execute_and_commit(sql)
+
+    def create_create_table_string(self, table):
+        return f"""if not exists (select * from sysobjects where name='agile_{table}' and xtype='U')
+                CREATE TABLE agile_{table} ( 
+                agile_id uniqueidentifier DEFAULT NEWID(),
+                agile_type nvarchar(max),
+                data  nvarchar(max));"""
+
+    def initialize_mssql_tables(self, only_tables=None):
+        if self.config['tables'] is None:
+            return
+            
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            if only_tables is not None and table not in only_tables:
+                continue
+            sql = self.create_create_table_string(table)
+            self.execute_and_commit(sql)
+        
+    def initialize_mssql_types(self):
+        if self.config['types'] is None:
+            return
+            
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            type_table = self.get_type_table(db_type)
+            db_type_object["table"] = type_table
+
+    def create_get_column_name_string(self, change_tables):
+        tables = ",".join(f"'{table}'" for table in change_tables)
+        return f"""SELECT TABLE_NAME AS table_name, COLUMN_NAME AS column_name 
+        FROM information_schema.columns
+        WHERE TABLE_NAME IN ({tables})"""
+
+    def get_all_column_names(self, change_table):
+        # The columns of all tables are read once, added columns are remembered
+        if self.table_columns is None:
+            self.table_columns = {}
+            tables = ["agile_main"] + ["agile_" + table for table in (self.config['tables'] or {})]
+            self.cursor.execute(self.create_get_column_name_string(tables))
+            for item in self.cursor.fetchall():
+                self.table_columns.setdefault(item['table_name'], []).append(item['column_name'])
+            self.connection.commit()
+        return self.table_columns.setdefault(change_table, [])
+
+    def is_indexed_column(self, change_table, column):
+        for db_type, db_type_object in (self.config['types'] or {}).items():
+            if (db_type_object.get("table") or "agile_main") != change_table:
+                continue
+            indices = db_type_object.get("indices") or {}
+            if any(column in [name.strip() for name in index.split(",")] for index in indices):
+                return True
+            if self.query.get_natural_key(db_type) == column:
+                return True
+        return False
+
+    def create_add_column_sql(self, change_table, column, column_type):
+        if column_type == "TEXT":
+            # Index keys are limited to 900 bytes, so indexed text columns keep
+            # their first 450 characters; other text columns are unlimited
+            if self.is_indexed_column(change_table, column):
+                column_type = "nvarchar(450)"
+            else:
+                column_type = "nvarchar(max)"
+        return f"""IF COL_LENGTH('{change_table}' , '{column}') IS NULL
+BEGIN
+    ALTER TABLE {change_table} ADD {column} AS CAST(JSON_VALUE(data,'$.{column}') as {column_type}) PERSISTED
+END"""
+
+    def create_column_update_sql(self, change_table, column, column_type):
+        return f"""UPDATE {change_table} SET
+        {column} = CAST(JSON_VALUE(data,'$.{column}') AS {column_type})"""  
+
+    def change_table_columns_due_to_config(self, db_type_object):
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        columns = db_type_object['columns']
+        all_columns = self.get_all_column_names(change_table)
+        for column, column_type in columns.items():
+            if column not in all_columns:
+                sql = self.create_add_column_sql(change_table, column, column_type)
+                print(sql)
+                self.execute_and_commit(sql)
+                all_columns.append(column)
+
+    def initialize_mssql_types_columns(self, only_types=None):
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.change_table_columns_due_to_config(db_type_object)
+
+    def create_index_sql(self, change_table, index):
+        index_name = index.replace(",", "_")
+        return f"""IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_{change_table}{index_name}')
+        CREATE NONCLUSTERED INDEX IDX_{change_table}{index_name} ON {change_table}({index}){self.get_index_option()}"""
+
+    def create_mssql_indices(self, db_type, db_type_object):
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        indices = db_type_object['indices']
+        for index, index_string in indices.items():
+            sql = self.create_index_sql(change_table, index)     
+            print(sql)
+            self.execute_and_commit(sql)
+        natural_key = self.query.get_natural_key(db_type)
+        if natural_key is not None and natural_key not in indices:
+            sql = self.create_index_sql(change_table, natural_key)
+            self.execute_and_commit(sql)
+            
+    def initialize_mssql_types_indexes(self, only_types=None):
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.create_mssql_indices(db_type, db_type_object)
+    
+    def create_search_column_sql(self, change_table, db_type):
+        column = self.query.get_search_column(db_type)
+        document = self.query.create_search_document(db_type)
+        return f"""IF COL_LENGTH('{change_table}' , '{column}') IS NULL
+BEGIN
+    ALTER TABLE {change_table} ADD {column} AS {document} PERSISTED
+END"""
+
+    def create_search_key_index_sql(self, change_table):
+        return f"""IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'UIDX_{change_table}_agile_id')
+        CREATE UNIQUE NONCLUSTERED INDEX UIDX_{change_table}_agile_id ON {change_table}(agile_id)"""
+
+    def create_search_catalog_sql(self):
+        return """IF NOT EXISTS(SELECT * FROM sys.fulltext_catalogs WHERE name = 'agile_catalog')
+        CREATE FULLTEXT CATALOG agile_catalog"""
+
+    def create_search_index_sql(self, change_table, db_type):
+        column = self.query.get_search_column(db_type)
+        fields, language = self.query.get_search(db_type)
+        return f"""IF NOT EXISTS(SELECT * FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('{change_table}'))
+    CREATE FULLTEXT INDEX ON {change_table}({column} LANGUAGE '{language}')
+    KEY INDEX UIDX_{change_table}_agile_id ON agile_catalog WITH CHANGE_TRACKING AUTO
+ELSE IF NOT EXISTS(SELECT * FROM sys.fulltext_index_columns WHERE object_id = OBJECT_ID('{change_table}')
+    AND column_id = COLUMNPROPERTY(OBJECT_ID('{change_table}'), '{column}', 'ColumnId'))
+    ALTER FULLTEXT INDEX ON {change_table} ADD ({column} LANGUAGE '{language}')"""
+
+    def initialize_mssql_types_search(self, only_types=None):
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if self.query.get_search(db_type) is None:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(self.create_search_column_sql(change_table, db_type))
+            self.execute_and_commit(self.create_search_key_index_sql(change_table))
+            # Full text DDL can't run inside a transaction
+            self.flush_ddl()
+            self.connection.autocommit(True)
+            try:
+                self.cursor.execute(self.create_search_catalog_sql())
+                self.cursor.execute(self.create_search_index_sql(change_table, db_type))
+            finally:
+                self.connection.autocommit(False)
+
+    def initialize_mssql_types_summaries(self, only_types=None):
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            for name in self.summary.get_summaries(db_type):
+                self.initialize_mssql_summary(db_type, name, change_table)
+
+    def initialize_mssql_summary(self, db_type, name, change_table):
+        # One transaction holding a shared lock on the table of the type, so no write of a
+        # running server falls between computing the summary and creating its trigger
+        self.flush_ddl()
+        try:
+            for sql in self.summary.create_lock_sql(db_type, name, change_table):
+                self.cursor.execute(sql)
+            self.cursor.execute(self.summary.create_table_sql(db_type, name))
+            self.cursor.execute(self.summary.create_is_empty_sql(db_type, name))
+            is_empty = len(self.cursor.fetchall()) == 0
+            for sql in self.summary.create_trigger_sql(db_type, name, change_table):
+                self.cursor.execute(sql)
+            if is_empty:
+                self.cursor.execute(self.summary.create_populate_sql(db_type, name, change_table))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def initialize_mssql_types_ttl(self, only_types=None):
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type, db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if not db_type_object.get("ttl"):
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(f"""IF COL_LENGTH('{change_table}' , 'agile_expires') IS NULL
+BEGIN
+    ALTER TABLE {change_table} ADD agile_expires DATETIME2 NULL
+END""")
+            self.execute_and_commit(f"""IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_{change_table}agile_expires')
+        CREATE NONCLUSTERED INDEX IDX_{change_table}agile_expires ON {change_table}(agile_expires) WHERE agile_expires IS NOT NULL{self.get_index_option()}""")
+
+    def initialize_mssql_types_storage(self, only_types=None):
+        # The rebuild is skipped by the statement if the table has the compression already,
+        # stripColumns is only supported by Postgres
+        if self.config['types'] is None:
+            return
+        for db_type in self.config['types']:
+            self.storage.is_stripped(db_type)
+        for table, (compression, storage) in self.storage.get_table_compressions(only_types).items():
+            self.execute_and_commit(
+                self.storage.create_compression_sql(table, compression, storage, self.online_indexes)
+            )
+
+    def get_type_table(self, requested_type):
+        if self.config['tables'] == None:
+            return None
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            types = table_object['types']
+            for table_type, table_object in types.items():
+                if table_type == requested_type:
                     return "agile_" + table
\ No newline at end of file
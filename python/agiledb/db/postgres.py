@@ -1,330 +1,692 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-class AgilePostgres:
-    def __init__(self,config,config_database):
-        """
-        Constructor for the AgilePostgres class. Initializes the class with the given configuration and database configuration.
-
-        Parameters:
-        config (dict): The configuration dictionary.
-        config_database (dict): The database configuration dictionary.
-        """
-        self.connection = None
-        self.cursor = None
-        self.type = None
-        self.host = None
-        self.port = None
-        self.name = None    
-        self.user = None
-        self.password = None
-        self.config = config
-        self.config_database = config_database 
-
-    def configure_postgres(self):
-        """
-        Configures the PostgreSQL database using the database configuration provided during initialization.
-        """
-        self.host = self.config_database["host"]
-        self.port = self.config_database["port"]
-        self.name = self.config_database["name"]
-        self.user = self.config_database["user"]
-        self.password = self.config_database["password"]
-        connection_string = f"host={self.host} port={self.port} dbname={self.name} user={self.user} password={self.password}"
-        self.connection = psycopg2.connect(connection_string)
-        self.cursor = self.connection.cursor(cursor_factory=RealDictCursor)
-        self.initialize_database_postgres()
-        self.initialize_postgres_tables()
-        self.initialize_postgres_types()
-        self.initialize_postgres_types_columns()
-        self.initialize_postgres_types_indexes()
-
-    def execute_and_commit(self,sql):
-        """
-        Executes the given SQL query and commits the transaction.
-
-        Parameters:
-        sql (str): The SQL query to execute.
-        """
-        self.cursor.execute(sql)
-        self.connection.commit()
-
-    def create_create_main_table_slql_string(self):
-        """
-        Creates the SQL query string for creating the main table.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return """CREATE TABLE IF NOT EXISTS public.agile_main ( 
-            agile_id uuid DEFAULT gen_random_uuid(),
-            agile_type TEXT,
-            data jsonb
-        );"""
-
-    def create_create_main_table_index_sql_string(self):
-        """
-        Creates the SQL query string for creating an index on the main table.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return """CREATE INDEX IF NOT EXISTS agile_main_data_idx ON public.agile_main ("data");"""
-    
-    def initialize_database_postgres(self):
-        """
-        Initializes the PostgreSQL database by creating the main table and its index.
-        """
-        sql = self.create_create_main_table_slql_string()
-        self.execute_and_commit(sql)
-        sql = self.create_create_main_table_index_sql_string()
-        self.execute_and_commit(sql)
-
-    def create_create_table_string(self,table):
-        """
-        Creates the SQL query string for creating a table.
-
-        Parameters:
-        table (str): The name of the table.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return f"""CREATE TABLE IF NOT EXISTS public.agile_{table} ( 
-                agile_id uuid DEFAULT gen_random_uuid(),
-                agile_type TEXT,
-                data jsonb);"""
-
-    def initialize_postgres_tables(self):
-        """
-        Initializes the tables in the PostgreSQL database as per the configuration.
-        """
-        if self.config['tables'] is None:
-            return
-            
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            sql = self.create_create_table_string(table)
-            self.execute_and_commit(sql)
-        
-    
-    def initialize_postgres_types(self):
-        """
-        Initializes the types in the PostgreSQL database as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-            
-        db_types = self.config['types']
-        for db_type,db_type_object in db_types.items():
-            type_table = self.get_type_table(db_type)
-            db_type_object["table"] = type_table
-            self.move_types_to_right_table(type_table,db_type)
-
-    def print_something(self):
-        print("Something")
-
-    def create_get_column_name_string(self,change_table):
-        """
-        Creates the SQL query string for getting the column names of a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return f"""SELECT column_name 
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        AND table_name = '{change_table}'"""
-
-    def get_all_column_names(self,change_table):
-        """
-        Gets all the column names of a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-
-        Returns:
-        list: The list of column names.
-        """
-        column_sql = self.create_get_column_name_string(change_table)
-        self.execute_and_commit(column_sql)
-        all_columns = self.cursor.fetchall()
-        all_columns_list = []
-        for item in all_columns :
-            all_columns_list.append(item['column_name'])
-        return all_columns_list
-
-    def create_add_column_sql(self,change_table,column,column_type):
-        """
-        Creates the SQL query string for adding a column to a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        column (str): The name of the column.
-        column_type (str): The type of the column.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return f"""ALTER TABLE {change_table} ADD COLUMN IF NOT EXISTS {column} {column_type}
-        GENERATED ALWAYS AS (data->'{column}') STORED;"""
-
-    def create_column_update_sql(self,change_table,column,column_type):
-        """
-        Creates the SQL query string for updating a column in a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        column (str): The name of the column.
-        column_type (str): The type of the column.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return f"""UPDATE {change_table} SET  
-        {column}=CAST(data->>'{column}' AS {column_type})"""  
-  
-    def change_table_columns_due_to_config(self,db_type_object):
-        """
-        Changes the columns of a table due to configuration.
-
-        Parameters:
-        db_type_object (dict): The database type object.
-        """
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        columns = db_type_object['columns']
-        all_columns = self.get_all_column_names(change_table)
-        for column,column_type in columns.items():
-            if column not in all_columns:
-                sql = self.create_add_column_sql(change_table,column,column_type)
-                self.execute_and_commit(sql)
-                #sql = self.create_column_update_sql(change_table,column,column_type)
-                #self.execute_and_commit(sql)
-
-    def initialize_postgres_types_columns(self):
-        """
-        Initializes the columns of the types in the PostgreSQL database as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type,db_type_object in db_types.items():
-            self.change_table_columns_due_to_config(db_type_object)
-
-    def create_index_sql(self,change_table,index):
-        """
-        Creates the SQL query string for creating an index on a table.
-
-        Parameters:
-        change_table (str): The name of the table.
-        index (str): The name of the index.
-
-        Returns:
-        str: The SQL query string.
-        """
-        index_name = index.replace(",","_")
-        index_column_name = index.replace(",","\",\"")    
-        return f"""CREATE INDEX IF NOT EXISTS 
-            {change_table}{index_name}_idx
-            ON public.{change_table} (\"{index_column_name}\")"""
-
-    def create_postgres_indices(self,db_type,db_type_object):
-        """
-        Creates the indices for a type in the PostgreSQL database.
-
-        Parameters:
-        db_type (str): The name of the type.
-        db_type_object (dict): The database type object.
-        """
-        type_table = db_type_object["table"]
-        change_table = "agile_main"
-        if type_table != None:
-            change_table = type_table
-        indices = db_type_object['indices']
-        for index,indexString in indices.items():
-            sql = self.create_index_sql(change_table,index)     
-            self.execute_and_commit(sql)
-            
-    def initialize_postgres_types_indexes(self):
-        """
-        Initializes the indices of the types in the PostgreSQL database as per the configuration.
-        """
-        if self.config['types'] is None:
-            return
-        db_types = self.config['types']
-        for db_type,db_type_object in db_types.items():
-            self.create_postgres_indices(db_type,db_type_object)
-    
-    def create_agile_table_sql(self):
-        """
-        Creates the SQL query string for selecting all tables that start with 'agile_' and do not end with '_index'.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return """select * from information_schema.tables 
-        where table_name like 'agile_%' 
-        and table_name not like '%_index'"""
-
-    def create_insert_agile_data_sql(self,type_table,agile_table):
-        """
-        Creates the SQL query string for inserting data from one table to another.
-
-        Parameters:
-        type_table (str): The name of the target table.
-        agile_table (dict): The source table.
-
-        Returns:
-        str: The SQL query string.
-        """
-        return f"""INSERT INTO {str(type_table)}
-        (agile_id, agile_type, data) 
-        SELECT agile_id, agile_type, data FROM {agile_table['table_name']}                
-        WHERE agile_type=%s"""
-
-    def move_types_to_right_table(self,type_table,db_type):
-        """
-        Moves the types to the right table.
-
-        Parameters:
-        type_table (str): The name of the target table.
-        db_type (str): The name of the type.
-        """
-        if type_table == None:
-            return 
-        sql = self.create_agile_table_sql()
-        self.execute_and_commit
-        self.cursor.execute(sql)
-        agile_tables = self.cursor.fetchall()
-        for agile_table in agile_tables:
-            if type_table != agile_table['table_name']:
-                sql = self.create_insert_agile_data_sql(type_table,agile_table)
-                self.cursor.execute(sql,(db_type,))
-                sql = f"""Delete FROM {agile_table['table_name']} WHERE agile_type=%s"""
-                self.cursor.execute(sql,(db_type,))
-                self.connection.commit()
-
-    def get_type_table(self,requestedType):
-        """
-        Gets the table for a requested type.
-
-        Parameters:
-        requestedType (str): The name of the requested type.
-
-        Returns:
-        str: The name of the table for the requested type.
-        """
-        if self.config['tables'] == None:
-            return None
-        tables = self.config['tables']
-        for table, table_object in tables.items():
-            types = table_object['types']
-            for tableType, table_object in types.items():
-                if tableType == requestedType:
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from agiledb.query import AgileQuery
+from agiledb.summary import AgileSummary
+from agiledb.schema import AgileSchema
+from agiledb.storage import AgileStorage
+
+class AgilePostgres:
+    def __init__(self,config,config_database):
+        """
+        Constructor for the AgilePostgres class. Initializes the class with the given configuration and database configuration.
+
+        Parameters:
+        config (dict): The configuration dictionary.
+        config_database (dict): The database configuration dictionary.
+        """
+        self.connection = None
+        self.cursor = None
+        self.type = None
+        self.host = None
+        self.port = None
+        self.name = None    
+        self.user = None
+        self.password = None
+        self.config = config
+        self.config_database = config_database 
+        self.query = AgileQuery(config, "postgres")
+        self.summary = AgileSummary(self.query)
+        self.schema = AgileSchema(config, "postgres")
+        self.storage = AgileStorage(self.query)
+        self.online_indexes = False
+        self.ddl = None
+        self.table_columns = None
+        self.db_schema = self.query.check_column_name(config_database.get("schema","public"))
+
+    def configure_postgres(self):
+        """
+        Configures the PostgreSQL database using the database configuration provided during initialization.
+        Provisioning is skipped if the stored schema fingerprint matches the configuration, otherwise the
+        DDL is executed in one batch and the new fingerprint is stored with it.
+        """
+        self.connect_postgres()
+        fingerprint = self.schema.create_fingerprint()
+        if self.read_schema_fingerprint() == fingerprint:
+            self.initialize_postgres_types()
+            return
+        self.ddl = []
+        self.initialize_database_postgres()
+        self.initialize_postgres_tables()
+        self.initialize_postgres_types()
+        self.initialize_postgres_types_columns()
+        self.initialize_postgres_types_indexes()
+        self.initialize_postgres_types_search()
+        self.initialize_postgres_types_summaries()
+        self.initialize_postgres_types_ttl()
+        self.initialize_postgres_types_storage()
+        for sql in self.schema.create_save_sql(fingerprint):
+            self.execute_and_commit(sql)
+        self.flush_ddl()
+        self.ddl = None
+
+    def reconfigure_postgres(self,changes):
+        """
+        Applies only the changed DDL of a reloaded configuration on its own connection, so the server
+        keeps serving requests. Indexes are built concurrently and invalid indexes of an earlier
+        failed build are dropped first. The columns of stripped types are turned into plain columns by the
+        server when it swaps the configuration, as writes of the old configuration can't fill them.
+
+        Parameters:
+        changes (dict): The changed tables and types of every step, see AgileReload.diff.
+        """
+        self.connect_postgres()
+        self.online_indexes = True
+        try:
+            self.drop_invalid_indexes()
+            self.initialize_postgres_tables(changes["tables"])
+            self.initialize_postgres_types()
+            self.initialize_postgres_types_columns(changes["columns"])
+            self.initialize_postgres_types_indexes(changes["indexes"])
+            self.initialize_postgres_types_search(changes["search"])
+            self.initialize_postgres_types_summaries(changes["summaries"])
+            self.initialize_postgres_types_ttl(changes["ttl"])
+            self.initialize_postgres_types_storage(changes["storage"],False)
+            for sql in self.schema.create_save_sql(self.schema.create_fingerprint()):
+                self.execute_and_commit(sql)
+        finally:
+            self.connection.close()
+
+    def connect_postgres(self):
+        """
+        Opens the connection to the PostgreSQL database.
+        """
+        self.host = self.config_database["host"]
+        self.port = self.config_database["port"]
+        self.name = self.config_database["name"]
+        self.user = self.config_database["user"]
+        self.password = self.config_database["password"]
+        connection_string = f"host={self.host} port={self.port} dbname={self.name} user={self.user} password={self.password}"
+        if self.db_schema != "public":
+            # The tables of a schema of their own, e.g. of a tenant, are found through the search path
+            self.connection = psycopg2.connect(connection_string,options=f"-c search_path={self.db_schema}")
+        else:
+            self.connection = psycopg2.connect(connection_string)
+        self.cursor = self.connection.cursor(cursor_factory=RealDictCursor)
+
+    def execute_and_commit(self,sql):
+        """
+        Executes the given SQL query and commits the transaction. While the DDL is batched the query
+        is queued until flush_ddl.
+
+        Parameters:
+        sql (str): The SQL query to execute.
+        """
+        if self.ddl is not None:
+            self.ddl.append(sql)
+            return
+        self.cursor.execute(sql)
+        self.connection.commit()
+
+    def flush_ddl(self):
+        """
+        Executes the batched DDL in one round trip and one transaction.
+        """
+        if not self.ddl:
+            return
+        sql = ";\n".join(statement.strip().rstrip(";") for statement in self.ddl)
+        self.ddl = []
+        self.cursor.execute(sql)
+        self.connection.commit()
+
+    def read_schema_fingerprint(self):
+        """
+        Reads the fingerprint of the provisioned schema.
+
+        Returns:
+        str: The fingerprint or None if the schema was never provisioned.
+        """
+        try:
+            self.cursor.execute(self.schema.create_read_sql())
+            rows = self.cursor.fetchall()
+            self.connection.commit()
+        except psycopg2.Error:
+            self.connection.rollback()
+            return None
+        if len(rows) == 0:
+            return None
+        return rows[0]['fingerprint']
+
+    def execute_index(self,sql):
+        """
+        Executes the given CREATE INDEX query. Online builds run CONCURRENTLY, which is not
+        possible inside a transaction, so they are executed in autocommit mode.
+
+        Parameters:
+        sql (str): The SQL query to execute.
+        """
+        if not self.online_indexes:
+            self.execute_and_commit(sql)
+            return
+        self.connection.commit()
+        self.connection.autocommit = True
+        try:
+            self.cursor.execute(sql)
+        finally:
+            self.connection.autocommit = False
+
+    def get_index_option(self):
+        """
+        Returns the option of CREATE INDEX for online builds.
+
+        Returns:
+        str: CONCURRENTLY or an empty string.
+        """
+        if self.online_indexes:
+            return "CONCURRENTLY "
+        return ""
+
+    def drop_invalid_indexes(self):
+        """
+        Drops the invalid agile indexes a failed concurrent build left behind, so they are built again.
+        """
+        self.cursor.execute("""SELECT c.relname AS index_name FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT i.indisvalid AND c.relname LIKE 'agile%' AND n.nspname = current_schema()""")
+        for index in self.cursor.fetchall():
+            print("Dropping invalid index", index['index_name'])
+            index_name = index['index_name']
+            self.execute_index(f"DROP INDEX {self.get_index_option()}IF EXISTS \"{index_name}\"")
+
+    def create_create_main_table_slql_string(self):
+        """
+        Creates the SQL query string for creating the main table.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""CREATE TABLE IF NOT EXISTS {self.db_schema}.agile_main ( 
+            agile_id uuid DEFAULT gen_random_uuid(),
+            agile_type TEXT,
+            data jsonb
+        );"""
+
+    def create_create_main_table_index_sql_string(self):
+        """
+        Creates the SQL query string for creating an index on the main table.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""CREATE INDEX IF NOT EXISTS agile_main_data_idx ON {self.db_schema}.agile_main ("data");"""
+    
+    def create_cast_function_sql(self,cast_type,function):
+        """
+        Creates the SQL query string for an IMMUTABLE function casting text to a date or time type.
+        The cast runs with the ISO date style and UTC, so the result only depends on the text and
+        the function can be used in expression indexes and generated columns.
+
+        Parameters:
+        cast_type (str): The date or time type.
+        function (str): The name of the function.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""CREATE OR REPLACE FUNCTION {self.db_schema}.{function}(value TEXT) RETURNS {cast_type}
+            LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+            SET datestyle = 'ISO, YMD' SET timezone = 'UTC'
+            AS $$ SELECT CAST(value AS {cast_type}) $$"""
+
+    def initialize_database_postgres(self):
+        """
+        Initializes the PostgreSQL database by creating the schema, the cast functions, the main
+        table and its index.
+        """
+        if self.db_schema != "public":
+            self.execute_and_commit(f"CREATE SCHEMA IF NOT EXISTS {self.db_schema}")
+        for cast_type,function in self.query.postgres_cast_functions.items():
+            self.execute_and_commit(self.create_cast_function_sql(cast_type,function))
+        sql = self.create_create_main_table_slql_string()
+        self.execute_and_commit(sql)
+        sql = self.create_create_main_table_index_sql_string()
+        self.execute_and_commit(sql)
+
+    def create_create_table_string(self,table):
+        """
+        Creates the SQL query string for creating a table.
+
+        Parameters:
+        table (str): The name of the table.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""CREATE TABLE IF NOT EXISTS {self.db_schema}.agile_{table} ( 
+                agile_id uuid DEFAULT gen_random_uuid(),
+                agile_type TEXT,
+                data jsonb);"""
+
+    def initialize_postgres_tables(self,only_tables=None):
+        """
+        Initializes the tables in the PostgreSQL database as per the configuration.
+
+        Parameters:
+        only_tables (list): Only these tables, all tables if None.
+        """
+        if self.config['tables'] is None:
+            return
+            
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            if only_tables is not None and table not in only_tables:
+                continue
+            sql = self.create_create_table_string(table)
+            self.execute_and_commit(sql)
+        
+    
+    def initialize_postgres_types(self):
+        """
+        Initializes the types in the PostgreSQL database as per the configuration. The records of
+        moved types are moved by the AgileMigrator of the server in the background.
+        """
+        if self.config['types'] is None:
+            return
+            
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            type_table = self.get_type_table(db_type)
+            db_type_object["table"] = type_table
+
+    def print_something(self):
+        print("Something")
+
+    def create_get_column_name_string(self,change_tables):
+        """
+        Creates the SQL query string for getting the column names of tables.
+
+        Parameters:
+        change_tables (list): The names of the tables.
+
+        Returns:
+        str: The SQL query string.
+        """
+        tables = ",".join(f"'{table}'" for table in change_tables)
+        return f"""SELECT table_name, column_name 
+        FROM information_schema.columns
+        WHERE table_schema = '{self.db_schema}'
+        AND table_name IN ({tables})"""
+
+    def get_all_column_names(self,change_table):
+        """
+        Gets all the column names of a table. The columns of all tables are read with one query
+        the first time, added columns are remembered afterwards.
+
+        Parameters:
+        change_table (str): The name of the table.
+
+        Returns:
+        list: The list of column names.
+        """
+        if self.table_columns is None:
+            self.table_columns = {}
+            tables = ["agile_main"] + ["agile_" + table for table in (self.config['tables'] or {})]
+            self.cursor.execute(self.create_get_column_name_string(tables))
+            for item in self.cursor.fetchall():
+                self.table_columns.setdefault(item['table_name'],[]).append(item['column_name'])
+            self.connection.commit()
+        return self.table_columns.setdefault(change_table,[])
+
+    def get_column_types(self,change_table,column):
+        """
+        Gets the types stored in a table which declare a column.
+
+        Parameters:
+        change_table (str): The name of the table.
+        column (str): The name of the column.
+
+        Returns:
+        list: The names of the types.
+        """
+        return [
+            db_type for db_type,db_type_object in (self.config['types'] or {}).items()
+            if (db_type_object.get("table") or "agile_main") == change_table
+            and column in (db_type_object.get("columns") or {})
+        ]
+
+    def create_add_column_sql(self,change_table,column,column_type):
+        """
+        Creates the SQL query string for adding a column to a table.
+        Only the records of the types declaring the column are casted, the
+        column is NULL for the other types of the table.
+
+        Parameters:
+        change_table (str): The name of the table.
+        column (str): The name of the column.
+        column_type (str): The type of the column.
+
+        Returns:
+        str: The SQL query string.
+        """
+        generated = self.query.cast_text(f"data->>'{column}'",self.query.get_cast_type(column_type) or column_type)
+        predicate = " OR ".join(
+            self.query.create_type_predicate(db_type)
+            for db_type in self.get_column_types(change_table,column)
+        ) or "FALSE"
+        return f"""ALTER TABLE {change_table} ADD COLUMN IF NOT EXISTS {column} {column_type}
+        GENERATED ALWAYS AS (CASE WHEN {predicate} THEN {generated} END) STORED;"""
+
+    def create_column_update_sql(self,change_table,column,column_type):
+        """
+        Creates the SQL query string for updating a column in a table.
+
+        Parameters:
+        change_table (str): The name of the table.
+        column (str): The name of the column.
+        column_type (str): The type of the column.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""UPDATE {change_table} SET  
+        {column}=CAST(data->>'{column}' AS {column_type})"""  
+  
+    def change_table_columns_due_to_config(self,db_type_object):
+        """
+        Changes the columns of a table due to configuration.
+
+        Parameters:
+        db_type_object (dict): The database type object.
+        """
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        columns = db_type_object['columns']
+        all_columns = self.get_all_column_names(change_table)
+        for column,column_type in columns.items():
+            if column not in all_columns:
+                sql = self.create_add_column_sql(change_table,column,column_type)
+                self.execute_and_commit(sql)
+                all_columns.append(column)
+                #sql = self.create_column_update_sql(change_table,column,column_type)
+                #self.execute_and_commit(sql)
+
+    def initialize_postgres_types_columns(self,only_types=None):
+        """
+        Initializes the columns of the types in the PostgreSQL database as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.change_table_columns_due_to_config(db_type_object)
+
+    def create_index_expression(self,db_type,column):
+        """
+        Creates the indexed expression of a column of an index.
+        Promoted columns are indexed directly, all other fields are indexed
+        with the same typed expression the where compiler uses.
+
+        Parameters:
+        db_type (str): The name of the type.
+        column (str): The name of the column or field.
+
+        Returns:
+        str: The indexed expression.
+        """
+        column = column.strip()
+        if self.query.is_column(db_type,column):
+            return f"\"{column}\""
+        declared_type = self.query.get_declared_type(db_type,column)
+        return "(" + self.query.typed_expression(column,declared_type) + ")"
+
+    def create_index_sql(self,change_table,index,db_type):
+        """
+        Creates the SQL query string for creating an index on a table. The
+        index is partial on the type, so its typed expressions are only
+        computed for the records of the type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        index (str): The name of the index.
+        db_type (str): The name of the type.
+
+        Returns:
+        str: The SQL query string.
+        """
+        index_name = index.replace(",","_")
+        index_columns = ",".join(
+            self.create_index_expression(db_type,column)
+            for column in index.split(",")
+        )
+        return f"""CREATE INDEX {self.get_index_option()}IF NOT EXISTS 
+            {change_table}_{db_type}_{index_name}_idx
+            ON {self.db_schema}.{change_table} ({index_columns})
+            WHERE {self.query.create_type_predicate(db_type)}"""
+
+    def create_postgres_indices(self,db_type,db_type_object):
+        """
+        Creates the indices for a type in the PostgreSQL database.
+
+        Parameters:
+        db_type (str): The name of the type.
+        db_type_object (dict): The database type object.
+        """
+        type_table = db_type_object["table"]
+        change_table = "agile_main"
+        if type_table != None:
+            change_table = type_table
+        indices = db_type_object['indices']
+        for index,indexString in indices.items():
+            sql = self.create_index_sql(change_table,index,db_type)
+            self.execute_index(sql)
+        natural_key = self.query.get_natural_key(db_type)
+        if natural_key is not None:
+            sql = self.create_natural_key_index_sql(change_table,db_type,natural_key)
+            self.execute_index(sql)
+
+    def create_natural_key_index_sql(self,change_table,db_type,natural_key):
+        """
+        Creates the SQL query string for the unique index of the natural key of a type.
+        The index is partial on the type, so upserts can use it with ON CONFLICT.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The name of the type.
+        natural_key (str): The promoted column of the natural key.
+
+        Returns:
+        str: The SQL query string.
+        """
+        return f"""CREATE UNIQUE INDEX {self.get_index_option()}IF NOT EXISTS 
+            {change_table}_{db_type}_{natural_key}_ukey
+            ON {self.db_schema}.{change_table} (\"{natural_key}\")
+            WHERE {self.query.create_type_predicate(db_type)}"""
+            
+    def initialize_postgres_types_indexes(self,only_types=None):
+        """
+        Initializes the indices of the types in the PostgreSQL database as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            self.create_postgres_indices(db_type,db_type_object)
+    
+    def create_search_column_sql(self,change_table,db_type):
+        """
+        Creates the SQL query string for adding the generated tsvector column of the
+        searched fields of a type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The name of the type.
+
+        Returns:
+        str: The SQL query string.
+        """
+        column = self.query.get_search_column(db_type)
+        document = self.query.create_search_document(db_type)
+        return f"""ALTER TABLE {change_table} ADD COLUMN IF NOT EXISTS {column} tsvector
+        GENERATED ALWAYS AS ({document}) STORED;"""
+
+    def create_search_index_sql(self,change_table,db_type):
+        """
+        Creates the SQL query string for the GIN index of the searched fields of a type.
+
+        Parameters:
+        change_table (str): The name of the table.
+        db_type (str): The name of the type.
+
+        Returns:
+        str: The SQL query string.
+        """
+        column = self.query.get_search_column(db_type)
+        return f"""CREATE INDEX {self.get_index_option()}IF NOT EXISTS 
+            {change_table}_{column}_idx
+            ON {self.db_schema}.{change_table} USING GIN ({column})"""
+
+    def initialize_postgres_types_search(self,only_types=None):
+        """
+        Initializes the full text search of the types in the PostgreSQL database as per the configuration.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if self.query.get_search(db_type) is None:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(self.create_search_column_sql(change_table,db_type))
+            self.execute_index(self.create_search_index_sql(change_table,db_type))
+
+    def initialize_postgres_types_summaries(self,only_types=None):
+        """
+        Initializes the summary tables of the types in the PostgreSQL database as per the configuration.
+        New summary tables are computed once from the existing records, afterwards triggers keep them up to date.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            for name in self.summary.get_summaries(db_type):
+                self.initialize_postgres_summary(db_type,name,change_table)
+
+    def initialize_postgres_summary(self,db_type,name,change_table):
+        """
+        Creates the table and the triggers of a summary and computes a new summary in one
+        transaction. The table of the type is locked against writes meanwhile, so a reload
+        doesn't miss the writes of the running server.
+
+        Parameters:
+        db_type (str): The name of the type.
+        name (str): The name of the summary.
+        change_table (str): The table of the type.
+        """
+        self.flush_ddl()
+        try:
+            for sql in self.summary.create_lock_sql(db_type,name,change_table):
+                self.cursor.execute(sql)
+            self.cursor.execute(self.summary.create_table_sql(db_type,name))
+            self.cursor.execute(self.summary.create_is_empty_sql(db_type,name))
+            is_empty = len(self.cursor.fetchall()) == 0
+            for sql in self.summary.create_trigger_sql(db_type,name,change_table):
+                self.cursor.execute(sql)
+            if is_empty:
+                self.cursor.execute(self.summary.create_populate_sql(db_type,name,change_table))
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def initialize_postgres_types_ttl(self,only_types=None):
+        """
+        Adds the expiry column and its index to the tables of the types with a ttl.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        """
+        if self.config['types'] is None:
+            return
+        db_types = self.config['types']
+        for db_type,db_type_object in db_types.items():
+            if only_types is not None and db_type not in only_types:
+                continue
+            if not db_type_object.get("ttl"):
+                continue
+            change_table = "agile_main"
+            if db_type_object["table"] != None:
+                change_table = db_type_object["table"]
+            self.execute_and_commit(f"""ALTER TABLE {change_table} ADD COLUMN IF NOT EXISTS agile_expires TIMESTAMP""")
+            self.execute_index(f"""CREATE INDEX {self.get_index_option()}IF NOT EXISTS 
+            {change_table}_agile_expires_idx
+            ON {self.db_schema}.{change_table} (agile_expires) WHERE agile_expires IS NOT NULL""")
+
+    def initialize_postgres_types_storage(self,only_types=None,strip=True):
+        """
+        Sets the compression of the documents of the tables and turns the promoted columns of types with
+        stripColumns into plain columns.
+
+        Parameters:
+        only_types (list): Only these types, all types if None.
+        strip (bool): Turn the columns of stripped types into plain columns.
+
+        Raises:
+        ValueError: If a column stored without the document should be kept in it again.
+        """
+        if self.config['types'] is None:
+            return
+        for table,(compression,storage) in self.storage.get_table_compressions(only_types).items():
+            self.execute_and_commit(self.storage.create_compression_sql(table,compression,storage))
+        for db_type in self.config['types']:
+            if only_types is not None and db_type not in only_types:
+                continue
+            if strip:
+                for sql in self.storage.create_strip_sql(db_type):
+                    self.execute_and_commit(sql)
+            if len(self.query.get_columns(db_type)) == 0:
+                continue
+            self.flush_ddl()
+            sql,sql_tuple = self.storage.create_plain_columns_sql(db_type)
+            self.cursor.execute(sql,sql_tuple)
+            stripped = [column.lower() for column in self.storage.get_stripped_columns(db_type)]
+            plain_columns = [item['column_name'] for item in self.cursor.fetchall() if item['column_name'] not in stripped]
+            self.connection.commit()
+            if len(plain_columns) > 0:
+                raise ValueError("The columns "+", ".join(plain_columns)+" of "+db_type+
+                                 " are stored without the document, move the type to a new table to keep them in it")
+
+    def get_type_table(self,requestedType):
+        """
+        Gets the table for a requested type.
+
+        Parameters:
+        requestedType (str): The name of the requested type.
+
+        Returns:
+        str: The name of the table for the requested type.
+        """
+        if self.config['tables'] == None:
+            return None
+        tables = self.config['tables']
+        for table, table_object in tables.items():
+            types = table_object['types']
+            for tableType, table_object in types.items():
+                if tableType == requestedType:
                     return "agile_" + table
\ No newline at end of file
@@ -1,329 +1,997 @@
-import json
-import re
-import agiledb.db.postgres as postgresLib
-import agiledb.db.mssql as mssqlLib
-import agiledb.db.mariaDb as mariaDbLib
-
-
-class Database:
-    def __init__(self):
-        self.config = None
-        self.cursor = None
-        self.connection = None
-        self.config_database = None
-        self.type_cache = {}
-        self.operator_list = ["=", "LIKE", ">", "<", "<=", ">="]
-
-    def configure(self, config_json):
-        self.config = config_json
-        self.config_database = config_json["database"]
-        self.type = self.config_database["type"]
-        if self.type == "postgres":
-            postgres = postgresLib.AgilePostgres(
-                self.config,
-                self.config_database
-            )
-        
-            postgres.configure_postgres()
-            self.cursor = postgres.cursor
-            self.connection = postgres.connection
-            return
-        if self.type == "mssql":
-            mssql = mssqlLib.AgileMssql(self.config, self.config_database)
-            mssql.configure_mssql()
-            self.cursor = mssql.cursor
-            self.connection = mssql.connection
-            return
-        if self.type == "mariaDb":
-            mariaDb = mariaDbLib.AgileMariaDb(self.config,self.config_database)
-            mariaDb.configure_maria_db()
-            print("mariaDb.cursor")
-            print(mariaDb.cursor)
-            self.cursor = mariaDb.cursor
-            self.connection = mariaDb.connection
-            return
-      
-    def get_from_json(self, str, json):
-        """
-        Retrieves a value from a JSON object based on the provided key.
-
-        This function takes a key and a JSON object as input.
-        If the key exists in the JSON object, its corresponding value is
-        returned.
-        If the key does not exist in the JSON object, None is returned.
-
-        Args:
-            str (str): The key for which the value should be retrieved.
-            json (dict): The JSON object from which the value should be
-            retrieved.
-
-        Returns:
-            obj: The value corresponding to the provided key if it exists,
-            None otherwise.
-        """
-        obj = None
-        if str in json:
-            obj = json[str]
-        return obj
-
-    def parse_where(self, where_string, single_where, str_sql_tuple,agile_type):
-        """
-        Parses a WHERE clause for a SQL query.
-
-        This function takes a WHERE clause string, a dictionary representing
-        a single WHERE condition, and a tuple representing the SQL string
-        as input.
-        The function iterates over the keys in the single WHERE condition.
-        If the key is not 'operator' and 'where', it is considered as a column
-        and its corresponding value is considered as the value for the WHERE
-        condition.
-        If the key is 'operator', its corresponding value is considered as
-        the operator for the WHERE condition.
-        The function then checks if the column exists in the configuration
-        for the given type.
-        If it does, the column, operator, and value are added to the WHERE
-        clause string.
-        If it doesn't, a JSONB query is added to the WHERE clause string.
-        The function then returns the updated WHERE clause string and tuple.
-
-        Args:
-            where_string (str): The WHERE clause string to be parsed.
-            single_where (dict): A dictionary representing a single WHERE
-            condition.
-            str_sql_tuple (tuple): The tuple representing the SQL string.
-
-        Returns:
-            tuple: A tuple containing the updated WHERE clause string and
-            tuple.
-        """
-        column = ""
-        value = ""
-        operator = "="
-        for att in list(single_where.keys()):
-            if any("operator" in s for s in single_where.keys()):
-                temp_operator = single_where["operator"]
-                if temp_operator in self.operator_list:
-                    operator = temp_operator
-            if att != "operator" and att != "where":
-                column = att
-                value = single_where[att] 
-                if self.keys_exists(self.config, "types", agile_type, "columns", column): 
-                    where_string += column + " " + operator + " %s "
-                    str_sql_tuple += (value,)
-                else:
-                    where_string += " data->>%s " + operator + " %s "
-                    str_sql_tuple += (column, value)
-        return where_string, str_sql_tuple
-    
-    def keys_exists(self, element, *keys):
-        if not isinstance(element, dict):
-            raise AttributeError('keys_exists() expects dict as first argument.')
-        if len(keys) == 0:
-            raise AttributeError('keys_exists() expects at least two arguments, one given.')
-        _element = element
-        for key in keys:
-            try:
-                _element = _element[key]
-            except KeyError:
-                return False
-        return True
-
-    def add_column_to_string_sql(self, str_sql, str_sql_tuple, type_, column):
-        """
-        Adds a column to a SQL string.
-
-        This function takes a SQL string, a tuple representing the SQL string,
-        the type of the record, and a column name as input.
-        The function checks if the column is not 'agile_id' and 'agile_type',
-        and if the column exists in the configuration for the given type.
-        If the conditions are met, the column is added to the SQL string.
-        The function then returns the updated SQL string and tuple.
-
-        Args:
-            str_sql (str): The SQL string to which the column should be added.
-            str_sql_tuple (tuple): The tuple representing the SQL string.
-            type_ (str): The type of the record.
-            column (str): The name of the column to be added.
-
-        Returns:
-            tuple: A tuple containing the updated SQL string and tuple.
-        """
-        if column != "agile_id" and column != "agile_type":
-            if self.keys_exists(self.config,"types",type_,"columns",column):
-                str_sql += column+" "
-            else:
-                if self.type == "postgres":
-                    str_sql += "data->>%s as \""+re.sub('[^A-Za-z0-9_]+', '', column)+"\" "
-                    str_sql_tuple += (column,)
-                elif self.type == "mssql":
-                    str_sql += "JSON_VALUE(data,%s) as \""+re.sub('[^A-Za-z0-9_]+', '', column)+"\" "
-                    str_sql_tuple += ("$."+column,)
-                elif self.type == "mariaDb":
-                    str_sql += "JSON_VALUE(data,%s) as \""+re.sub('[^A-Za-z0-9_]+', '', column)+"\" "
-                    str_sql_tuple += ("$."+column,)    
-        else: 
-            if column == "agile_id":
-                if self.type == "mariaDb":
-                    str_sql += "CAST(agile_id as CHAR CHARACTER SET utf8) as agile_id" + " "
-                else:
-                    str_sql += "CAST(agile_id as varchar(max)) as agile_id" + " "
-            else:
-                str_sql += column+" "
-        return str_sql,str_sql_tuple
-
-    def get(self,jsonObject):
-        agile_type = jsonObject["type"]
-        columns = self.get_from_json("columns",jsonObject)
-        where = self.get_from_json("where",jsonObject)
-        strSQL = "SELECT "
-        strSQLTuple = ()
-        if columns == None or len(columns) == 0:
-            strSQL += "* "
-        else:
-            first = True
-            for column in columns:
-                if first == False:strSQL += ","  
-                else:first = False
-                strSQL,strSQLTuple = self.add_column_to_string_sql(strSQL,strSQLTuple,agile_type,column)
-        if self.keys_exists(self.config,"types",agile_type,"table"):
-            strSQL += "FROM "+self.config["types"][agile_type]["table"]+" "
-        else:    
-            strSQL += "FROM agile_main "
-        strSQL += "WHERE agile_type=%s "
-        strSQLTuple += (agile_type,)
-        whereString = ""
-        print ("SQL")
-        print (strSQL)
-        if where != None:
-            for singleWhere in where:
-                whereString += " AND "    
-                whereString,strSQLTuple = self.parse_where(whereString,singleWhere,strSQLTuple,agile_type)
-                #Parse wjere object here
-        strSQL += whereString
-        print ("SQL")
-        print (strSQL)
-
-        self.cursor.execute(strSQL,strSQLTuple)
-        if self.type =="postgres":
-            self.connection.commit()
-        result = self.cursor.fetchall()
-        return json.dumps(result)
-    
-    def post(self, json_object):
-        """
-        Inserts a new record into the database.
-
-        This function takes a JSON object as input, which should contain the type of the record and the data to be inserted.
-        The function constructs an SQL INSERT statement based on the input and executes it.
-        If the operation is successful, the function returns the ID of the newly inserted record.
-
-        Args:
-            json_object (dict): A dictionary containing the type of the record and the data to be inserted.
-
-        Returns:
-            str: The ID of the newly inserted record as a string.
-
-        Raises:
-            Exception: If there is an error executing the SQL statement.
-        """
-        agile_type= json_object["type"]
-        data = json_object["data"]
-        table_name = "main"
-        if self.keys_exists(self.config, "types", agile_type, "table"):
-            table_name = self.config["types"][agile_type]["table"]
-        sql = """INSERT INTO agile_"""+table_name+""" (agile_type,data"""
-        values = " VALUES (%s, %s"
-        #if self.keys_exists(self.config,"types",type,"columns"):
-        #    for column, _ in self.config["types"][type]["columns"].items():
-        #        sql += ","+column
-        #        values += ", %s"
-        sql += ") "
-        values += ") "
-        if self.type=="postgres" or self.type=="mariaDb":
-            sql += values + " RETURNING agile_id;"  
-        if self.type=="mssql":
-           sql += " OUTPUT Inserted.agile_id " + values +";"
-        print ("SQL")
-        print(sql)
-        self.cursor.execute(sql,(agile_type, json.dumps(data)))
-        print("After COmmand")
-        id = self.cursor.fetchone()['agile_id']
-        self.connection.commit()
-        return str(id)
-        
-    def put(self,jsonObject):
-        id = jsonObject["agile_id"]
-        type = jsonObject["type"]
-        data = jsonObject["data"]
-        tableName = "main"
-        if self.keys_exists(self.config,"types",type,"table"):
-            tableName = self.config["types"][type]["table"]
-        sql = "UPDATE agile_"+tableName+" set data=%s"
-        sql_tuple = (json.dumps(data),id)
-        #if self.keys_exists(self.config,"types",type,"columns"):
-        #    for column, _ in self.config["types"][type]["columns"].items():
-        #        if self.keys_exists(jsonObject,"data",column):
-        #            sql += ","+column+"=%s"
-        #            sqlTuple += (jsonObject["data"][column],)
-        sql += """ WHERE agile_id=%s"""
-        self.cursor.execute(sql, sql_tuple)
-        self.connection.commit()
-
-    def is_number(n):
-        try:
-            float(n)   # Type-casting the string to `float`.
-                    # If string is not a valid `float`, 
-                    # it'll raise `ValueError` exception
-        except ValueError:
-            return False
-        return True
-
-    def patch(self,jsonObject):
-        #Here You can Put RAWSQL 
-        if "enableRawSQL" in self.config and \
-        self.config["enableRawSQL"] == True:
-            sql = jsonObject["sql"]
-            self.cursor.execute(sql)
-            if self.type=="postgres":
-                self.connection.commit()
-            arr = self.cursor.fetchall()
-            if self.type=="mssql":
-                for arrElement in arr:
-                    for attr in arrElement:
-                        attrValue = arrElement[attr]
-                        attributeType = type(attrValue).__name__
-                        if attributeType == 'UUID':
-                            arrElement[attr] = str(attrValue)
-            return json.dumps(arr)
-        else:
-            return json.dumps({"error": "RawSQL is not enabled!"})
-    
-    def delete(self, json_object):
-        """
-        Deletes a record or records from the database.
-
-        This function takes a JSON object as input, which should contain the 
-        ID or IDs of the records to be deleted and the type of the record.
-        The function constructs an SQL DELETE statement based on the input and 
-        executes it.
-
-        Args:
-            json_object (dict): A dictionary containing the objects
-            to be deleted and the type of the record.
-
-        Raises:
-            Exception: If there is an error executing the SQL statement.
-        """
-        id = json_object["agile_id"]
-        type = json_object["type"]
-        table_name = "agile_main"
-        if self.keys_exists(self.config, "types", type, "table"):
-            table_name = self.config["types"][type]["table"]
-        if isinstance(id, list) is True:
-            for single_id in id:
-                sql = "DELETE FROM "+table_name+" WHERE agile_id=%s"
-                self.cursor.execute(sql, (single_id,))
-        else:
-            sql = "DELETE FROM "+table_name+" WHERE agile_id=%s"
-            self.cursor.execute(sql, (id,))
-        self.connection.commit()
+import json
+import threading
+import time
+import agiledb.db.postgres as postgresLib
+import agiledb.db.mssql as mssqlLib
+import agiledb.db.mariadb as mariaDbLib
+from agiledb.query import AgileQuery
+from agiledb.bulk import AgileBulk
+from agiledb.writebuffer import AgileWriteBuffer
+from agiledb.summary import AgileSummary
+from agiledb.storage import AgileStorage
+from agiledb.ttl import AgileTtl
+from agiledb.columnar import AgileColumnar
+from agiledb.explain import AgileExplain
+from agiledb.reload import AgileReload
+from agiledb.migrate import AgileMigrator
+from agiledb.coalesce import AgileCoalescer
+from agiledb.advisor import AgileAdvisor
+from agiledb.convert import AgileRowConverter
+from agiledb.rawsql import AgileRawSql
+from agiledb.profiler import tracer
+
+
+class Database:
+    drain_timeout = 30
+
+    def __init__(self):
+        self.config = None
+        self.cursor = None
+        self.connection = None
+        self.config_database = None
+        self.type_cache = {}
+        self.query = None
+        self.summary = None
+        self.storage = None
+        self.bulk = AgileBulk(self)
+        self.lock = threading.RLock()
+        self.write_buffers = {}
+        self.ttl = AgileTtl(self)
+        self.columnar = AgileColumnar(self)
+        self.explainer = AgileExplain(self)
+        self.reloader = AgileReload(self)
+        self.migrator = AgileMigrator(self)
+        self.coalescer = AgileCoalescer(self)
+        self.advisor = AgileAdvisor(self)
+        self.converter = AgileRowConverter(self)
+        self.raw_sql = AgileRawSql(self)
+        self.session_timeout = 0
+
+    def configure(self, config_json):
+        self.config = config_json
+        self.config_database = config_json["database"]
+        self.type = self.config_database["type"]
+        self.query = AgileQuery(self.config, self.type)
+        self.summary = AgileSummary(self.query)
+        self.storage = AgileStorage(self.query)
+        if self.type == "postgres":
+            postgres = postgresLib.AgilePostgres(
+                self.config,
+                self.config_database
+            )
+        
+            postgres.configure_postgres()
+            self.cursor = postgres.cursor
+            self.connection = postgres.connection
+        elif self.type == "mssql":
+            mssql = mssqlLib.AgileMssql(self.config, self.config_database)
+            mssql.configure_mssql()
+            self.cursor = mssql.cursor
+            self.connection = mssql.connection
+        elif self.type == "mariaDb":
+            mariaDb = mariaDbLib.AgileMariaDb(self.config,self.config_database)
+            mariaDb.configure_maria_db()
+            self.cursor = mariaDb.cursor
+            self.connection = mariaDb.connection
+        self.configure_write_buffers()
+        self.ttl.start()
+        self.migrator.plan()
+        self.migrator.start()
+        self.advisor.start()
+
+    def connect(self, config_database=None):
+        """
+        Opens another connection to the database, e.g. for background work
+        which should not hold the lock of the server connection.
+
+        Args:
+            config_database (dict): Other database settings, e.g. of a replica.
+
+        Returns:
+            obj: The connection of the driver of the backend.
+        """
+        if config_database is None:
+            config_database = self.config_database
+        if self.type == "postgres":
+            postgres = postgresLib.AgilePostgres(self.config, config_database)
+            postgres.connect_postgres()
+            return postgres.connection
+        if self.type == "mssql":
+            mssql = mssqlLib.AgileMssql(self.config, config_database)
+            mssql.connect_mssql()
+            return mssql.connection
+        mariaDb = mariaDbLib.AgileMariaDb(self.config, config_database)
+        mariaDb.connect_maria_db()
+        return mariaDb.connection
+
+    def close(self):
+        """
+        Stops the background work and closes the connection, e.g. of a tenant
+        which is evicted. Pending migrations resume when the database is
+        configured again.
+        """
+        self.ttl.stop()
+        self.migrator.stop()
+        self.advisor.stop()
+        for write_buffer in self.write_buffers.values():
+            write_buffer.stop()
+        self.raw_sql.close()
+        with self.lock:
+            self.connection.close()
+
+    def reload(self, config_json):
+        """
+        Applies a changed configuration without restarting the server.
+
+        Args:
+            config_json (dict): The new configuration.
+
+        Returns:
+            dict: The applied changes.
+        """
+        return self.reloader.reload(config_json)
+
+    def reconfigure(self, config_json, changes):
+        """
+        Runs the changed DDL of a new configuration on a new connection of the backend.
+
+        Args:
+            config_json (dict): The new configuration.
+            changes (dict): The changes found by AgileReload.diff.
+        """
+        if self.type == "postgres":
+            postgres = postgresLib.AgilePostgres(config_json, config_json["database"])
+            postgres.reconfigure_postgres(changes)
+        elif self.type == "mssql":
+            mssql = mssqlLib.AgileMssql(config_json, config_json["database"])
+            mssql.reconfigure_mssql(changes)
+        elif self.type == "mariaDb":
+            mariaDb = mariaDbLib.AgileMariaDb(config_json, config_json["database"])
+            mariaDb.reconfigure_maria_db(changes)
+
+    def swap_config(self, config_json, changes):
+        """
+        Replaces the configuration and the metadata built from it. Requests hold the
+        lock while they execute, so they see either the old or the new configuration.
+
+        Args:
+            config_json (dict): The new configuration with the tables of the types set.
+            changes (dict): The changes found by AgileReload.diff.
+        """
+        query = AgileQuery(config_json, self.type)
+        summary = AgileSummary(query)
+        storage = AgileStorage(query)
+        replaced = [
+            self.write_buffers[agile_type]
+            for agile_type in changes["types"] + changes["removed_types"]
+            if agile_type in self.write_buffers
+        ]
+        # The buffered writes of the changed types are committed with the old
+        # configuration, the buffers flush with the lock, so they are drained first
+        for write_buffer in replaced:
+            write_buffer.stop()
+        for write_buffer in replaced:
+            if not write_buffer.join(self.drain_timeout):
+                print("Write buffer of", write_buffer.agile_type, "still flushing after the reload")
+        with self.lock:
+            self.config = config_json
+            self.config_database = config_json["database"]
+            self.query = query
+            self.summary = summary
+            self.storage = storage
+            self.strip_columns(changes["storage"])
+            for agile_type in changes["types"] + changes["removed_types"]:
+                self.write_buffers.pop(agile_type, None)
+            self.configure_write_buffers(changes["types"])
+            self.explainer.reset()
+            # Reads of moved types have to include their old table from the
+            # first request with the new configuration
+            self.migrator.plan()
+            self.coalescer.invalidate()
+        self.raw_sql.reset()
+        self.ttl.start()
+        self.migrator.start()
+        self.advisor.start()
+
+    def strip_columns(self, only_types):
+        """
+        Turns the columns of stripped types into plain columns after a reload. It runs while the
+        configuration is swapped, as the writes of the old configuration don't fill plain columns
+        and the writes of the new one can't write generated columns.
+
+        Args:
+            only_types (list): The types whose storage changed.
+        """
+        statements = []
+        for agile_type in only_types:
+            statements += self.storage.create_strip_sql(agile_type)
+        if len(statements) == 0:
+            return
+        try:
+            for sql in statements:
+                self.cursor.execute(sql)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def configure_write_buffers(self, only_types=None):
+        """
+        Creates the write buffers of all types with a writeBuffer setting.
+
+        Args:
+            only_types (list): Only the buffers of these types, all types if None.
+        """
+        for agile_type, type_object in (self.config.get("types") or {}).items():
+            if only_types is not None and agile_type not in only_types:
+                continue
+            if type_object.get("writeBuffer"):
+                self.write_buffers[agile_type] = AgileWriteBuffer(
+                    self, agile_type, type_object["writeBuffer"]
+                )
+
+    def get_from_json(self, str, json):
+        """
+        Retrieves a value from a JSON object based on the provided key.
+
+        This function takes a key and a JSON object as input.
+        If the key exists in the JSON object, its corresponding value is
+        returned.
+        If the key does not exist in the JSON object, None is returned.
+
+        Args:
+            str (str): The key for which the value should be retrieved.
+            json (dict): The JSON object from which the value should be
+            retrieved.
+
+        Returns:
+            obj: The value corresponding to the provided key if it exists,
+            None otherwise.
+        """
+        obj = None
+        if str in json:
+            obj = json[str]
+        return obj
+
+    def parse_where(self, where_string, single_where, str_sql_tuple,agile_type):
+        """
+        Parses a WHERE clause for a SQL query.
+
+        This function takes a WHERE clause string, a dictionary representing
+        a single WHERE condition, and a tuple representing the SQL string
+        as input.
+        The condition is compiled by AgileQuery. Every key except
+        'operator' is a field compared with the operator. The keys 'or'
+        and 'and' hold lists of nested conditions.
+        Promoted columns are compared directly, all other fields are read
+        from the JSON document and casted to the type declared in the
+        'columns' or 'fields' of the type, so the predicate can use the
+        indexes of the type.
+        The function then returns the updated WHERE clause string and tuple.
+
+        Args:
+            where_string (str): The WHERE clause string to be parsed.
+            single_where (dict): A dictionary representing a single WHERE
+            condition.
+            str_sql_tuple (tuple): The tuple representing the SQL string.
+            agile_type (str): The type of the record.
+
+        Returns:
+            tuple: A tuple containing the updated WHERE clause string and
+            tuple.
+        """
+        sql, sql_tuple = self.query.compile_condition(agile_type, single_where)
+        where_string += " " + sql + " "
+        str_sql_tuple += sql_tuple
+        return where_string, str_sql_tuple
+
+    def get_statement_timeout(self, operation, agile_type=None):
+        """
+        Returns the statement timeout of an operation.
+
+        The statementTimeout of a type, a number or a dict of operations,
+        overrides statementTimeouts in server. Both can have a default.
+
+        Args:
+            operation (str): get, post, put, delete, upsert, patch, summary
+            or export.
+            agile_type (str): The type of the request.
+
+        Returns:
+            float: The timeout in seconds, None or 0 for no timeout.
+        """
+        timeouts = (self.config.get("server") or {}).get("statementTimeouts") or {}
+        timeout = timeouts.get(operation, timeouts.get("default"))
+        if agile_type is not None:
+            type_timeout = self.query.get_type_config(agile_type).get("statementTimeout")
+            if isinstance(type_timeout, dict):
+                type_timeout = type_timeout.get(operation, type_timeout.get("default"))
+            if type_timeout is not None:
+                timeout = type_timeout
+        return timeout
+
+    def set_statement_timeout(self, operation, agile_type=None, cursor=None):
+        """
+        Limits the execution time of the statements of an operation on the
+        session. Called with the lock held before the operation executes.
+
+        Postgres sets statement_timeout for the transaction, MariaDB sets
+        max_statement_time of the session. MSSQL has no statement timeout
+        on the session, so it limits the waits for locks with LOCK_TIMEOUT.
+
+        Args:
+            operation (str): The operation, see get_statement_timeout.
+            agile_type (str): The type of the request.
+            cursor (obj): A cursor of another session, the server session if None.
+        """
+        timeout = float(self.get_statement_timeout(operation, agile_type) or 0)
+        server_session = cursor is None
+        if server_session:
+            cursor = self.cursor
+        if self.type == "postgres":
+            if timeout > 0:
+                cursor.execute("SET LOCAL statement_timeout = " + str(int(timeout * 1000)))
+            return
+        if server_session and timeout == self.session_timeout:
+            return
+        if self.type == "mariaDb":
+            cursor.execute("SET SESSION max_statement_time = " + str(timeout))
+        else:
+            cursor.execute("SET LOCK_TIMEOUT " + str(int(timeout * 1000) if timeout > 0 else -1))
+        if server_session:
+            self.session_timeout = timeout
+
+    def get_table_name(self, agile_type):
+        """
+        Returns the table a type is stored in.
+
+        Args:
+            agile_type (str): The type of the record.
+
+        Returns:
+            str: The name of the table.
+        """
+        if self.keys_exists(self.config, "types", agile_type, "table") and \
+            self.config["types"][agile_type]["table"] is not None:
+            return self.config["types"][agile_type]["table"]
+        return "agile_main"
+
+    def keys_exists(self, element, *keys):
+        if not isinstance(element, dict):
+            raise AttributeError('keys_exists() expects dict as first argument.')
+        if len(keys) == 0:
+            raise AttributeError('keys_exists() expects at least two arguments, one given.')
+        _element = element
+        for key in keys:
+            try:
+                _element = _element[key]
+            except KeyError:
+                return False
+        return True
+
+    def create_get_sql(self,jsonObject,projection):
+        """
+        Builds the SELECT of a GET request.
+
+        Args:
+            jsonObject (dict): A dictionary containing the type, where, search
+            and limit of the request.
+            projection (str): The selected expressions.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        agile_type = jsonObject["type"]
+        where = self.get_from_json("where",jsonObject)
+        search = self.get_from_json("search",jsonObject)
+        limit = self.get_from_json("limit",jsonObject)
+        table_name = self.get_table_name(agile_type)
+        readTable,readTuple = self.migrator.create_read_table(agile_type)
+        strSQL = "SELECT "
+        strSQLTuple = ()
+        if limit != None and self.type == "mssql":
+            strSQL += "TOP "+str(int(limit))+" "
+        strSQL += projection+" "
+        strSQL += "FROM "+readTable+" "
+        strSQLTuple += readTuple
+        order = ""
+        orderTuple = ()
+        searchPredicate = ""
+        searchTuple = ()
+        if search != None:
+            if self.type != "postgres" and self.migrator.is_migrating(agile_type):
+                raise ValueError("The type "+agile_type+" is moving to its table, search works after the migration")
+            join,joinTuple,searchPredicate,searchTuple,order,orderTuple = \
+                self.query.compile_search(agile_type,table_name,search)
+            strSQL += join+" "
+            strSQLTuple += joinTuple
+        strSQL += "WHERE agile_type=%s "
+        strSQLTuple += (agile_type,)
+        if searchPredicate != "":
+            strSQL += " AND "+searchPredicate+" "
+            strSQLTuple += searchTuple
+        if self.ttl.has_ttl(agile_type):
+            visiblePredicate,visibleTuple = self.ttl.create_visible_predicate()
+            strSQL += " AND "+visiblePredicate+" "
+            strSQLTuple += visibleTuple
+        whereString = ""
+        if where != None:
+            for singleWhere in where:
+                whereString += " AND "    
+                whereString,strSQLTuple = self.parse_where(whereString,singleWhere,strSQLTuple,agile_type)
+        strSQL += whereString
+        if order != "":
+            strSQL += " ORDER BY "+order
+            strSQLTuple += orderTuple
+        if limit != None and self.type != "mssql":
+            strSQL += " LIMIT "+str(int(limit))
+        return strSQL,strSQLTuple
+
+    def create_get_projection(self,jsonObject):
+        """
+        Builds the selected expressions of a GET, the whole row or one JSON
+        object of the requested columns.
+        """
+        agile_type = jsonObject["type"]
+        columns = self.get_from_json("columns",jsonObject)
+        if columns == None or len(columns) == 0:
+            table_name = self.get_table_name(agile_type)
+            if self.storage.is_stripped(agile_type):
+                # The stripped columns are merged back into the document
+                return "CAST((to_jsonb("+table_name+") - 'data') || jsonb_build_object('data', "+ \
+                    self.storage.create_document_expression(agile_type,table_name)+") AS TEXT) AS agile_object"
+            return table_name+".*"
+        return self.query.compile_projection(agile_type,columns)+" AS agile_object"
+
+    def get(self,jsonObject):
+        """
+        Selects the records of a type.
+
+        The request can hold the requested columns, where conditions, a full
+        text search on the searched fields of the type, ordered by relevance,
+        and a limit.
+
+        With coalesce in server, identical concurrent requests share one execution.
+
+        Args:
+            jsonObject (dict): A dictionary containing the type, columns, where,
+            search and limit of the request.
+
+        Returns:
+            str: The records as JSON array.
+        """
+        tracer.tag("get",jsonObject["type"])
+        return self.coalescer.run(jsonObject,lambda: self.execute_get(jsonObject))
+
+    def execute_get(self,jsonObject):
+        """
+        Executes a GET and serializes its records.
+        """
+        columns = self.get_from_json("columns",jsonObject)
+        with tracer.span("build"):
+            strSQL,strSQLTuple = self.create_get_sql(jsonObject,self.create_get_projection(jsonObject))
+        print ("SQL")
+        print (strSQL)
+
+        with self.lock:
+            try:
+                self.set_statement_timeout("get",jsonObject["type"])
+                started = time.perf_counter()
+                with tracer.span("execute"):
+                    self.cursor.execute(strSQL,strSQLTuple)
+                    if self.type =="postgres":
+                        self.connection.commit()
+                with tracer.span("fetch"):
+                    result = self.cursor.fetchall()
+                    description = self.cursor.description
+                duration = time.perf_counter() - started
+            except Exception:
+                if self.type =="postgres":
+                    self.connection.rollback()
+                raise
+        self.explainer.observe(strSQL,strSQLTuple)
+        self.advisor.observe(jsonObject,duration)
+        with tracer.span("serialize"):
+            if (columns == None or len(columns) == 0) and not self.storage.is_stripped(jsonObject["type"]):
+                return json.dumps(self.converter.convert(result,description))
+            # The objects are built by the database, so they are only joined
+            return "[" + ",".join(row["agile_object"] for row in result) + "]"
+
+    def get_columnar(self,jsonObject):
+        """
+        Selects the records of a type as Arrow IPC stream or Parquet file.
+
+        Args:
+            jsonObject (dict): The GET request with the format arrow or parquet.
+
+        Returns:
+            generator: The binary chunks of the result.
+        """
+        return self.connected_stream(self.columnar.get(jsonObject),"get",jsonObject["type"])
+    
+    def explain(self,jsonObject):
+        """
+        Shows the query plan of a GET request.
+
+        Args:
+            jsonObject (dict): The body of a GET request, optionally with analyze
+            to execute the query on Postgres.
+
+        Returns:
+            str: The SQL, the plan and its summary as JSON.
+        """
+        return json.dumps(self.explainer.explain(jsonObject), default=str)
+
+    def post(self, json_object):
+        """
+        Inserts a new record into the database.
+
+        This function takes a JSON object as input, which should contain the type of the record and the data to be inserted.
+        The function constructs an SQL INSERT statement based on the input and executes it.
+        If the type has a write buffer, the insert is committed together with the other
+        buffered writes of the type.
+        If the operation is successful, the function returns the ID of the newly inserted record.
+        Instead of data the JSON object can hold a list of records, which are inserted in one
+        transaction.
+
+        Args:
+            json_object (dict): A dictionary containing the type of the record and the data to be
+            inserted or the records.
+
+        Returns:
+            obj: The ID of the newly inserted record as a string or the list of IDs of the records.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        return self.write("post", json_object)
+
+    def execute_post(self, json_object):
+        """
+        Executes the INSERT of a post without committing it.
+
+        Args:
+            json_object (dict): A dictionary containing the type of the record and the data to be
+            inserted or the records.
+
+        Returns:
+            obj: The ID of the newly inserted record as a string or the list of IDs of the records.
+        """
+        agile_type = json_object["type"]
+        if "records" in json_object:
+            if not isinstance(json_object["records"], list):
+                raise ValueError("The records have to be a list")
+            return [
+                self.execute_single_post(agile_type, data)
+                for data in json_object["records"]
+            ]
+        return self.execute_single_post(agile_type, json_object["data"])
+
+    def execute_single_post(self, agile_type, data):
+        """
+        Executes the INSERT of one record without committing it.
+
+        Args:
+            agile_type (str): The type of the record.
+            data (obj): The data of the record.
+
+        Returns:
+            str: The ID of the newly inserted record as a string.
+        """
+        table_name = self.get_table_name(agile_type)
+        stored, columns, column_values = self.storage.strip(agile_type, data)
+        sql = """INSERT INTO """+table_name+""" (agile_type,data"""
+        values = " VALUES (%s, %s"
+        sql_tuple = (agile_type, json.dumps(stored))
+        for column, placeholder in columns:
+            sql += ","+column
+            values += ", "+placeholder
+        sql_tuple += column_values
+        if self.ttl.has_ttl(agile_type):
+            sql += ",agile_expires"
+            values += ", %s"
+            sql_tuple += (self.ttl.compute_expiry(agile_type, data),)
+        sql += ") "
+        values += ") "
+        if self.type=="postgres" or self.type=="mariaDb":
+            sql += values + " RETURNING agile_id;"  
+        if self.type=="mssql":
+           # OUTPUT needs INTO on tables with triggers, e.g. of summaries
+           sql = "DECLARE @agile_ids TABLE (agile_id uniqueidentifier); " + sql + \
+               " OUTPUT Inserted.agile_id INTO @agile_ids " + values + \
+               "; SELECT agile_id FROM @agile_ids;"
+        self.cursor.execute(sql,sql_tuple)
+        id = self.cursor.fetchone()['agile_id']
+        return str(id)
+        
+    def put(self,jsonObject):
+        """
+        Replaces the data of a record.
+
+        Args:
+            jsonObject (dict): A dictionary containing the agile_id, the type and the new data.
+        """
+        self.write("put", jsonObject)
+
+    def execute_put(self,jsonObject):
+        """
+        Executes the UPDATE of a put without committing it.
+
+        Args:
+            jsonObject (dict): A dictionary containing the agile_id, the type and the new data.
+        """
+        id = jsonObject["agile_id"]
+        type = jsonObject["type"]
+        data = jsonObject["data"]
+        tableName = self.get_table_name(type)
+        self.migrator.move_record(self.cursor, type, "agile_id", id)
+        stored, columns, column_values = self.storage.strip(type, data)
+        sql = "UPDATE "+tableName+" set data=%s"
+        sql_tuple = (json.dumps(stored),)
+        for column, placeholder in columns:
+            sql += ", "+column+"="+placeholder
+        sql_tuple += column_values
+        if self.ttl.has_ttl(type):
+            sql += ", agile_expires=%s"
+            sql_tuple += (self.ttl.compute_expiry(type, data),)
+        sql += """ WHERE agile_id=%s"""
+        sql_tuple += (id,)
+        self.cursor.execute(sql, sql_tuple)
+
+    def is_number(n):
+        try:
+            float(n)   # Type-casting the string to `float`.
+                    # If string is not a valid `float`, 
+                    # it'll raise `ValueError` exception
+        except ValueError:
+            return False
+        return True
+
+    def patch(self,jsonObject):
+        #Here You can Put RAWSQL 
+        if "enableRawSQL" in self.config and \
+        self.config["enableRawSQL"] == True:
+            # A session of its own, read only and limited, streams the rows
+            return self.raw_sql.execute(jsonObject["sql"])
+        else:
+            return json.dumps({"error": "RawSQL is not enabled!"})
+    
+    def delete(self, json_object):
+        """
+        Deletes a record or records from the database.
+
+        This function takes a JSON object as input, which should contain the 
+        ID or IDs of the records to be deleted and the type of the record.
+        The function constructs an SQL DELETE statement based on the input and 
+        executes it.
+
+        Args:
+            json_object (dict): A dictionary containing the objects
+            to be deleted and the type of the record.
+
+        Raises:
+            Exception: If there is an error executing the SQL statement.
+        """
+        self.write("delete", json_object)
+
+    def execute_delete(self, json_object):
+        """
+        Executes the DELETE of a delete without committing it.
+
+        Args:
+            json_object (dict): A dictionary containing the objects
+            to be deleted and the type of the record.
+        """
+        id = json_object["agile_id"]
+        type = json_object["type"]
+        table_name = self.get_table_name(type)
+        if isinstance(id, list) is True:
+            for single_id in id:
+                self.migrator.move_record(self.cursor, type, "agile_id", single_id)
+                sql = "DELETE FROM "+table_name+" WHERE agile_id=%s"
+                self.cursor.execute(sql, (single_id,))
+        else:
+            self.migrator.move_record(self.cursor, type, "agile_id", id)
+            sql = "DELETE FROM "+table_name+" WHERE agile_id=%s"
+            self.cursor.execute(sql, (id,))
+
+    def upsert(self, json_object):
+        """
+        Inserts or updates records identified by the natural key of their type.
+
+        The natural key is a promoted column declared as naturalKey of the type.
+        The data can be one record or a list of records, a list is written in
+        one transaction.
+
+        Args:
+            json_object (dict): A dictionary containing the type and the data.
+
+        Returns:
+            obj: The ID of the record or the list of IDs for a list of records.
+        """
+        return self.write("upsert", json_object)
+
+    def create_upsert_sql(self, agile_type, natural_key):
+        """
+        Creates the upsert statement of a type.
+
+        Postgres uses INSERT ... ON CONFLICT with the partial unique index of the
+        natural key, MariaDB INSERT ... ON DUPLICATE KEY UPDATE and MSSQL a MERGE
+        with HOLDLOCK.
+
+        Args:
+            agile_type (str): The type of the record.
+            natural_key (str): The natural key of the type.
+
+        Returns:
+            str: The SQL string taking the type, the data, the stripped columns
+            and for types with a ttl the expiry time as parameters.
+        """
+        table_name = self.get_table_name(agile_type)
+        columns = ["agile_type", "data"]
+        placeholders = ["%s", "%s"]
+        for column, placeholder in self.storage.get_placeholders(agile_type):
+            columns.append(column)
+            placeholders.append(placeholder)
+        if self.ttl.has_ttl(agile_type):
+            columns.append("agile_expires")
+            placeholders.append("%s")
+        updated = columns[1:]
+        values = ", ".join(placeholders)
+        if self.type == "postgres":
+            return "INSERT INTO "+table_name+" ("+",".join(columns)+") VALUES ("+values+")" \
+                " ON CONFLICT (\""+natural_key+"\") WHERE " + \
+                self.query.create_type_predicate(agile_type) + \
+                " DO UPDATE SET "+", ".join(column+"=EXCLUDED."+column for column in updated)+ \
+                " RETURNING agile_id;"
+        if self.type == "mariaDb":
+            return "INSERT INTO "+table_name+" ("+",".join(columns)+") VALUES ("+values+")" \
+                " ON DUPLICATE KEY UPDATE "+", ".join(column+"=VALUES("+column+")" for column in updated)+";"
+        column_type = self.query.get_declared_type(agile_type, natural_key)
+        key_expression = self.query.typed_expression(
+            natural_key, column_type, "source.data"
+        )
+        return "DECLARE @agile_ids TABLE (agile_id uniqueidentifier);" \
+            " MERGE "+table_name+" WITH (HOLDLOCK) AS target" \
+            " USING (SELECT "+", ".join("%s AS "+column for column in columns)+") AS source" \
+            " ON target."+natural_key+"="+key_expression+ \
+            " AND target.agile_type=source.agile_type" \
+            " WHEN MATCHED THEN UPDATE SET "+", ".join(column+"=source."+column for column in updated)+ \
+            " WHEN NOT MATCHED THEN INSERT ("+",".join(columns)+")" \
+            " VALUES ("+", ".join("source."+column for column in columns)+")" \
+            " OUTPUT inserted.agile_id INTO @agile_ids;" \
+            " SELECT agile_id FROM @agile_ids;"
+
+    def execute_single_upsert(self, agile_type, natural_key, data):
+        """
+        Executes the upsert of one record without committing it.
+
+        Returns:
+            str: The ID of the record.
+        """
+        if natural_key not in data or data[natural_key] is None:
+            raise ValueError("The data has no value for the natural key " + natural_key)
+        self.migrator.move_record(
+            self.cursor, agile_type,
+            self.query.typed_expression(
+                natural_key, self.query.get_declared_type(agile_type, natural_key)
+            ),
+            data[natural_key]
+        )
+        sql = self.create_upsert_sql(agile_type, natural_key)
+        stored, columns, column_values = self.storage.strip(agile_type, data)
+        sql_tuple = (agile_type, json.dumps(stored)) + column_values
+        if self.ttl.has_ttl(agile_type):
+            sql_tuple += (self.ttl.compute_expiry(agile_type, data),)
+        self.cursor.execute(sql, sql_tuple)
+        if self.type == "mariaDb":
+            # ON DUPLICATE KEY UPDATE can't return the ID of an updated row,
+            # it is found with the hashed key of the written document
+            self.cursor.execute(
+                "SELECT agile_id FROM "+self.get_table_name(agile_type)+
+                " WHERE "+self.query.get_natural_key_column(agile_type)+
+                "=SHA2("+self.query.text_expression(natural_key, "%s")+", 256)"
+                " AND agile_type=%s",
+                (sql_tuple[1], agile_type)
+            )
+        return str(self.cursor.fetchone()['agile_id'])
+
+    def execute_upsert(self, json_object):
+        """
+        Executes an upsert without committing it.
+
+        Args:
+            json_object (dict): A dictionary containing the type and the data.
+
+        Returns:
+            obj: The ID of the record or the list of IDs for a list of records.
+        """
+        agile_type = json_object["type"]
+        data = json_object["data"]
+        natural_key = self.query.get_natural_key(agile_type)
+        if natural_key is None:
+            raise ValueError("The type " + agile_type + " has no naturalKey")
+        if isinstance(data, list):
+            return [
+                self.execute_single_upsert(agile_type, natural_key, single_data)
+                for single_data in data
+            ]
+        return self.execute_single_upsert(agile_type, natural_key, data)
+
+    def execute_write(self, operation, json_object):
+        """
+        Executes a write operation without committing it.
+
+        Args:
+            operation (str): post, put, delete or upsert.
+            json_object (dict): The body of the request.
+
+        Returns:
+            obj: The result of the operation, the new ID for posts.
+        """
+        self.set_statement_timeout(operation, json_object["type"])
+        if operation == "post":
+            return self.execute_post(json_object)
+        if operation == "put":
+            return self.execute_put(json_object)
+        if operation == "delete":
+            return self.execute_delete(json_object)
+        if operation == "upsert":
+            return self.execute_upsert(json_object)
+        raise ValueError("Unknown write operation: " + operation)
+
+    def write(self, operation, json_object):
+        """
+        Executes and commits a write operation. Writes of types with a
+        write buffer are handed to the buffer, which commits them in groups.
+
+        Args:
+            operation (str): post, put, delete or upsert.
+            json_object (dict): The body of the request.
+
+        Returns:
+            obj: The result of the operation, the new ID for posts.
+        """
+        agile_type = json_object["type"]
+        tracer.tag(operation, agile_type)
+        if agile_type in self.write_buffers:
+            with tracer.span("buffer"):
+                return self.write_buffers[agile_type].submit(operation, json_object)
+        with self.lock:
+            try:
+                with tracer.span("execute"):
+                    result = self.execute_write(operation, json_object)
+                with tracer.span("commit"):
+                    self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+            # GETs of the type run with the lock, so none of them reads the
+            # state before the commit once the lock is released
+            self.coalescer.invalidate(agile_type)
+        return result
+
+    def get_summary(self, json_object):
+        """
+        Reads a summary of a type. Summaries are kept up to date by triggers,
+        so reading them costs one row per group.
+
+        Args:
+            json_object (dict): A dictionary containing the type and the name
+            of the summary.
+
+        Returns:
+            str: The groups of the summary with count and sums as JSON array.
+        """
+        tracer.tag("summary", json_object["type"])
+        with tracer.span("build"):
+            sql = self.summary.create_read_sql(json_object["type"], json_object["summary"])
+        with self.lock:
+            try:
+                self.set_statement_timeout("summary", json_object["type"])
+                with tracer.span("execute"):
+                    self.cursor.execute(sql)
+                    if self.type == "postgres":
+                        self.connection.commit()
+                with tracer.span("fetch"):
+                    result = self.cursor.fetchall()
+                    description = self.cursor.description
+            except Exception:
+                if self.type == "postgres":
+                    self.connection.rollback()
+                raise
+        with tracer.span("serialize"):
+            return json.dumps(self.converter.convert(result, description))
+
+    def export(self, json_object):
+        """
+        Exports all records of a type as stream.
+
+        Args:
+            json_object (dict): A dictionary containing the type, optional
+            where conditions, the format (ndjson or copy) and the batch size.
+
+        Returns:
+            generator: The exported lines in batches.
+        """
+        lines = self.bulk.export(
+            json_object["type"],
+            self.get_from_json("where", json_object),
+            json_object.get("format", "ndjson"),
+            int(json_object.get("batch_size", 1000))
+        )
+        return self.connected_stream(lines, "export", json_object["type"])
+
+    def get_migrations(self):
+        """
+        Shows the pending migrations of types to their tables.
+
+        Returns:
+            str: The type, the old and new table and the moved records of
+            every migration as JSON array.
+        """
+        return json.dumps(self.migrator.get_status())
+
+    def get_advice(self):
+        """
+        Shows the columns and indexes suggested by the GETs of the server.
+
+        Returns:
+            str: The suggestions ranked by their estimated savings and the
+            counted fields of every type as JSON.
+        """
+        return json.dumps(self.advisor.get_report())
+
+    def connected_stream(self, create_lines, operation, agile_type):
+        """
+        Reads a stream from a connection of its own, so a slow client never
+        holds the lock of the server connection. The connection is closed
+        when the stream ends.
+
+        Args:
+            create_lines (function): Creates the stream from the connection.
+            operation (str): The operation limited by its statement timeout.
+            agile_type (str): The type of the request.
+        """
+        tracer.tag(operation, agile_type)
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            try:
+                self.set_statement_timeout(operation, agile_type, cursor)
+            finally:
+                cursor.close()
+            with tracer.span("stream"):
+                for line in create_lines(connection):
+                    yield line
+        finally:
+            connection.close()
+
+    def import_data(self, agile_type, stream, data_format="ndjson", chunk_size=5000):
+        """
+        Imports a stream of records into a type in chunked transactions on a
+        connection of its own, so requests are not blocked while a large
+        file is read. Running GETs of the type are invalidated after every
+        chunk.
+
+        Args:
+            agile_type (str): The type of the records.
+            stream (file): The stream with one record per line.
+            data_format (str): ndjson or copy.
+            chunk_size (int): The number of rows per transaction.
+
+        Returns:
+            dict: The number of imported rows and chunks.
+        """
+        def progress(imported):
+            with self.lock:
+                self.coalescer.invalidate(agile_type)
+            print("Import", agile_type, imported, "rows")
+        connection = self.connect()
+        try:
+            return self.bulk.import_data(
+                connection, agile_type, stream, data_format, chunk_size,
+                progress
+            )
+        finally:
+            connection.close()
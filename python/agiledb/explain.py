@@ -0,0 +1,339 @@
+import json
+import threading
+import xml.etree.ElementTree
+
+
+class AgileExplain:
+    """
+    Shows how the database executes a GET request.
+
+    The request is compiled through the same path as GET and explained
+    with EXPLAIN (FORMAT JSON) on Postgres, EXPLAIN FORMAT=JSON on
+    MariaDB and SHOWPLAN_XML on MSSQL. The summary lists the full scans
+    with their estimated rows, the used indexes and the compared fields
+    without an index in the config of the type.
+
+    With ``planWarnings`` in ``server`` every GET shape, the SQL without
+    its parameters, is explained once after it ran ``hotThreshold``
+    times and a warning is logged if it scans more than ``minRows``
+    estimated rows.
+    """
+
+    showplan_namespace = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+    mssql_scans = ["Table Scan", "Clustered Index Scan", "Index Scan"]
+    mssql_seeks = ["Index Seek", "Clustered Index Seek"]
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.shapes = {}
+        self.shapes_lock = threading.Lock()
+
+    def get_indexed_fields(self, agile_type):
+        """
+        Returns the fields which lead an index of the type.
+        """
+        query = self.database.query
+        type_config = query.get_type_config(agile_type)
+        fields = []
+        for index in (type_config.get("indices") or {}):
+            field = index.split(",")[0].strip()
+            if self.database.type != "postgres" and \
+                    not query.is_column(agile_type, field):
+                # MariaDB and MSSQL only index promoted columns
+                continue
+            fields.append(field)
+        natural_key = type_config.get("naturalKey")
+        if natural_key is not None:
+            fields.append(natural_key)
+        return fields
+
+    def find_unindexed_fields(self, json_object):
+        """
+        Returns the compared fields of a request without an index.
+        """
+        agile_type = json_object["type"]
+        where = self.database.get_from_json("where", json_object)
+        indexed = self.get_indexed_fields(agile_type)
+        return [
+            field for field in self.database.query.get_where_fields(where)
+            if field not in indexed and field != "agile_id"
+        ]
+
+    def create_sql(self, json_object):
+        """
+        Compiles a GET request like GET does.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        if self.database.columnar.is_columnar(json_object):
+            projection = self.database.columnar.create_projection(json_object)[1]
+        else:
+            projection = self.database.create_get_projection(json_object)
+        return self.database.create_get_sql(json_object, projection)
+
+    def run_explain(self, sql, sql_tuple, analyze=False, agile_type=None):
+        """
+        Explains a statement without executing it, on Postgres with analyze
+        it is executed, limited by the statement timeout of GETs of the type.
+
+        Returns:
+            obj: The plan as JSON object or, on MSSQL, as XML string.
+        """
+        database = self.database
+        with database.lock:
+            cursor = database.connection.cursor()
+            try:
+                if database.type == "postgres":
+                    if analyze:
+                        database.set_statement_timeout("get", agile_type, cursor)
+                    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+                    cursor.execute("EXPLAIN (" + options + ") " + sql, sql_tuple)
+                    plan = cursor.fetchone()[0]
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    database.connection.commit()
+                    return plan
+                if database.type == "mariaDb":
+                    cursor.execute("EXPLAIN FORMAT=JSON " + sql, sql_tuple)
+                    return json.loads(cursor.fetchone()[0])
+                cursor.execute("SET SHOWPLAN_XML ON")
+                try:
+                    cursor.execute(sql, sql_tuple)
+                    return cursor.fetchone()[0]
+                finally:
+                    cursor.execute("SET SHOWPLAN_XML OFF")
+            except Exception:
+                if database.type == "postgres":
+                    database.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def summarize_postgres(self, plan):
+        """
+        Summarizes an EXPLAIN (FORMAT JSON) plan of Postgres.
+        """
+        root = plan[0]["Plan"]
+        summary = {
+            "estimated_rows": root.get("Plan Rows"),
+            "total_cost": root.get("Total Cost"),
+            "full_scans": [],
+            "indexes": [],
+            "missing_indexes": [],
+        }
+        if "Actual Rows" in root:
+            summary["actual_rows"] = root["Actual Rows"]
+        nodes = [root]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", []))
+            if node.get("Node Type") == "Seq Scan":
+                scan = {
+                    "table": node.get("Relation Name"),
+                    "estimated_rows": node.get("Plan Rows"),
+                    "filter": node.get("Filter"),
+                }
+                if "Actual Rows" in node:
+                    scan["actual_rows"] = node["Actual Rows"]
+                    scan["removed_rows"] = node.get("Rows Removed by Filter", 0)
+                summary["full_scans"].append(scan)
+            elif "Index Name" in node:
+                summary["indexes"].append(node["Index Name"])
+        return summary
+
+    def find_mariadb_tables(self, node, tables):
+        if isinstance(node, dict):
+            if "table_name" in node:
+                tables.append(node)
+            for value in node.values():
+                self.find_mariadb_tables(value, tables)
+        elif isinstance(node, list):
+            for value in node:
+                self.find_mariadb_tables(value, tables)
+        return tables
+
+    def summarize_mariadb(self, plan):
+        """
+        Summarizes an EXPLAIN FORMAT=JSON plan of MariaDB.
+        """
+        tables = self.find_mariadb_tables(plan, [])
+        summary = {
+            "estimated_rows": None,
+            "full_scans": [],
+            "indexes": [],
+            "missing_indexes": [],
+        }
+        for table in tables:
+            rows = table.get("rows")
+            if summary["estimated_rows"] is None and rows is not None:
+                summary["estimated_rows"] = int(rows * table.get("filtered", 100) / 100)
+            if table.get("access_type") in ["ALL", "index"]:
+                summary["full_scans"].append({
+                    "table": table.get("table_name"),
+                    "estimated_rows": rows,
+                    "filter": table.get("attached_condition"),
+                    "possible_keys": table.get("possible_keys"),
+                })
+            if table.get("key") is not None:
+                summary["indexes"].append(table["key"])
+        return summary
+
+    def summarize_mssql(self, plan):
+        """
+        Summarizes a SHOWPLAN_XML plan of MSSQL, including the missing
+        indexes reported by the optimizer.
+        """
+        namespace = self.showplan_namespace
+        root = xml.etree.ElementTree.fromstring(plan)
+        summary = {
+            "estimated_rows": None,
+            "full_scans": [],
+            "indexes": [],
+            "missing_indexes": [],
+        }
+        statement = root.find(".//" + namespace + "StmtSimple")
+        if statement is not None and statement.get("StatementEstRows") is not None:
+            summary["estimated_rows"] = float(statement.get("StatementEstRows"))
+        for operator in root.iter(namespace + "RelOp"):
+            physical_op = operator.get("PhysicalOp")
+            if physical_op not in self.mssql_scans + self.mssql_seeks:
+                continue
+            table = None
+            index = None
+            predicate = None
+            for child in operator:
+                scanned = child.find(namespace + "Object")
+                if scanned is None:
+                    continue
+                table = scanned.get("Table")
+                index = scanned.get("Index")
+                condition = child.find(namespace + "Predicate/" + namespace + "ScalarOperator")
+                if condition is not None:
+                    predicate = condition.get("ScalarString")
+            if physical_op in self.mssql_scans:
+                summary["full_scans"].append({
+                    "table": table,
+                    "estimated_rows": float(operator.get("EstimateRows", 0)),
+                    "filter": predicate,
+                    "operator": physical_op,
+                })
+            if index is not None:
+                summary["indexes"].append(index)
+        for missing in root.iter(namespace + "MissingIndex"):
+            columns = {}
+            for group in missing.iter(namespace + "ColumnGroup"):
+                columns[group.get("Usage").lower()] = [
+                    column.get("Name") for column in group.iter(namespace + "Column")
+                ]
+            summary["missing_indexes"].append({
+                "table": missing.get("Table"),
+                "columns": columns,
+                "source": "optimizer",
+            })
+        return summary
+
+    def summarize(self, plan):
+        if self.database.type == "postgres":
+            return self.summarize_postgres(plan)
+        if self.database.type == "mariaDb":
+            return self.summarize_mariadb(plan)
+        return self.summarize_mssql(plan)
+
+    def create_warnings(self, summary):
+        """
+        Describes the problems of a summary as text.
+        """
+        warnings = []
+        for scan in summary["full_scans"]:
+            warning = "Full scan of " + str(scan["table"]) + \
+                " (estimated " + str(scan["estimated_rows"]) + " rows)"
+            if scan.get("filter"):
+                warning += " filtering " + str(scan["filter"])
+            warnings.append(warning)
+        for missing in summary["missing_indexes"]:
+            if missing.get("source") == "config":
+                warnings.append("No index on " + missing["field"] + " in the config of the type")
+            else:
+                warnings.append("Missing index on " + str(missing["table"]) + ": " +
+                                json.dumps(missing["columns"]))
+        return warnings
+
+    def explain(self, json_object):
+        """
+        Explains a GET request.
+
+        Args:
+            json_object (dict): The body of a GET request, with analyze
+            the query is executed on Postgres.
+
+        Returns:
+            dict: The SQL, its parameters, the plan and the summary.
+        """
+        sql, sql_tuple = self.create_sql(json_object)
+        plan = self.run_explain(
+            sql, sql_tuple, json_object.get("analyze") is True, json_object["type"]
+        )
+        summary = self.summarize(plan)
+        for field in self.find_unindexed_fields(json_object):
+            summary["missing_indexes"].append({
+                "table": self.database.get_table_name(json_object["type"]),
+                "field": field,
+                "source": "config",
+            })
+        summary["warnings"] = self.create_warnings(summary)
+        return {"sql": sql, "parameters": list(sql_tuple), "plan": plan, "summary": summary}
+
+    def reset(self):
+        """
+        Forgets the counted GET shapes, e.g. after new indexes changed the plans.
+        """
+        with self.shapes_lock:
+            self.shapes = {}
+
+    def get_options(self):
+        server = self.database.config.get("server") or {}
+        options = server.get("planWarnings")
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        return options
+
+    def observe(self, sql, sql_tuple):
+        """
+        Counts the executions of a GET shape and explains it once when it
+        gets hot. Does nothing without planWarnings.
+        """
+        options = self.get_options()
+        if options is None:
+            return
+        threshold = int(options.get("hotThreshold", 100))
+        with self.shapes_lock:
+            count = self.shapes.get(sql, 0) + 1
+            if count > threshold:
+                return
+            if len(self.shapes) >= int(options.get("maxShapes", 10000)) and sql not in self.shapes:
+                return
+            self.shapes[sql] = count
+        if count < threshold:
+            return
+        try:
+            summary = self.summarize(self.run_explain(sql, sql_tuple))
+        except Exception as error:
+            print("Explain of hot GET failed:", error)
+            return
+        min_rows = float(options.get("minRows", 1000))
+        scans = [
+            scan for scan in summary["full_scans"]
+            if scan["estimated_rows"] is None or scan["estimated_rows"] >= min_rows
+        ]
+        if len(scans) > 0:
+            summary["full_scans"] = scans
+            print("Warning: hot GET scans:", sql)
+            for warning in self.create_warnings(summary):
+                print("  " + warning)
@@ -0,0 +1,494 @@
+import threading
+import time
+
+
+class AgileMigrator:
+    """
+    Moves the records of a type to its table while the server keeps running.
+
+    The table holding every type is registered in ``agile_meta_types``. When
+    the configured table of a type differs, a migration from the registered
+    table is recorded in ``agile_meta_migrations`` and a background thread
+    moves the records on its own connection in chunks ordered by
+    ``agile_id``. Every chunk locks its rows, copies and deletes them and
+    saves the last moved id in one transaction, so a crashed migration
+    resumes after the last committed chunk.
+
+    New records are written to the new table right away. Until the cutover
+    GET reads the union of both tables and writes of existing records move
+    the record first. When the old table holds no record of the type any
+    more, the migration is deleted and reads switch to the new table.
+    Types which are not registered yet are looked up once in the configured
+    tables and ``agile_main``.
+    """
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.migrations = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def get_options(self):
+        server = self.database.config.get("server") or {}
+        return server.get("migration") or {}
+
+    def get_batch_size(self):
+        return int(self.get_options().get("batchSize", 1000))
+
+    def get_batch_pause(self):
+        return float(self.get_options().get("batchPause", 0.05))
+
+    def get_migrations(self, agile_type):
+        """
+        Returns the pending migrations of a type.
+        """
+        return [
+            migration for migration in self.migrations
+            if migration["type"] == agile_type
+        ]
+
+    def is_migrating(self, agile_type):
+        return len(self.get_migrations(agile_type)) > 0
+
+    def get_status(self):
+        """
+        Returns the pending migrations with their progress.
+        """
+        return [dict(migration) for migration in self.migrations]
+
+    def create_tables_sql(self):
+        """
+        Creates the statements of the tables holding the registered tables
+        of the types and the pending migrations.
+        """
+        if self.database.type == "mssql":
+            return [
+                "IF OBJECT_ID('agile_meta_types', 'U') IS NULL"
+                " CREATE TABLE agile_meta_types ("
+                "agile_type nvarchar(255) NOT NULL PRIMARY KEY,"
+                " table_name nvarchar(255))",
+                "IF OBJECT_ID('agile_meta_migrations', 'U') IS NULL"
+                " CREATE TABLE agile_meta_migrations ("
+                "agile_type nvarchar(255) NOT NULL,"
+                " source_table nvarchar(255) NOT NULL,"
+                " target_table nvarchar(255),"
+                " last_id nvarchar(64),"
+                " moved_rows BIGINT DEFAULT 0,"
+                " updated_at DATETIME2,"
+                " PRIMARY KEY (agile_type, source_table))",
+            ]
+        timestamp = "TIMESTAMP" if self.database.type == "postgres" else "DATETIME"
+        return [
+            "CREATE TABLE IF NOT EXISTS agile_meta_types ("
+            "agile_type VARCHAR(255) NOT NULL PRIMARY KEY,"
+            " table_name VARCHAR(255))",
+            "CREATE TABLE IF NOT EXISTS agile_meta_migrations ("
+            "agile_type VARCHAR(255) NOT NULL,"
+            " source_table VARCHAR(255) NOT NULL,"
+            " target_table VARCHAR(255),"
+            " last_id VARCHAR(64),"
+            " moved_rows BIGINT DEFAULT 0,"
+            " updated_at " + timestamp + ","
+            " PRIMARY KEY (agile_type, source_table))",
+        ]
+
+    def create_exists_sql(self, table_name):
+        """
+        Creates the statement checking if a table holds records of a type.
+        """
+        if self.database.type == "mssql":
+            return "SELECT TOP 1 1 FROM " + table_name + " WHERE agile_type=%s"
+        return "SELECT 1 FROM " + table_name + " WHERE agile_type=%s LIMIT 1"
+
+    def get_candidate_tables(self):
+        """
+        Returns the tables the server creates, which can hold records of a
+        type which is not registered yet.
+        """
+        tables = ["agile_main"]
+        for table in self.database.config.get("tables") or {}:
+            tables.append("agile_" + table)
+        return tables
+
+    def find_source_tables(self, cursor, agile_type, target):
+        sources = []
+        for table_name in self.get_candidate_tables():
+            if table_name == target:
+                continue
+            cursor.execute(self.create_exists_sql(table_name), (agile_type,))
+            if len(cursor.fetchall()) > 0:
+                sources.append(table_name)
+        return sources
+
+    def add_migration(self, cursor, agile_type, source, target):
+        cursor.execute(
+            "DELETE FROM agile_meta_migrations"
+            " WHERE agile_type=%s AND source_table=%s",
+            (agile_type, source)
+        )
+        cursor.execute(
+            "INSERT INTO agile_meta_migrations"
+            " (agile_type, source_table, target_table, moved_rows, updated_at)"
+            " VALUES (%s, %s, %s, 0, %s)",
+            (agile_type, source, target, self.database.ttl.now())
+        )
+
+    def plan(self):
+        """
+        Compares the registered with the configured tables of the types and
+        records the migrations of moved types. It reads two small tables and
+        looks up types only once, when they are not registered yet.
+        """
+        database = self.database
+        with database.lock, self.lock:
+            cursor = database.connection.cursor()
+            try:
+                for sql in self.create_tables_sql():
+                    cursor.execute(sql)
+                cursor.execute("SELECT agile_type, table_name FROM agile_meta_types")
+                registered = {row[0]: row[1] for row in cursor.fetchall()}
+                for agile_type in database.config.get("types") or {}:
+                    target = database.get_table_name(agile_type)
+                    if agile_type not in registered:
+                        for source in self.find_source_tables(cursor, agile_type, target):
+                            self.add_migration(cursor, agile_type, source, target)
+                        cursor.execute(
+                            "INSERT INTO agile_meta_types (agile_type, table_name)"
+                            " VALUES (%s, %s)",
+                            (agile_type, target)
+                        )
+                        continue
+                    if registered[agile_type] == target:
+                        continue
+                    self.add_migration(cursor, agile_type, registered[agile_type], target)
+                    # Pending migrations of an earlier move follow the type
+                    cursor.execute(
+                        "UPDATE agile_meta_migrations SET target_table=%s"
+                        " WHERE agile_type=%s",
+                        (target, agile_type)
+                    )
+                    cursor.execute(
+                        "DELETE FROM agile_meta_migrations"
+                        " WHERE agile_type=%s AND source_table=%s",
+                        (agile_type, target)
+                    )
+                    cursor.execute(
+                        "UPDATE agile_meta_types SET table_name=%s"
+                        " WHERE agile_type=%s",
+                        (target, agile_type)
+                    )
+                cursor.execute(
+                    "SELECT agile_type, source_table, target_table, last_id,"
+                    " moved_rows FROM agile_meta_migrations"
+                )
+                migrations = [
+                    {
+                        "type": row[0],
+                        "source": row[1],
+                        "target": row[2],
+                        "last_id": row[3],
+                        "moved": int(row[4] or 0),
+                    }
+                    for row in cursor.fetchall()
+                ]
+                database.connection.commit()
+            except Exception:
+                database.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+            self.migrations = migrations
+        for migration in migrations:
+            print("Migrating", migration["type"], "from", migration["source"],
+                  "to", migration["target"], "after", migration["moved"], "moved records")
+
+    def get_moved_columns(self, agile_type):
+        columns = ["agile_id", "agile_type", "data"]
+        if self.database.ttl.has_ttl(agile_type):
+            columns.append("agile_expires")
+        return columns
+
+    def create_lock_sql(self, table_name, predicate, limit=None, skip_locked=False):
+        """
+        Creates the SELECT locking the records of a move, ordered by id.
+
+        Postgres skips records locked by writes, MSSQL reads past them, the
+        writes move these records themselves.
+        """
+        if self.database.type == "mssql":
+            hints = "UPDLOCK, ROWLOCK, READPAST" if skip_locked else "UPDLOCK, HOLDLOCK"
+            top = "TOP (" + str(int(limit)) + ") " if limit is not None else ""
+            return "SELECT " + top + "agile_id FROM " + table_name + \
+                " WITH (" + hints + ") WHERE " + predicate + " ORDER BY agile_id"
+        sql = "SELECT agile_id FROM " + table_name + " WHERE " + predicate + \
+            " ORDER BY agile_id"
+        if limit is not None:
+            sql += " LIMIT " + str(int(limit))
+        sql += " FOR UPDATE"
+        if skip_locked and self.database.type == "postgres":
+            sql += " SKIP LOCKED"
+        return sql
+
+    def move_rows(self, cursor, migration, predicate, sql_tuple):
+        """
+        Copies and deletes the records of a migration matching a predicate,
+        without committing. The records have to be locked.
+
+        The document is read whole from the old table, the plain columns of
+        a stripped type are filled from it.
+        """
+        agile_type = migration["type"]
+        storage = self.database.storage
+        columns = self.get_moved_columns(agile_type)
+        document = storage.create_source_document(agile_type, migration["source"])
+        expressions = [document if column == "data" else column for column in columns]
+        for column, declared_type in storage.get_stripped_columns(agile_type).items():
+            columns.append(column)
+            expressions.append(
+                self.database.query.typed_expression(column, declared_type, document)
+            )
+        cursor.execute(
+            "INSERT INTO " + migration["target"] + " (" + ",".join(columns) + ")"
+            " SELECT " + ",".join(expressions) + " FROM " + migration["source"] +
+            " WHERE " + predicate,
+            sql_tuple
+        )
+        cursor.execute(
+            "DELETE FROM " + migration["source"] + " WHERE " + predicate,
+            sql_tuple
+        )
+
+    def move_record(self, cursor, agile_type, expression, value):
+        """
+        Moves the records of a type with the given value of an expression to
+        the new table before a write, in the transaction of the write.
+
+        Args:
+            cursor (cursor): The cursor of the write.
+            agile_type (str): The type of the record.
+            expression (str): The compared expression, e.g. agile_id.
+            value (obj): The compared value.
+        """
+        predicate = "agile_type=%s AND " + expression + "=%s"
+        for migration in self.get_migrations(agile_type):
+            cursor.execute(
+                self.create_lock_sql(migration["source"], predicate),
+                (agile_type, value)
+            )
+            if len(cursor.fetchall()) == 0:
+                continue
+            self.move_rows(cursor, migration, predicate, (agile_type, value))
+
+    def create_read_table(self, agile_type):
+        """
+        Creates the table GET reads a type from. While the type is migrating
+        it is the union of the new and the old tables, with the columns of
+        the new table computed from the document for the old ones, named
+        like the new table. Documents of the old tables are read whole, the
+        type can have been stripped there.
+
+        Returns:
+            tuple: The table expression and its parameters.
+        """
+        table_name = self.database.get_table_name(agile_type)
+        migrations = self.get_migrations(agile_type)
+        if len(migrations) == 0:
+            return table_name, ()
+        query = self.database.query
+        names = ["agile_id", "agile_type", "data"]
+        for column in query.get_columns(agile_type):
+            names.append(query.check_column_name(column))
+        if query.get_search(agile_type) is not None and self.database.type == "postgres":
+            names.append(query.get_search_column(agile_type))
+        if self.database.ttl.has_ttl(agile_type):
+            names.append("agile_expires")
+        selects = ["SELECT " + ", ".join(names) + " FROM " + table_name +
+                   " WHERE agile_type=%s"]
+        for migration in migrations:
+            document = self.database.storage.create_source_document(
+                agile_type, migration["source"]
+            )
+            expressions = ["agile_id", "agile_type", document]
+            for column, column_type in query.get_columns(agile_type).items():
+                expressions.append(query.typed_expression(column, column_type, document))
+            if query.get_search(agile_type) is not None and self.database.type == "postgres":
+                expressions.append(query.create_search_document(agile_type))
+            if self.database.ttl.has_ttl(agile_type):
+                expressions.append("agile_expires")
+            selects.append(
+                "SELECT " + ", ".join(
+                    expression if expression == name else expression + " AS " + name
+                    for name, expression in zip(names, expressions)
+                ) + " FROM " + migration["source"] + " WHERE agile_type=%s"
+            )
+        return "(" + " UNION ALL ".join(selects) + ") AS " + table_name, \
+            (agile_type,) * len(selects)
+
+    def prepare_source(self, connection, cursor, migration):
+        """
+        Prepares the old table: the index on agile_id for the ordered chunks
+        and the expiry column of types with a ttl.
+        """
+        source = migration["source"]
+        db_type = self.database.type
+        if db_type == "postgres":
+            connection.autocommit = True
+            try:
+                cursor.execute(
+                    "CREATE INDEX CONCURRENTLY IF NOT EXISTS " + source +
+                    "_agile_id_idx ON " + source + " (agile_id)"
+                )
+            finally:
+                connection.autocommit = False
+        elif db_type == "mssql":
+            online = ""
+            if self.database.config_database.get("onlineIndexes") is True:
+                online = " WITH (ONLINE = ON)"
+            cursor.execute(
+                "IF NOT EXISTS(SELECT * FROM sys.indexes WHERE Name = 'IDX_" +
+                source + "agile_id') CREATE NONCLUSTERED INDEX IDX_" + source +
+                "agile_id ON " + source + "(agile_id)" + online
+            )
+        if self.database.ttl.has_ttl(migration["type"]):
+            if db_type == "postgres":
+                cursor.execute("ALTER TABLE " + source +
+                               " ADD COLUMN IF NOT EXISTS agile_expires TIMESTAMP")
+            elif db_type == "mariaDb":
+                cursor.execute("ALTER TABLE " + source +
+                               " ADD COLUMN IF NOT EXISTS agile_expires DATETIME NULL")
+            else:
+                cursor.execute("IF COL_LENGTH('" + source + "', 'agile_expires') IS NULL"
+                               " ALTER TABLE " + source + " ADD agile_expires DATETIME2 NULL")
+        connection.commit()
+
+    def move_chunk(self, connection, cursor, migration, batch_size):
+        """
+        Moves the next chunk of a migration and saves the progress in the
+        same transaction.
+
+        Returns:
+            int: The number of moved records.
+        """
+        predicate = "agile_type=%s"
+        sql_tuple = (migration["type"],)
+        if migration["last_id"] is not None:
+            predicate += " AND agile_id > %s"
+            sql_tuple += (migration["last_id"],)
+        cursor.execute(
+            self.create_lock_sql(migration["source"], predicate, batch_size, True),
+            sql_tuple
+        )
+        ids = [str(row[0]) for row in cursor.fetchall()]
+        if len(ids) == 0:
+            connection.rollback()
+            return 0
+        id_predicate = "agile_id IN (" + ", ".join(["%s"] * len(ids)) + ")"
+        self.move_rows(cursor, migration, id_predicate, tuple(ids))
+        cursor.execute(
+            "UPDATE agile_meta_migrations SET last_id=%s,"
+            " moved_rows=moved_rows+%s, updated_at=%s"
+            " WHERE agile_type=%s AND source_table=%s",
+            (ids[-1], len(ids), self.database.ttl.now(),
+             migration["type"], migration["source"])
+        )
+        connection.commit()
+        migration["last_id"] = ids[-1]
+        migration["moved"] += len(ids)
+        return len(ids)
+
+    def cutover(self, connection, cursor, migration):
+        """
+        Finishes a migration, reads of the type switch to the new table.
+        """
+        cursor.execute(
+            "DELETE FROM agile_meta_migrations"
+            " WHERE agile_type=%s AND source_table=%s",
+            (migration["type"], migration["source"])
+        )
+        connection.commit()
+        self.migrations = [
+            pending for pending in self.migrations
+            if pending is not migration
+        ]
+        print("Migrated", migration["type"], "from", migration["source"],
+              "to", migration["target"] + ",", migration["moved"], "records moved")
+
+    def step(self, connection, cursor, prepared):
+        """
+        Moves one chunk of the first pending migration.
+
+        Returns:
+            bool: False if no migration is pending.
+        """
+        with self.lock:
+            if len(self.migrations) == 0:
+                self.thread = None
+                return False
+            migration = self.migrations[0]
+            key = (migration["type"], migration["source"])
+            if key not in prepared:
+                self.prepare_source(connection, cursor, migration)
+                prepared.add(key)
+            if self.move_chunk(connection, cursor, migration, self.get_batch_size()) > 0:
+                return True
+            if migration["last_id"] is not None:
+                # Records skipped as locked are moved by a last pass
+                migration["last_id"] = None
+                return True
+            self.cutover(connection, cursor, migration)
+            return True
+
+    def run(self):
+        """
+        Works through the pending migrations chunk by chunk.
+        """
+        connection = self.database.connect()
+        cursor = connection.cursor()
+        prepared = set()
+        reported = time.monotonic()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    if not self.step(connection, cursor, prepared):
+                        return
+                except Exception as error:
+                    connection.rollback()
+                    print("Migration chunk failed:", error)
+                    self.stopped.wait(5)
+                    continue
+                if time.monotonic() - reported > 10:
+                    reported = time.monotonic()
+                    for migration in self.migrations:
+                        print("Migrating", migration["type"] + ":",
+                              migration["moved"], "records moved")
+                self.stopped.wait(self.get_batch_pause())
+        finally:
+            cursor.close()
+            connection.close()
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+
+    def start(self):
+        """
+        Starts the migration thread if a migration is pending.
+        """
+        with self.lock:
+            if len(self.migrations) == 0 or self.thread is not None or self.stopped.is_set():
+                return
+            self.thread = threading.Thread(
+                target=self.run, name="agile_migrator", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stops the migration thread after its current chunk. The moved
+        records are recorded, so the migration resumes on the next start.
+        """
+        self.stopped.set()
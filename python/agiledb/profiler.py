@@ -0,0 +1,357 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+from agiledb.admission import AdmittedBody
+
+
+class NoSpan:
+    """
+    The span of a request which is not traced, it measures nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+class Span:
+    """
+    A timed step of a traced request.
+    """
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.trace.spans.append((self.name, time.perf_counter() - self.start))
+        return False
+
+
+class Trace:
+    """
+    The spans of one traced request with its type and operation.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.agile_type = "-"
+        self.spans = []
+        self.start = time.perf_counter()
+
+
+class AgileTracer:
+    """
+    Times the steps of a sampled fraction of the requests.
+
+    While tracing is on, every request is traced with the probability
+    ``rate``. The drivers wrap their steps in ``span``, e.g. building the
+    SQL, waiting for the connection, executing, fetching and serializing,
+    and the timings are summed per type, operation and span. While tracing
+    is off, and for requests which are not sampled, ``span`` returns a
+    shared span measuring nothing, so the steps cost one attribute lookup.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.rate = 0
+        self.until = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.traced = 0
+
+    def start(self, seconds, rate):
+        """
+        Traces the requests for some seconds, the timings of the last
+        tracing are reset.
+
+        Args:
+            seconds (float): How long the requests are traced.
+            rate (float): The fraction of the requests which are traced.
+        """
+        if rate <= 0 or rate > 1:
+            raise ValueError("The rate has to be between 0 and 1")
+        with self.lock:
+            self.timings = {}
+            self.traced = 0
+            self.rate = rate
+            self.until = time.monotonic() + seconds
+            self.active = True
+
+    def stop(self):
+        self.active = False
+
+    def begin(self, operation):
+        """
+        Starts the trace of a request on the current thread if tracing is
+        on and the request is sampled.
+
+        Returns:
+            Trace: The trace or None.
+        """
+        if not self.active:
+            return None
+        if time.monotonic() >= self.until:
+            self.active = False
+            return None
+        if random.random() >= self.rate:
+            return None
+        trace = Trace(operation)
+        self.local.trace = trace
+        return trace
+
+    def end(self, trace):
+        """
+        Ends the trace of a request and adds its spans to the timings.
+        """
+        self.local.trace = None
+        total = time.perf_counter() - trace.start
+        with self.lock:
+            self.traced += 1
+            for name, duration in trace.spans + [("total", total)]:
+                key = (trace.agile_type, trace.operation, name)
+                timing = self.timings.get(key)
+                if timing is None:
+                    timing = [0, 0.0, 0.0]
+                    self.timings[key] = timing
+                timing[0] += 1
+                timing[1] += duration
+                timing[2] = max(timing[2], duration)
+
+    def tag(self, operation, agile_type):
+        """
+        Sets the operation and type of the traced request of the current
+        thread.
+        """
+        if not self.active:
+            return
+        trace = getattr(self.local, "trace", None)
+        if trace is not None:
+            trace.operation = operation
+            trace.agile_type = agile_type
+
+    def span(self, name):
+        """
+        Returns the span timing a step of the traced request of the current
+        thread, a span measuring nothing if the request isn't traced.
+        """
+        if not self.active:
+            return NO_SPAN
+        trace = getattr(self.local, "trace", None)
+        if trace is None:
+            return NO_SPAN
+        return Span(trace, name)
+
+    def get_status(self):
+        """
+        Returns the timings per type, operation and span in milliseconds.
+        """
+        with self.lock:
+            timings = [
+                {
+                    "type": agile_type,
+                    "operation": operation,
+                    "span": name,
+                    "count": count,
+                    "totalMs": round(total * 1000, 3),
+                    "avgMs": round(total * 1000 / count, 3),
+                    "maxMs": round(maximum * 1000, 3),
+                }
+                for (agile_type, operation, name), (count, total, maximum) in self.timings.items()
+            ]
+            return {
+                "active": self.active and time.monotonic() < self.until,
+                "rate": self.rate,
+                "traced": self.traced,
+                "timings": sorted(timings, key=lambda timing: -timing["totalMs"]),
+            }
+
+
+tracer = AgileTracer()
+
+
+class AgileSampler:
+    """
+    Samples the stacks of all threads for some seconds.
+
+    A thread reads the current frame of every other thread each
+    ``interval`` seconds and counts the stacks, which are exported in the
+    collapsed format of flamegraph tools, one stack per line from the
+    outermost frame with its number of samples. Nothing runs while the
+    sampler is off.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stacks = {}
+        self.samples = 0
+        self.interval = 0
+
+    def start(self, seconds, interval):
+        """
+        Samples the stacks in a thread for some seconds, the stacks of the
+        last sampling are reset.
+
+        Raises:
+            ValueError: If the sampler is already running.
+        """
+        if interval <= 0:
+            raise ValueError("The interval has to be positive")
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                raise ValueError("The profiler is already running")
+            self.stacks = {}
+            self.samples = 0
+            self.interval = interval
+            self.thread = threading.Thread(
+                target=self.run, args=(seconds, interval), daemon=True
+            )
+            self.thread.start()
+
+    def get_frame_name(self, frame):
+        code = frame.f_code
+        return os.path.basename(code.co_filename) + ":" + code.co_name
+
+    def sample(self):
+        own = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            names = []
+            while frame is not None:
+                names.append(self.get_frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+            stacks.append(";".join(names))
+        with self.lock:
+            self.samples += 1
+            for stack in stacks:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def run(self, seconds, interval):
+        until = time.monotonic() + seconds
+        while time.monotonic() < until:
+            self.sample()
+            time.sleep(interval)
+        print("Profiler took", self.samples, "samples")
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def get_collapsed(self):
+        """
+        Returns the counted stacks in the collapsed format.
+        """
+        with self.lock:
+            stacks = sorted(self.stacks.items(), key=lambda stack: -stack[1])
+        return "".join(stack + " " + str(count) + "\n" for stack, count in stacks)
+
+
+class AgileProfiler:
+    """
+    WSGI middleware serving the profiling endpoints of the server and
+    tracing the sampled requests.
+
+    ``POST /profile?seconds=10&interval=0.005`` samples the stacks of all
+    threads, ``GET /profile`` returns them collapsed for flamegraphs.
+    ``POST /trace?seconds=60&rate=0.1`` traces a fraction of the requests,
+    ``GET /trace`` returns the span timings per type and operation.
+    ``DELETE /trace`` stops tracing. Both run at most ``maxSeconds``.
+    """
+
+    profile_path = "/profile"
+    trace_path = "/trace"
+
+    def __init__(self, app, options=None):
+        """
+        Args:
+            app (function): The WSGI application.
+            options (dict): The profiler setting of the server.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        self.app = app
+        self.max_seconds = float(options.get("maxSeconds", 300))
+        self.sampler = AgileSampler()
+        self.tracer = tracer
+
+    def get_seconds(self, query, default):
+        seconds = float(query.get("seconds", [default])[0])
+        if seconds <= 0 or seconds > self.max_seconds:
+            raise ValueError("The seconds have to be between 0 and " + str(self.max_seconds))
+        return seconds
+
+    def handle(self, environ):
+        """
+        Answers a request to a profiling endpoint.
+
+        Returns:
+            tuple: The status, the content type and the body.
+        """
+        method = environ.get("REQUEST_METHOD")
+        query = parse_qs(environ.get("QUERY_STRING", ""))
+        if environ.get("PATH_INFO") == self.profile_path:
+            if method == "POST":
+                seconds = self.get_seconds(query, 10)
+                self.sampler.start(seconds, float(query.get("interval", [0.005])[0]))
+                return "200 OK", "application/json", json.dumps({"result": "OK", "seconds": seconds})
+            if method == "GET":
+                return "200 OK", "text/plain; charset=utf-8", self.sampler.get_collapsed()
+        else:
+            if method == "POST":
+                seconds = self.get_seconds(query, 60)
+                self.tracer.start(seconds, float(query.get("rate", [0.1])[0]))
+                return "200 OK", "application/json", json.dumps({"result": "OK", "seconds": seconds})
+            if method == "GET":
+                return "200 OK", "application/json", json.dumps(self.tracer.get_status())
+            if method == "DELETE":
+                self.tracer.stop()
+                return "200 OK", "application/json", json.dumps({"result": "OK"})
+        return "405 Method Not Allowed", "application/json", json.dumps({"error": "Method not allowed"})
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") in (self.profile_path, self.trace_path):
+            try:
+                status, content_type, body = self.handle(environ)
+            except ValueError as error:
+                status, content_type, body = "400 Bad Request", "application/json", \
+                    json.dumps({"error": str(error)})
+            start_response(status, [("Content-Type", content_type)])
+            return [body.encode("utf-8")]
+        trace = self.tracer.begin(
+            environ.get("REQUEST_METHOD", "") + " " + environ.get("PATH_INFO", "")
+        )
+        if trace is None:
+            return self.app(environ, start_response)
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            self.tracer.end(trace)
+            raise
+        if isinstance(body, (list, tuple)):
+            self.tracer.end(trace)
+            return body
+        ended = []
+
+        def end():
+            if len(ended) == 0:
+                ended.append(True)
+                self.tracer.end(trace)
+        return AdmittedBody(body, end)
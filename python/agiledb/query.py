@@ -0,0 +1,742 @@
+import re
+
+
+class AgileQuery:
+    """
+    Compiles the JSON query shapes of the API into SQL for one backend.
+
+    Field expressions are built from the declared types of a type in the
+    configuration. Promoted columns (``columns``) are used directly and
+    typed fields (``fields``) are cast to their declared type, so the
+    compiled predicates are textually identical to the expressions the
+    ``Agile*`` drivers index.
+    """
+
+    operator_list = [
+        "=", "!=", "<>", ">", "<", "<=", ">=",
+        "LIKE", "NOT LIKE",
+        "IN", "NOT IN",
+        "BETWEEN", "NOT BETWEEN",
+        "IS NULL", "IS NOT NULL",
+    ]
+    group_list = ["and", "or"]
+    table_columns = ["agile_id", "agile_type"]
+    simple_name = re.compile("^[A-Za-z_][A-Za-z0-9_]*$")
+    path_part = re.compile("^([^\\[\\]]+)((?:\\[[0-9]+\\])*)$")
+    path_index = re.compile("\\[([0-9]+)\\]")
+
+    cast_types = {
+        "postgres": {
+            "BOOL": "BOOLEAN",
+            "DATETIME": "TIMESTAMP",
+            "TIMESTAMP WITHOUT TIME ZONE": "TIMESTAMP",
+            "TIMESTAMP WITH TIME ZONE": "TIMESTAMPTZ",
+            "FLOAT": "DOUBLE PRECISION",
+            "DOUBLE": "DOUBLE PRECISION",
+        },
+        "mariaDb": {
+            "INTEGER": "SIGNED",
+            "INT": "SIGNED",
+            "BIGINT": "SIGNED",
+            "SMALLINT": "SIGNED",
+            "NUMERIC": "DECIMAL(38,10)",
+            "DECIMAL": "DECIMAL(38,10)",
+            "FLOAT": "DOUBLE",
+            "DOUBLE": "DOUBLE",
+            "REAL": "DOUBLE",
+            "DATE": "DATE",
+            "DATETIME": "DATETIME",
+            "TIMESTAMP": "DATETIME",
+            "TIME": "TIME",
+        },
+        "mssql": {
+            "INTEGER": "INT",
+            "NUMERIC": "DECIMAL(38,10)",
+            "DECIMAL": "DECIMAL(38,10)",
+            "DOUBLE": "FLOAT",
+            "REAL": "FLOAT",
+            "BOOL": "BIT",
+            "BOOLEAN": "BIT",
+            "DATETIME": "DATETIME2",
+            "TIMESTAMP": "DATETIME2",
+        },
+    }
+    text_types = ["TEXT", "VARCHAR", "CHAR", "NVARCHAR", "STRING", "JSON"]
+    # Casts of text to dates and times depend on the DateStyle and TimeZone
+    # of the session, so Postgres doesn't index them. They are done by
+    # IMMUTABLE functions with a fixed ISO date style and UTC instead.
+    postgres_cast_functions = {
+        "DATE": "agile_cast_date",
+        "TIME": "agile_cast_time",
+        "TIMESTAMP": "agile_cast_timestamp",
+        "TIMESTAMPTZ": "agile_cast_timestamptz",
+    }
+    # The JSON types of the document with values of an inferred type
+    json_types = {"BOOLEAN": "boolean", "DOUBLE": "number"}
+
+    def __init__(self, config, db_type):
+        """
+        Args:
+            config (dict): The server configuration.
+            db_type (str): The backend, one of postgres, mssql or mariaDb.
+        """
+        self.config = config
+        self.type = db_type
+
+    def get_type_config(self, agile_type):
+        """
+        Returns the configuration of a type or an empty dict.
+        """
+        types = self.config.get("types") or {}
+        return types.get(agile_type) or {}
+
+    def get_columns(self, agile_type):
+        """
+        Returns the promoted columns of a type as a dict of name to type.
+        """
+        return self.get_type_config(agile_type).get("columns") or {}
+
+    def get_fields(self, agile_type):
+        """
+        Returns the typed, not promoted fields of a type as a dict of
+        name to type.
+        """
+        return self.get_type_config(agile_type).get("fields") or {}
+
+    def is_column(self, agile_type, field):
+        """
+        Checks if a field is a promoted column or a column of every table.
+        """
+        return field in self.table_columns or \
+            field in self.get_columns(agile_type)
+
+    def get_natural_key(self, agile_type):
+        """
+        Returns the natural key of a type or None.
+
+        Raises:
+            ValueError: If the natural key is not a promoted column.
+        """
+        natural_key = self.get_type_config(agile_type).get("naturalKey")
+        if natural_key is None:
+            return None
+        if natural_key not in self.get_columns(agile_type):
+            raise ValueError(
+                "The naturalKey of " + agile_type + " has to be a column"
+            )
+        return self.check_column_name(natural_key)
+
+    def get_search(self, agile_type):
+        """
+        Returns the full text search setting of a type.
+
+        Returns:
+            tuple: The list of searched fields and the language, or None if
+            the type has no search.
+        """
+        search = self.get_type_config(agile_type).get("search")
+        if search is None:
+            return None
+        if isinstance(search, list):
+            search = {"fields": search}
+        fields = search.get("fields") or []
+        if len(fields) == 0:
+            return None
+        language = search.get("language", "english")
+        if self.simple_name.match(language) is None:
+            raise ValueError("Invalid search language: " + language)
+        return fields, language
+
+    def get_search_column(self, agile_type):
+        """
+        Returns the name of the generated column holding the searched text
+        of a type.
+        """
+        return self.check_column_name(
+            "agile_search_" + re.sub("[^A-Za-z0-9_]+", "_", agile_type)
+        )
+
+    def get_natural_key_column(self, agile_type):
+        """
+        Returns the name of the generated column holding the hashed natural
+        key of a type on MariaDB.
+        """
+        return self.check_column_name(
+            "agile_key_" + re.sub("[^A-Za-z0-9_]+", "_", agile_type)
+        )
+
+    def create_natural_key_hash(self, agile_type, natural_key, document="data"):
+        """
+        Builds the expression of the hashed natural key of a type on
+        MariaDB. It is NULL for rows of other types, so its unique index is
+        unique per type, and it hashes the whole key instead of a prefix.
+        """
+        return "IF(" + self.create_type_predicate(agile_type) + ", SHA2(" + \
+            self.text_expression(natural_key, document) + ", 256), NULL)"
+
+    def create_search_document(self, agile_type):
+        """
+        Builds the expression of the searched text of a type, the searched
+        fields joined with spaces. It is NULL for rows of other types, so
+        the index only holds the type.
+        """
+        fields, language = self.get_search(agile_type)
+        type_predicate = self.create_type_predicate(agile_type)
+        if self.type == "postgres":
+            text = " || ' ' || ".join(
+                "coalesce(" + self.text_expression(field) + ", '')"
+                for field in fields
+            )
+            return "CASE WHEN " + type_predicate + \
+                " THEN to_tsvector(" + self.quote_literal(language) + \
+                ", " + text + ") END"
+        text = "CONCAT_WS(' ', " + ", ".join(
+            self.text_expression(field) for field in fields
+        ) + ")"
+        if self.type == "mariaDb":
+            return "IF(" + type_predicate + ", " + text + ", NULL)"
+        return "CAST(CASE WHEN " + type_predicate + " THEN " + text + \
+            " END AS nvarchar(max))"
+
+    def compile_search(self, agile_type, table_name, text):
+        """
+        Compiles a full text search on the searched fields of a type.
+
+        Args:
+            agile_type (str): The type of the record.
+            table_name (str): The table of the type.
+            text (str): The searched text.
+
+        Raises:
+            ValueError: If the type has no search.
+
+        Returns:
+            tuple: The join, its parameters, the predicate, its parameters,
+            the ranking order and its parameters. Empty strings if a part
+            is not needed.
+        """
+        if self.get_search(agile_type) is None:
+            raise ValueError("The type " + agile_type + " has no search")
+        fields, language = self.get_search(agile_type)
+        column = self.get_search_column(agile_type)
+        if self.type == "postgres":
+            query = "websearch_to_tsquery(" + self.quote_literal(language) + \
+                ", %s)"
+            return "", (), column + " @@ " + query, (text,), \
+                "ts_rank(" + column + ", " + query + ") DESC", (text,)
+        if self.type == "mariaDb":
+            match = "MATCH(" + column + ") AGAINST (%s IN NATURAL LANGUAGE MODE)"
+            return "", (), match, (text,), match + " DESC", (text,)
+        join = "INNER JOIN FREETEXTTABLE(" + table_name + ", " + column + \
+            ", %s) AS agile_rank ON agile_rank.[KEY]=" + table_name + \
+            ".agile_id"
+        return join, (text,), "", (), "agile_rank.RANK DESC", ()
+
+    def create_type_predicate(self, agile_type):
+        """
+        Builds the predicate selecting a type with the type as literal,
+        as partial indexes need it.
+        """
+        return "agile_type = " + self.quote_literal(agile_type)
+
+    def get_declared_type(self, agile_type, field):
+        """
+        Returns the declared type of a field or None.
+        """
+        columns = self.get_columns(agile_type)
+        if field in columns:
+            return columns[field]
+        fields = self.get_fields(agile_type)
+        if field in fields:
+            return fields[field]
+        return None
+
+    def quote_literal(self, value):
+        """
+        Quotes a string as SQL literal.
+        """
+        return "'" + value.replace("'", "''") + "'"
+
+    def check_column_name(self, column):
+        """
+        Makes sure a promoted column can be used as SQL identifier.
+
+        Raises:
+            ValueError: If the column is not a plain identifier.
+        """
+        if self.simple_name.match(column) is None:
+            raise ValueError("Invalid column name: " + column)
+        return column
+
+    def get_cast_type(self, declared_type):
+        """
+        Maps a declared column type to the cast type of the backend.
+
+        Returns:
+            str: The cast type or None if the field is compared as text.
+        """
+        if declared_type is None:
+            return None
+        declared_type = declared_type.strip().upper()
+        if declared_type.split("(")[0] in self.text_types:
+            return None
+        mapping = self.cast_types.get(self.type, {})
+        if declared_type in mapping:
+            return mapping[declared_type]
+        if self.type == "mariaDb":
+            return None
+        return declared_type
+
+    def parse_path(self, field):
+        """
+        Splits a field path like ``address.city`` or ``items[0].name`` into
+        its keys and array indexes.
+
+        Raises:
+            ValueError: If the path is empty or malformed.
+
+        Returns:
+            list: The keys (str) and array indexes (int) of the path.
+        """
+        if "%" in field:
+            raise ValueError("Invalid field name: " + field)
+        segments = []
+        for part in field.split("."):
+            match = self.path_part.match(part)
+            if match is None:
+                raise ValueError("Invalid field path: " + field)
+            segments.append(match.group(1))
+            for index in self.path_index.findall(match.group(2)):
+                segments.append(int(index))
+        return segments
+
+    def json_path(self, field):
+        """
+        Builds the JSON path literal of a field for JSON_VALUE.
+        """
+        path = "$"
+        for segment in self.parse_path(field):
+            if isinstance(segment, int):
+                path += "[" + str(segment) + "]"
+            elif self.simple_name.match(segment):
+                path += "." + segment
+            else:
+                path += '."' + segment.replace('"', '\\"') + '"'
+        return self.quote_literal(path)
+
+    def postgres_path(self, field):
+        """
+        Builds the text array literal of a field path for the Postgres
+        ``#>`` and ``#>>`` operators.
+        """
+        elements = []
+        for segment in self.parse_path(field):
+            segment = str(segment)
+            if self.simple_name.match(segment) or segment.isdigit():
+                elements.append(segment)
+            else:
+                elements.append(
+                    '"' + segment.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                )
+        return self.quote_literal("{" + ",".join(elements) + "}")
+
+    def is_top_level(self, field):
+        """
+        Checks if a field is a plain key of the document.
+        """
+        segments = self.parse_path(field)
+        return len(segments) == 1 and isinstance(segments[0], str)
+
+    def text_expression(self, field, document="data"):
+        """
+        Builds the expression that reads a field of the document as text.
+
+        Args:
+            field (str): The field path.
+            document (str): The column holding the document, e.g.
+            ``NEW.data`` in triggers.
+        """
+        if self.type == "postgres":
+            if self.is_top_level(field):
+                return "(" + document + "->>" + self.quote_literal(field) + ")"
+            return "(" + document + "#>>" + self.postgres_path(field) + ")"
+        return "JSON_VALUE(" + document + "," + self.json_path(field) + ")"
+
+    def json_expression(self, field, declared_type=None):
+        """
+        Builds the expression that reads a field of the document as JSON
+        value, keeping numbers, objects and arrays of the document.
+
+        MSSQL has no single function for scalars and objects, so fields
+        declared as JSON are read with JSON_QUERY, declared scalars are
+        casted and all other fields are read as text.
+        """
+        if self.type == "postgres":
+            if self.is_top_level(field):
+                return "(data->" + self.quote_literal(field) + ")"
+            return "(data#>" + self.postgres_path(field) + ")"
+        if self.type == "mariaDb":
+            return "JSON_EXTRACT(data," + self.json_path(field) + ")"
+        if declared_type is not None and \
+                declared_type.strip().upper() == "JSON":
+            return "JSON_QUERY(data," + self.json_path(field) + ")"
+        return self.typed_expression(field, declared_type)
+
+    def typed_expression(self, field, declared_type, document="data"):
+        """
+        Builds the expression that reads a field of the document casted to
+        the declared type.
+
+        The Agile* drivers use this expression for expression indexes, so
+        it has to stay textually identical for both.
+        """
+        cast_type = self.get_cast_type(declared_type)
+        expression = self.text_expression(field, document)
+        if cast_type is None:
+            return expression
+        return self.cast_text(expression, cast_type)
+
+    def cast_text(self, expression, cast_type):
+        """
+        Casts a text expression to a cast type of the backend, on Postgres
+        dates and times with their IMMUTABLE cast function.
+        """
+        if self.type == "postgres" and cast_type in self.postgres_cast_functions:
+            return self.postgres_cast_functions[cast_type] + "(" + expression + ")"
+        return "CAST(" + expression + " AS " + cast_type + ")"
+
+    def infer_type(self, value):
+        """
+        Infers a declared type for undeclared fields from the compared value.
+        """
+        if isinstance(value, (list, tuple)) and len(value) > 0:
+            return self.infer_type(value[0])
+        if isinstance(value, bool):
+            return "BOOLEAN"
+        if isinstance(value, (int, float)):
+            return "DOUBLE"
+        return None
+
+    def inferred_expression(self, field, inferred_type):
+        """
+        Builds the expression of an undeclared field casted to the type
+        inferred from the compared value. Records of the type may hold any
+        other value in the field, which must not fail the query, so they
+        read as NULL: Postgres checks the JSON type before the cast, MSSQL
+        uses TRY_CAST and MariaDB casts without errors.
+        """
+        if inferred_type is None or self.type == "mariaDb":
+            return self.typed_expression(field, inferred_type)
+        if self.type == "postgres":
+            return "(CASE WHEN jsonb_typeof(" + self.json_expression(field) + \
+                ") = " + self.quote_literal(self.json_types[inferred_type]) + \
+                " THEN " + self.typed_expression(field, inferred_type) + " END)"
+        return "TRY_CAST(" + self.text_expression(field) + " AS " + \
+            self.get_cast_type(inferred_type) + ")"
+
+    def field_expression(self, agile_type, field, value=None, operator="="):
+        """
+        Builds the SQL expression of a field used in a predicate.
+
+        Args:
+            agile_type (str): The type of the record.
+            field (str): The field of the document.
+            value (obj): The compared value, used for undeclared fields.
+            operator (str): The operator of the predicate.
+
+        Returns:
+            str: The SQL expression.
+        """
+        if self.is_column(agile_type, field):
+            return self.check_column_name(field)
+        if operator in ["LIKE", "NOT LIKE"]:
+            return self.text_expression(field)
+        declared_type = self.get_declared_type(agile_type, field)
+        if declared_type is not None:
+            return self.typed_expression(field, declared_type)
+        inferred_type = self.infer_type(value)
+        if inferred_type == "BOOLEAN" and self.type != "postgres":
+            inferred_type = None
+        return self.inferred_expression(field, inferred_type)
+
+    def convert_value(self, agile_type, field, value):
+        """
+        Converts a compared value to the representation of the expression.
+
+        Booleans of undeclared fields are compared as JSON text on
+        MariaDB and MSSQL.
+        """
+        if isinstance(value, bool) and self.type != "postgres" and \
+                self.get_declared_type(agile_type, field) is None and \
+                not self.is_column(agile_type, field):
+            return "true" if value else "false"
+        return value
+
+    def compile_predicate(self, agile_type, field, value, operator):
+        """
+        Compiles one predicate.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        operator = operator.strip().upper()
+        if operator not in self.operator_list:
+            raise ValueError("Operator not supported: " + operator)
+        if value is None and operator in ["=", "!=", "<>"]:
+            operator = "IS NULL" if operator == "=" else "IS NOT NULL"
+        expression = self.field_expression(
+            agile_type, field, value, operator
+        )
+        if operator in ["IS NULL", "IS NOT NULL"]:
+            return expression + " " + operator, ()
+        if operator in ["IN", "NOT IN"]:
+            if not isinstance(value, (list, tuple)):
+                value = [value]
+            if len(value) == 0:
+                return ("1=0" if operator == "IN" else "1=1"), ()
+            values = tuple(
+                self.convert_value(agile_type, field, v) for v in value
+            )
+            placeholders = ",".join(["%s"] * len(values))
+            return expression + " " + operator + " (" + placeholders + ")", \
+                values
+        if operator in ["BETWEEN", "NOT BETWEEN"]:
+            if not isinstance(value, (list, tuple)) or len(value) != 2:
+                raise ValueError(operator + " expects a list of two values")
+            values = tuple(
+                self.convert_value(agile_type, field, v) for v in value
+            )
+            return expression + " " + operator + " %s AND %s", values
+        value = self.convert_value(agile_type, field, value)
+        return expression + " " + operator + " %s", (value,)
+
+    def compile_condition(self, agile_type, condition):
+        """
+        Compiles one entry of a where list.
+
+        An entry is either a group ``{"or": [...]}`` / ``{"and": [...]}``,
+        a nested list (AND) or a dict of field values with an optional
+        operator, which are joined with AND.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        if isinstance(condition, list):
+            return self.compile_group(agile_type, condition, "AND")
+        if not isinstance(condition, dict):
+            raise ValueError("Invalid where condition: " + str(condition))
+        parts = []
+        params = ()
+        operator = condition.get("operator", "=")
+        for key, value in condition.items():
+            if key == "operator" or key == "where":
+                continue
+            if key.lower() in self.group_list:
+                if not isinstance(value, list):
+                    raise ValueError(key + " expects a list of conditions")
+                sql, sql_params = self.compile_group(
+                    agile_type, value, key.upper()
+                )
+            else:
+                sql, sql_params = self.compile_predicate(
+                    agile_type, key, value, operator
+                )
+            parts.append(sql)
+            params += sql_params
+        if len(parts) == 0:
+            return "1=1", ()
+        if len(parts) == 1:
+            return parts[0], params
+        return "(" + " AND ".join(parts) + ")", params
+
+    def compile_group(self, agile_type, conditions, joiner):
+        """
+        Compiles a list of conditions joined with AND or OR.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        if len(conditions) == 0:
+            return ("1=1" if joiner == "AND" else "1=0"), ()
+        parts = []
+        params = ()
+        for condition in conditions:
+            sql, sql_params = self.compile_condition(agile_type, condition)
+            parts.append(sql)
+            params += sql_params
+        if len(parts) == 1:
+            return parts[0], params
+        return "(" + (" " + joiner + " ").join(parts) + ")", params
+
+    def get_where_fields(self, where):
+        """
+        Collects the fields compared in a where list, including nested
+        groups.
+
+        Returns:
+            list: The field names in their order.
+        """
+        fields = []
+        if isinstance(where, list):
+            for condition in where:
+                for field in self.get_where_fields(condition):
+                    if field not in fields:
+                        fields.append(field)
+            return fields
+        if not isinstance(where, dict):
+            return fields
+        for key, value in where.items():
+            if key == "operator" or key == "where":
+                continue
+            if key.lower() in self.group_list:
+                nested = self.get_where_fields(value)
+            else:
+                nested = [key]
+            for field in nested:
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def compile_where(self, agile_type, where):
+        """
+        Compiles the where list of a request. All entries are joined
+        with AND.
+
+        Args:
+            agile_type (str): The type of the record.
+            where (list): The where list of the request.
+
+        Returns:
+            tuple: The SQL string (without WHERE) and the tuple of
+            parameters. The string is empty if there is no condition.
+        """
+        if where is None or len(where) == 0:
+            return "", ()
+        if isinstance(where, dict):
+            where = [where]
+        return self.compile_group(agile_type, where, "AND")
+
+    def column_expression(self, agile_type, column):
+        """
+        Builds the projected expression of a table column.
+        """
+        if column == "agile_id":
+            if self.type == "mariaDb":
+                return "CAST(agile_id AS CHAR CHARACTER SET utf8)"
+            if self.type == "postgres":
+                return "CAST(agile_id AS TEXT)"
+        return self.check_column_name(column)
+
+    def add_projection_path(self, tree, keys, expression, column):
+        """
+        Adds one projected expression to the tree of output keys.
+
+        Raises:
+            ValueError: If two columns project into the same key.
+        """
+        node = tree
+        for key in keys[:-1]:
+            if key not in node:
+                node[key] = {}
+            node = node[key]
+            if not isinstance(node, dict):
+                raise ValueError("Conflicting projection: " + column)
+        if keys[-1] in node:
+            raise ValueError("Conflicting projection: " + column)
+        node[keys[-1]] = expression
+
+    def build_object(self, tree):
+        """
+        Renders a tree of output keys as JSON object constructor.
+        """
+        if self.type == "postgres":
+            function = "jsonb_build_object("
+        else:
+            function = "JSON_OBJECT("
+        arguments = []
+        for key, value in tree.items():
+            if isinstance(value, dict):
+                value = self.build_object(value)
+            arguments.append(self.quote_literal(key) + ", " + value)
+        return function + ", ".join(arguments) + ")"
+
+    def quote_alias(self, alias):
+        """
+        Quotes a column alias of MSSQL.
+        """
+        return "[" + alias.replace("]", "]]") + "]"
+
+    def compile_projection(self, agile_type, columns):
+        """
+        Compiles the requested columns into one JSON object per row, built
+        inside the database. Columns can be nested paths like
+        ``address.city`` or ``items[0].name``, the output object keeps the
+        nesting of the path.
+
+        Args:
+            agile_type (str): The type of the record.
+            columns (list): The requested columns.
+
+        Returns:
+            str: The SQL expression returning the JSON object as text.
+        """
+        tree = {}
+        aliases = []
+        for column in columns:
+            if self.is_column(agile_type, column):
+                expression = self.column_expression(agile_type, column)
+                keys = [column]
+            else:
+                declared_type = self.get_declared_type(agile_type, column)
+                expression = self.json_expression(column, declared_type)
+                keys = column.split(".")
+            self.add_projection_path(tree, keys, expression, column)
+            aliases.append(expression + " AS " + self.quote_alias(column))
+        if self.type == "mssql":
+            return "(SELECT " + ", ".join(aliases) + \
+                " FOR JSON PATH, INCLUDE_NULL_VALUES, WITHOUT_ARRAY_WRAPPER)"
+        if self.type == "postgres":
+            return self.build_object(tree) + "::text"
+        return self.build_object(tree)
+
+    def compile_columns(self, agile_type, columns=None):
+        """
+        Compiles the requested columns into one typed SQL expression per
+        column for columnar results. Without columns the id, the declared
+        columns and fields of the type are selected, or the id and the
+        document if the type declares none.
+
+        Args:
+            agile_type (str): The type of the record.
+            columns (list): The requested columns.
+
+        Returns:
+            list: Tuples of the column name, the SQL expression and the
+            declared type, None for text.
+        """
+        if columns is None or len(columns) == 0:
+            columns = ["agile_id"] + list(self.get_columns(agile_type)) + \
+                list(self.get_fields(agile_type))
+            if len(columns) == 1:
+                columns.append("data")
+        compiled = []
+        for column in columns:
+            if column in ["agile_id", "data"]:
+                expression = self.column_expression(agile_type, column)
+                if column == "data" and self.type == "postgres":
+                    expression = "CAST(data AS TEXT)"
+                compiled.append((column, expression, None))
+                continue
+            declared_type = self.get_declared_type(agile_type, column)
+            if self.is_column(agile_type, column):
+                expression = self.check_column_name(column)
+            elif declared_type is not None and \
+                    declared_type.strip().upper() == "JSON":
+                if self.type == "postgres":
+                    expression = self.text_expression(column)
+                else:
+                    expression = self.json_expression(column, declared_type)
+            else:
+                expression = self.typed_expression(column, declared_type)
+            compiled.append((column, expression, declared_type))
+        return compiled
@@ -0,0 +1,322 @@
+import json
+import re
+import threading
+import time
+import uuid
+from psycopg2.extras import RealDictCursor
+from agiledb.admission import AdmittedBody
+
+
+class AgileRawSql:
+    """
+    Runs the raw SQL of PATCH on a session of its own.
+
+    The session is opened on the first raw query, on the database of
+    ``replica`` if it is set, and is read only unless ``readOnly`` is
+    false: Postgres and MariaDB start every transaction read only, MSSQL
+    has no read only session, so its transactions are rolled back. The
+    session can't stop statements which end the transaction or change its
+    settings, so a read only session rejects them: Postgres and MariaDB
+    run a single statement without transaction control, SET or
+    set_config, MSSQL, which needs no semicolons between statements,
+    rejects these words anywhere. This is a best effort, only a read
+    only login in ``replica`` is safe. The statements run one at a time,
+    limited to ``timeout`` seconds, and never take the lock of the server
+    connection, so they don't block the writes of the API.
+
+    The rows are fetched in batches of ``batchSize`` through a streaming
+    cursor and sent as one JSON array while they are read. The result
+    ends after ``maxRows`` rows or ``maxBytes`` bytes, the cut is logged.
+    """
+
+    blocked_statements = [
+        "BEGIN", "START", "COMMIT", "END", "ROLLBACK", "ABORT", "SAVEPOINT",
+        "RELEASE", "SET", "RESET", "DISCARD", "DO", "CALL", "EXEC", "EXECUTE",
+        "PREPARE", "DEALLOCATE", "LOAD", "HANDLER", "SAVE",
+    ]
+    blocked_words = ["SET_CONFIG", "SP_EXECUTESQL"]
+    mssql_blocked_words = [
+        "BEGIN", "COMMIT", "ROLLBACK", "SAVE", "SET", "EXEC", "EXECUTE",
+    ]
+    dollar_quote = re.compile("\\$[A-Za-z_]*\\$")
+    word = re.compile("[A-Za-z_][A-Za-z0-9_$@#]*")
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.connection = None
+        self.stale = False
+        self.lock = threading.Lock()
+
+    def get_options(self):
+        """
+        Returns the rawSql setting, an empty dict if it is missing.
+        """
+        options = self.database.config.get("rawSql")
+        if not isinstance(options, dict):
+            return {}
+        return options
+
+    def is_read_only(self):
+        return self.get_options().get("readOnly", True) is not False
+
+    def get_timeout(self):
+        """
+        Returns the timeout of raw statements in seconds, the patch
+        statement timeout if rawSql has none.
+        """
+        timeout = self.get_options().get("timeout")
+        if timeout is None:
+            timeout = self.database.get_statement_timeout("patch")
+        return float(timeout or 30)
+
+    def split_words(self, sql):
+        """
+        Splits a raw statement into its statements and their words in upper
+        case, without comments, string literals and quoted names. Where the
+        database would read more of the text as code, e.g. nested comments
+        of Postgres or MariaDB comments starting with /*!, the words are
+        kept, so the check only errs on the side of rejecting.
+
+        Returns:
+            list: The words of every statement which isn't empty.
+        """
+        db_type = self.database.type
+        statements = [[]]
+        closing = {"'": "'", '"': '"', "`": "`", "[": "]"}
+        index = 0
+        while index < len(sql):
+            char = sql[index]
+            if sql.startswith("--", index) or (char == "#" and db_type == "mariaDb"):
+                end = sql.find("\n", index)
+                index = len(sql) if end < 0 else end + 1
+            elif sql.startswith("/*!", index) and db_type == "mariaDb":
+                index += 3
+            elif sql.startswith("*/", index) and db_type == "mariaDb":
+                index += 2
+            elif sql.startswith("/*", index):
+                end = sql.find("*/", index + 2)
+                index = len(sql) if end < 0 else end + 2
+            elif char in closing and (char != "[" or db_type == "mssql") and \
+                    (char != "`" or db_type == "mariaDb"):
+                # Doubled quotes are read as two literals, backslashes
+                # never escape, so a literal never ends later than in SQL
+                end = sql.find(closing[char], index + 1)
+                index = len(sql) if end < 0 else end + 1
+            elif char == "$" and db_type == "postgres" and \
+                    self.dollar_quote.match(sql, index) is not None:
+                tag = self.dollar_quote.match(sql, index).group(0)
+                end = sql.find(tag, index + len(tag))
+                index = len(sql) if end < 0 else end + len(tag)
+            elif char == ";":
+                statements.append([])
+                index += 1
+            else:
+                match = self.word.match(sql, index)
+                if match is None:
+                    index += 1
+                else:
+                    statements[-1].append(match.group(0).upper())
+                    index = match.end()
+        return [words for words in statements if len(words) > 0]
+
+    def check_read_only(self, sql):
+        """
+        Rejects raw statements which could end the read only transaction
+        or change the settings of the session.
+
+        Raises:
+            ValueError: If the statement is rejected.
+        """
+        statements = self.split_words(sql)
+        if self.database.type == "mssql":
+            blocked = self.mssql_blocked_words + self.blocked_words
+            words = [word for words in statements for word in words]
+        else:
+            if len(statements) > 1:
+                raise ValueError("Read only raw SQL runs a single statement")
+            if len(statements) == 1 and statements[0][0] in self.blocked_statements:
+                raise ValueError("Read only raw SQL can't run " + statements[0][0])
+            blocked = self.blocked_words
+            words = statements[0] if len(statements) == 1 else []
+        for word in words:
+            if word in blocked:
+                raise ValueError("Read only raw SQL can't use " + word)
+
+    def open(self):
+        """
+        Opens the session of the raw statements and makes it read only.
+        """
+        database = self.database
+        config_database = database.config_database
+        replica = self.get_options().get("replica")
+        if isinstance(replica, dict):
+            config_database = dict(config_database, **replica)
+        connection = database.connect(config_database)
+        cursor = connection.cursor()
+        try:
+            timeout = self.get_timeout()
+            if database.type == "postgres":
+                cursor.execute("SET statement_timeout = " + str(int(timeout * 1000)))
+                if self.is_read_only():
+                    cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+            elif database.type == "mariaDb":
+                cursor.execute("SET SESSION max_statement_time = " + str(timeout))
+                if self.is_read_only():
+                    cursor.execute("SET SESSION TRANSACTION READ ONLY")
+            else:
+                cursor.execute("SET LOCK_TIMEOUT " + str(int(timeout * 1000)))
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        finally:
+            cursor.close()
+        return connection
+
+    def open_cursor(self):
+        """
+        Opens a cursor of the session which fetches the rows in batches.
+        Named cursors of Postgres only run queries, so writes of a session
+        which isn't read only use a plain cursor.
+        """
+        if self.database.type == "postgres" and self.is_read_only():
+            return self.connection.cursor(
+                name="agile_raw_" + uuid.uuid4().hex, cursor_factory=RealDictCursor
+            )
+        if self.database.type == "postgres":
+            return self.connection.cursor(cursor_factory=RealDictCursor)
+        if self.database.type == "mariaDb":
+            return self.connection.cursor(dictionary=True, buffered=False)
+        return self.connection.cursor(as_dict=True)
+
+    def finish(self, cursor):
+        """
+        Ends the transaction of a raw statement, rolled back if the session
+        is read only. A broken session is closed and opened again next time.
+        """
+        try:
+            try:
+                cursor.close()
+            finally:
+                if self.is_read_only():
+                    self.connection.rollback()
+                else:
+                    self.connection.commit()
+        except Exception as error:
+            print("Raw SQL session closed:", error)
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def execute(self, sql):
+        """
+        Executes a raw statement and fetches its first batch, so errors of
+        the statement are raised before the result is sent.
+
+        Raises:
+            ValueError: If a read only session rejects the statement.
+
+        Args:
+            sql (str): The statement.
+
+        Returns:
+            AdmittedBody: The chunks of the JSON array of the rows, the
+            session is released when the response is closed.
+        """
+        options = self.get_options()
+        batch_size = int(options.get("batchSize", 1000))
+        if self.is_read_only():
+            self.check_read_only(sql)
+        self.lock.acquire()
+        try:
+            if self.stale and self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.stale = False
+            if self.connection is None:
+                self.connection = self.open()
+            cursor = self.open_cursor()
+        except Exception:
+            self.lock.release()
+            raise
+        try:
+            deadline = time.monotonic() + self.get_timeout()
+            cursor.execute(sql)
+            rows = []
+            # Named cursors describe their rows after the first fetch,
+            # statements without rows have no description
+            if cursor.description is not None or getattr(cursor, "name", None):
+                rows = cursor.fetchmany(batch_size)
+        except Exception:
+            self.finish(cursor)
+            self.lock.release()
+            raise
+        released = []
+
+        def release():
+            if len(released) == 0:
+                released.append(True)
+                self.finish(cursor)
+                self.lock.release()
+        if not self.is_read_only():
+            self.database.coalescer.invalidate()
+        return AdmittedBody(
+            self.stream(cursor, rows, batch_size, deadline, sql), release
+        )
+
+    def reset(self):
+        """
+        Opens the session again for the next statement, e.g. after a reload
+        changed the rawSql setting.
+        """
+        self.stale = True
+
+    def close(self):
+        """
+        Closes the session once the running statement is done.
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def stream(self, cursor, rows, batch_size, deadline, sql):
+        """
+        Serializes the rows batch by batch until the result or a limit ends.
+        """
+        options = self.get_options()
+        max_rows = int(options.get("maxRows", 10000))
+        max_bytes = int(options.get("maxBytes", 16 * 1024 * 1024))
+        count = 0
+        size = 2
+        separator = "["
+        limit = None
+        while len(rows) > 0 and limit is None:
+            rows = self.database.converter.convert(rows, cursor.description)
+            parts = []
+            for row in rows:
+                if count >= max_rows:
+                    limit = "maxRows"
+                    break
+                line = json.dumps(row)
+                size += len(line) + 1
+                if size > max_bytes:
+                    limit = "maxBytes"
+                    break
+                parts.append(separator + line)
+                separator = ","
+                count += 1
+            yield "".join(parts)
+            if limit is None and time.monotonic() >= deadline:
+                limit = "timeout"
+            if limit is None:
+                rows = cursor.fetchmany(batch_size)
+        if limit is not None:
+            print("Raw SQL result cut after", count, "rows by", limit + ":", sql)
+        yield "]" if count > 0 else "[]"
@@ -0,0 +1,126 @@
+import threading
+
+
+class AgileReload:
+    """
+    Applies a changed configuration while the server keeps running.
+
+    The old and the new configuration are compared type by type and
+    only the DDL steps of the changed tables and types are run, on their
+    own connection and with online index builds where the backend
+    supports them. Afterwards the configuration and the metadata built
+    from it are swapped under the lock of the connection, so every
+    request sees either the old or the new configuration. Removed types,
+    indexes and columns are never dropped.
+    """
+
+    steps = ["columns", "indexes", "search", "summaries", "ttl", "storage"]
+    restart_keys = ["port", "threaded", "compression", "requestLog", "admission"]
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.lock = threading.Lock()
+
+    def get_type_table(self, config, agile_type):
+        """
+        Returns the table of a type in a configuration like the drivers.
+        """
+        for table, table_object in (config.get("tables") or {}).items():
+            if agile_type in (table_object.get("types") or {}):
+                return "agile_" + table
+        return None
+
+    def is_changed(self, old_type, new_type, keys):
+        return any(old_type.get(key) != new_type.get(key) for key in keys)
+
+    def diff(self, old_config, new_config):
+        """
+        Compares two configurations.
+
+        Args:
+            old_config (dict): The running configuration.
+            new_config (dict): The new configuration.
+
+        Returns:
+            dict: The new tables, the types to move to another table, the
+            types of every DDL step, all changed, added and removed types
+            and the settings which need a restart.
+        """
+        old_types = old_config.get("types") or {}
+        new_types = new_config.get("types") or {}
+        old_tables = old_config.get("tables") or {}
+        new_tables = new_config.get("tables") or {}
+        changes = {
+            "tables": [table for table in new_tables if table not in old_tables],
+            "moved": [],
+            "types": [],
+            "removed_types": [agile_type for agile_type in old_types if agile_type not in new_types],
+            "restart": [],
+        }
+        for step in self.steps:
+            changes[step] = []
+        for agile_type, new_type in new_types.items():
+            old_type = old_types.get(agile_type)
+            new_table = self.get_type_table(new_config, agile_type)
+            if old_type is None or old_type.get("table") != new_table:
+                if new_table is not None:
+                    changes["moved"].append(agile_type)
+                changed_steps = self.steps
+            else:
+                changed_steps = []
+                if self.is_changed(old_type, new_type, ["columns"]):
+                    changed_steps += ["columns", "indexes", "storage"]
+                if self.is_changed(old_type, new_type, ["indices", "fields", "naturalKey"]):
+                    changed_steps.append("indexes")
+                for step, key in [("search", "search"), ("summaries", "summaries"), ("ttl", "ttl")]:
+                    if self.is_changed(old_type, new_type, [key]):
+                        changed_steps.append(step)
+                # The search and the summaries decide which columns are stripped
+                if self.is_changed(old_type, new_type, ["storage", "search", "summaries"]):
+                    changed_steps.append("storage")
+            for step in changed_steps:
+                if agile_type not in changes[step]:
+                    changes[step].append(agile_type)
+            keys = (set(old_type or {}) | set(new_type)) - {"table"}
+            if old_type is None or self.is_changed(old_type, new_type, keys):
+                changes["types"].append(agile_type)
+        if old_config.get("database") != new_config.get("database"):
+            changes["restart"].append("database")
+        old_server = old_config.get("server") or {}
+        new_server = new_config.get("server") or {}
+        for key in self.restart_keys:
+            if old_server.get(key) != new_server.get(key):
+                changes["restart"].append("server." + key)
+        return changes
+
+    def reload(self, new_config):
+        """
+        Applies a new configuration. Only one reload runs at a time.
+
+        Args:
+            new_config (dict): The new configuration.
+
+        Returns:
+            dict: The applied changes, see diff.
+
+        Raises:
+            ValueError: If the database settings changed.
+        """
+        with self.lock:
+            changes = self.diff(self.database.config, new_config)
+            if "database" in changes["restart"]:
+                raise ValueError("The database settings can't be reloaded, restart the server")
+            for key in changes["restart"]:
+                print("Reload: " + key + " changed, it takes effect after a restart")
+            self.database.reconfigure(new_config, changes)
+            self.database.swap_config(new_config, changes)
+            print("Reloaded the configuration:", ", ".join(
+                step + "=" + ",".join(changes[step])
+                for step in ["tables", "moved"] + self.steps + ["types"]
+                if len(changes[step]) > 0
+            ) or "no changes")
+            return changes
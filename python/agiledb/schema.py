@@ -0,0 +1,71 @@
+import hashlib
+import json
+
+
+class AgileSchema:
+    """
+    Fingerprints the part of the configuration which shapes the schema.
+
+    The drivers store the fingerprint in ``agile_meta_schema`` after they
+    provisioned the tables, columns, indexes, searches, summaries and
+    expiry columns. When the stored fingerprint matches the configuration
+    at startup, provisioning is skipped. ``version`` is raised whenever
+    the drivers create different DDL for the same configuration.
+    """
+
+    version = 3
+    type_keys = ["columns", "indices", "fields", "naturalKey", "search", "summaries", "ttl", "storage"]
+
+    def __init__(self, config, db_type):
+        """
+        Args:
+            config (dict): The server configuration.
+            db_type (str): The backend, one of postgres, mssql or mariaDb.
+        """
+        self.config = config
+        self.type = db_type
+
+    def create_fingerprint(self):
+        """
+        Returns:
+            str: The SHA-256 of the tables, the schema settings of the types,
+            the backend and the version as hex string.
+        """
+        types = {}
+        for agile_type, type_object in (self.config.get("types") or {}).items():
+            type_object = type_object or {}
+            types[agile_type] = {
+                key: type_object.get(key)
+                for key in self.type_keys
+                if type_object.get(key) is not None
+            }
+        tables = {
+            table: sorted((table_object or {}).get("types") or {})
+            for table, table_object in (self.config.get("tables") or {}).items()
+        }
+        document = json.dumps({
+            "version": self.version,
+            "backend": self.type,
+            "tables": tables,
+            "types": types,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+    def create_read_sql(self):
+        return "SELECT fingerprint FROM agile_meta_schema"
+
+    def create_save_sql(self, fingerprint):
+        """
+        Creates the statements replacing the stored fingerprint. The
+        fingerprint is a hex string, so it is written as literal.
+        """
+        if self.type == "mssql":
+            create = "IF OBJECT_ID('agile_meta_schema', 'U') IS NULL" \
+                " CREATE TABLE agile_meta_schema (fingerprint nvarchar(64))"
+        else:
+            create = "CREATE TABLE IF NOT EXISTS agile_meta_schema (fingerprint VARCHAR(64))"
+        return [
+            create,
+            "DELETE FROM agile_meta_schema",
+            "INSERT INTO agile_meta_schema (fingerprint) VALUES ('" + fingerprint + "')",
+        ]
@@ -0,0 +1,330 @@
+import json
+
+
+class AgileStorage:
+    """
+    Builds the storage settings of the types: the compression of their
+    table and the compact documents of ``stripColumns``.
+
+    ``compression`` compresses the table of a type, LZ4 TOAST compression
+    of the document on Postgres, InnoDB ``ROW_FORMAT=COMPRESSED`` on
+    MariaDB and PAGE or ROW data compression on MSSQL. Types sharing a
+    table have to agree on it.
+
+    With ``stripColumns`` (Postgres) the promoted scalar columns of a type
+    are stored only in their column instead of twice. The columns become
+    plain columns written with the document and reads merge them back into
+    the document, so the API returns the same documents. A value is only
+    removed from the document if it reads back unchanged from its column,
+    columns used by the search or a summary stay in the document. The type
+    needs a table of its own.
+    """
+
+    compressions = {
+        "postgres": ["lz4", "pglz"],
+        "mariaDb": ["compressed"],
+        "mssql": ["page", "row"],
+    }
+    key_block_sizes = [1, 2, 4, 8, 16]
+    integer_types = ["INTEGER", "INT", "BIGINT", "SMALLINT", "INT2", "INT4", "INT8"]
+    decimal_types = ["NUMERIC", "DECIMAL"]
+    float_types = ["DOUBLE", "DOUBLE PRECISION", "FLOAT", "FLOAT8"]
+    text_types = ["TEXT", "VARCHAR", "CHARACTER VARYING"]
+    bool_types = ["BOOLEAN", "BOOL"]
+
+    def __init__(self, query):
+        """
+        Args:
+            query (AgileQuery): The compiler of the configuration.
+        """
+        self.query = query
+        self.type = query.type
+
+    def get_storage(self, agile_type):
+        """
+        Returns the storage setting of a type or an empty dict.
+        """
+        storage = self.query.get_type_config(agile_type).get("storage")
+        if not isinstance(storage, dict):
+            return {}
+        return storage
+
+    def get_table(self, agile_type):
+        """
+        Returns the table of a type like the drivers set it.
+        """
+        return self.query.get_type_config(agile_type).get("table") or "agile_main"
+
+    def get_compression(self, agile_type):
+        """
+        Returns the compression of the table of a type or None.
+
+        Raises:
+            ValueError: If the compression is unknown to the backend.
+        """
+        compression = self.get_storage(agile_type).get("compression")
+        if not compression:
+            return None
+        if compression is True:
+            return self.compressions[self.type][0]
+        compression = str(compression).lower()
+        if compression not in self.compressions[self.type]:
+            raise ValueError(
+                "Compression not supported by " + self.type + ": " + compression
+            )
+        return compression
+
+    def get_table_compressions(self, only_types=None):
+        """
+        Collects the compression of every table with a compressed type.
+
+        Args:
+            only_types (list): Only the tables of these types, all types if None.
+
+        Returns:
+            dict: The table name and the setting of the type which set it.
+
+        Raises:
+            ValueError: If types of one table have different compressions.
+        """
+        compressions = {}
+        for agile_type in (self.query.config.get("types") or {}):
+            compression = self.get_compression(agile_type)
+            if compression is None:
+                continue
+            table = self.get_table(agile_type)
+            if table in compressions and compressions[table][0] != compression:
+                raise ValueError("The types of " + table + " have different compressions")
+            compressions[table] = (compression, self.get_storage(agile_type))
+        if only_types is None:
+            return compressions
+        tables = [self.get_table(agile_type) for agile_type in only_types]
+        return {
+            table: compression for table, compression in compressions.items()
+            if table in tables
+        }
+
+    def create_compression_sql(self, table, compression, storage, online=False):
+        """
+        Creates the statement compressing a table. MariaDB rebuilds the
+        table, so the driver only runs it if the row format differs.
+
+        Args:
+            table (str): The table.
+            compression (str): The compression of the backend.
+            storage (dict): The storage setting, keyBlockSize on MariaDB.
+            online (bool): Rebuild without blocking writes where supported.
+        """
+        if self.type == "postgres":
+            # Only new values are compressed with the method, existing ones
+            # keep theirs until they are rewritten
+            return "ALTER TABLE " + table + " ALTER COLUMN data SET COMPRESSION " + compression
+        if self.type == "mariaDb":
+            key_block_size = int(storage.get("keyBlockSize", 8))
+            if key_block_size not in self.key_block_sizes:
+                raise ValueError("Invalid keyBlockSize: " + str(key_block_size))
+            sql = "ALTER TABLE " + table + " ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=" + \
+                str(key_block_size)
+            if online:
+                sql += ", LOCK=NONE"
+            return sql
+        option = ", ONLINE = ON" if online else ""
+        return "IF EXISTS (SELECT * FROM sys.partitions WHERE object_id = OBJECT_ID('" + \
+            table + "') AND index_id IN (0, 1) AND data_compression_desc <> '" + \
+            compression.upper() + "')\nALTER TABLE " + table + \
+            " REBUILD WITH (DATA_COMPRESSION = " + compression.upper() + option + ")"
+
+    def create_row_format_sql(self):
+        """
+        Creates the SELECT of the row format of a MariaDB table.
+        """
+        return "SELECT ROW_FORMAT AS row_format FROM information_schema.TABLES" \
+            " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s"
+
+    def get_base_type(self, declared_type):
+        return " ".join(declared_type.strip().upper().split())
+
+    def get_strippable_columns(self, agile_type):
+        """
+        Returns the promoted columns of a type which can be kept out of the
+        document: scalar columns reading back unchanged which the search and
+        the summaries don't read from the document.
+
+        Returns:
+            dict: The column names and their declared types.
+        """
+        if self.type != "postgres":
+            return {}
+        kept = []
+        search = self.query.get_search(agile_type)
+        if search is not None:
+            kept += search[0]
+        summaries = self.query.get_type_config(agile_type).get("summaries") or {}
+        for summary in summaries.values():
+            for key in ["groupBy", "sum"]:
+                fields = (summary or {}).get(key) or []
+                if isinstance(fields, str):
+                    fields = [fields]
+                kept += fields
+        columns = {}
+        for column, declared_type in self.query.get_columns(agile_type).items():
+            if column in kept or self.query.simple_name.match(column) is None:
+                continue
+            base_type = self.get_base_type(declared_type)
+            if base_type in self.integer_types + self.decimal_types + \
+                    self.float_types + self.text_types + self.bool_types or \
+                    base_type.startswith("VARCHAR("):
+                columns[column] = declared_type
+        return columns
+
+    def is_stripped(self, agile_type):
+        """
+        Checks if the promoted columns of a type are kept out of its
+        documents.
+
+        Raises:
+            ValueError: If the backend isn't Postgres or the type shares its
+            table.
+        """
+        if self.get_storage(agile_type).get("stripColumns") is not True:
+            return False
+        if self.type != "postgres":
+            raise ValueError("stripColumns of " + agile_type + " needs Postgres")
+        table = self.get_table(agile_type)
+        table_object = (self.query.config.get("tables") or {}).get(table[len("agile_"):]) or {}
+        if table == "agile_main" or list(table_object.get("types") or {}) != [agile_type]:
+            raise ValueError("stripColumns of " + agile_type + " needs a table of its own")
+        return len(self.get_strippable_columns(agile_type)) > 0
+
+    def get_stripped_columns(self, agile_type):
+        """
+        Returns the plain columns written with the documents of a type, an
+        empty dict if the type keeps its columns in the document.
+        """
+        if not self.is_stripped(agile_type):
+            return {}
+        return self.get_strippable_columns(agile_type)
+
+    def create_strip_sql(self, agile_type):
+        """
+        Creates the statements turning the generated columns of a stripped
+        type into plain columns. The columns keep their values and the
+        statements do nothing for plain columns.
+        """
+        table = self.get_table(agile_type)
+        return [
+            "ALTER TABLE " + table + " ALTER COLUMN " + column + " DROP EXPRESSION IF EXISTS"
+            for column in self.get_stripped_columns(agile_type)
+        ]
+
+    def create_plain_columns_sql(self, agile_type):
+        """
+        Creates the SELECT of the promoted columns of a type which are plain
+        columns of its table. Only the stripped columns may be plain, the
+        writes don't fill the others.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        columns = [column.lower() for column in self.query.get_columns(agile_type)]
+        table = self.get_table(agile_type)
+        return "SELECT column_name FROM information_schema.columns" \
+            " WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'" \
+            " AND column_name IN (" + ", ".join(["%s"] * len(columns)) + ")", \
+            (table.lower(),) + tuple(columns)
+
+    def get_text_value(self, value):
+        """
+        Returns a value of the document as text like ``->>`` reads it.
+        """
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    def reads_back(self, declared_type, value):
+        """
+        Checks if a value of the document reads back unchanged from a
+        column of the declared type.
+        """
+        base_type = self.get_base_type(declared_type)
+        if isinstance(value, bool):
+            return base_type in self.bool_types
+        if isinstance(value, int):
+            return base_type in self.integer_types + self.decimal_types
+        if isinstance(value, float):
+            return base_type in self.float_types
+        if isinstance(value, str):
+            return base_type in self.text_types or base_type.startswith("VARCHAR(")
+        return False
+
+    def get_placeholders(self, agile_type):
+        """
+        Returns the stripped columns of a type with the placeholders casting
+        their text values to the declared types.
+        """
+        return [
+            (column, "CAST(%s AS " + declared_type + ")")
+            for column, declared_type in self.get_stripped_columns(agile_type).items()
+        ]
+
+    def strip(self, agile_type, data):
+        """
+        Splits a document of a stripped type into the stored document and
+        the values of its plain columns.
+
+        Args:
+            agile_type (str): The type of the record.
+            data (dict): The document.
+
+        Returns:
+            tuple: The stored document, the list of the column names and
+            their placeholders and the tuple of the values as text.
+        """
+        columns = self.get_stripped_columns(agile_type)
+        if len(columns) == 0:
+            return data, [], ()
+        if not isinstance(data, dict):
+            raise ValueError("The data of " + agile_type + " has to be an object")
+        stored = dict(data)
+        values = ()
+        for column, declared_type in columns.items():
+            value = data.get(column)
+            values += (self.get_text_value(value),)
+            if value is not None and self.reads_back(declared_type, value):
+                del stored[column]
+        return stored, self.get_placeholders(agile_type), values
+
+    def create_document_expression(self, agile_type, table):
+        """
+        Builds the expression of the whole document of a type read from its
+        table, the stripped columns merged into the stored document.
+
+        Args:
+            agile_type (str): The type of the record.
+            table (str): The table or its alias.
+        """
+        columns = self.get_stripped_columns(agile_type)
+        if len(columns) == 0:
+            return table + ".data"
+        return "(jsonb_strip_nulls(jsonb_build_object(" + ", ".join(
+            self.query.quote_literal(column) + ", " + table + "." + column
+            for column in columns
+        ) + ")) || " + table + ".data)"
+
+    def create_source_document(self, agile_type, table):
+        """
+        Builds the expression of the whole document of a type read from an
+        old table of a migration. The type can have been stripped there, so
+        the columns are read from the row and only fill keys missing in the
+        stored document.
+        """
+        columns = self.get_strippable_columns(agile_type)
+        if len(columns) == 0:
+            return "data"
+        # The row is converted once, its keys are the folded column names
+        return "((SELECT jsonb_strip_nulls(jsonb_build_object(" + ", ".join(
+            self.query.quote_literal(column) + ", agile_row->" +
+            self.query.quote_literal(column.lower())
+            for column in columns
+        ) + ")) FROM (SELECT to_jsonb(" + table + ") AS agile_row) AS agile_source) || " + \
+            table + ".data)"
@@ -0,0 +1,414 @@
+import hashlib
+import json
+
+
+class AgileSummary:
+    """
+    Builds the SQL of the summary tables of the types.
+
+    A summary is declared in ``summaries`` of a type with the fields it
+    groups by and the fields it sums. It is stored in the table
+    ``agile_summary_<type>_<name>_<hash>`` with one row per group, holding
+    the number of records (``agile_count``) and the sums (``sum_<field>``).
+    The hash is taken from the groupBy and sum of the summary, so a changed
+    summary gets a new table, which is computed from the records again.
+    Triggers on the table of the type add the changes of every insert,
+    update and delete to the rows of the groups, so reading a summary
+    never recomputes it. Missing group values are grouped as empty string.
+    """
+
+    def __init__(self, query):
+        """
+        Args:
+            query (AgileQuery): The query compiler of the backend.
+        """
+        self.query = query
+        self.type = query.type
+
+    def get_summaries(self, agile_type):
+        """
+        Returns the summaries of a type as dict of name to setting.
+        """
+        return self.query.get_type_config(agile_type).get("summaries") or {}
+
+    def get_summary(self, agile_type, name):
+        """
+        Returns the setting of a summary.
+
+        Raises:
+            ValueError: If the type has no summary with the name.
+        """
+        summaries = self.get_summaries(agile_type)
+        if name not in summaries:
+            raise ValueError(
+                "The type " + agile_type + " has no summary " + str(name)
+            )
+        summary = summaries[name]
+        if len(summary.get("groupBy") or []) == 0:
+            raise ValueError("The summary " + name + " has no groupBy")
+        return summary
+
+    def get_table_name(self, agile_type, name):
+        """
+        Returns the name of the table of a summary, which changes with the
+        groupBy and sum of the summary.
+        """
+        summary = self.get_summary(agile_type, name)
+        definition = json.dumps(
+            {"groupBy": summary["groupBy"], "sum": summary.get("sum") or []},
+            sort_keys=True
+        )
+        digest = hashlib.sha256(definition.encode("utf-8")).hexdigest()[:8]
+        return self.get_base_name(agile_type, name) + "_" + digest
+
+    def get_base_name(self, agile_type, name):
+        """
+        Returns the name of a summary without its hash.
+        """
+        self.query.check_column_name(agile_type)
+        self.query.check_column_name(name)
+        return "agile_summary_" + agile_type + "_" + name
+
+    def get_group_columns(self, summary):
+        """
+        Returns the group fields of a summary with their column names.
+        """
+        return [
+            (field, self.query.check_column_name(
+                "group_" + field.replace(".", "_")
+            ))
+            for field in summary["groupBy"]
+        ]
+
+    def get_sum_columns(self, summary):
+        """
+        Returns the summed fields of a summary with their column names.
+        """
+        return [
+            (field, self.query.check_column_name(
+                "sum_" + field.replace(".", "_")
+            ))
+            for field in summary.get("sum") or []
+        ]
+
+    def create_table_sql(self, agile_type, name):
+        """
+        Creates the SQL string creating the table of a summary.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        if self.type == "postgres":
+            key_type, count_type, sum_type = "TEXT", "BIGINT", "NUMERIC"
+        elif self.type == "mariaDb":
+            key_type, count_type, sum_type = \
+                "VARCHAR(255)", "BIGINT", "DECIMAL(38,10)"
+        else:
+            key_type, count_type, sum_type = \
+                "nvarchar(450)", "BIGINT", "DECIMAL(38,10)"
+        group_columns = [
+            column for field, column in self.get_group_columns(summary)
+        ]
+        columns = [
+            column + " " + key_type + " NOT NULL" for column in group_columns
+        ]
+        columns.append("agile_count " + count_type + " NOT NULL DEFAULT 0")
+        for field, column in self.get_sum_columns(summary):
+            columns.append(column + " " + sum_type + " NOT NULL DEFAULT 0")
+        columns.append("PRIMARY KEY (" + ", ".join(group_columns) + ")")
+        body = "(\n    " + ",\n    ".join(columns) + "\n)"
+        if self.type == "mssql":
+            return "if not exists (select * from sysobjects where name='" + \
+                table_name + "' and xtype='U')\nCREATE TABLE " + \
+                table_name + " " + body
+        return "CREATE TABLE IF NOT EXISTS " + table_name + " " + body
+
+    def create_change_select(self, agile_type, summary, document, sign):
+        """
+        Builds the select list of the change a document makes to its group.
+
+        Args:
+            agile_type (str): The type of the summary.
+            summary (dict): The setting of the summary.
+            document (str): The column holding the document.
+            sign (str): An empty string to add, "-" to subtract the document.
+
+        Returns:
+            list: The expressions of the group columns, count and sums.
+        """
+        expressions = []
+        for field, column in self.get_group_columns(summary):
+            expressions.append(
+                "COALESCE(" + self.query.text_expression(field, document) +
+                ", '')"
+            )
+        expressions.append(sign + "1")
+        for field, column in self.get_sum_columns(summary):
+            expressions.append(
+                sign + "COALESCE(" + self.query.typed_expression(
+                    field, "NUMERIC", document
+                ) + ", 0)"
+            )
+        return expressions
+
+    def create_populate_sql(self, agile_type, name, table):
+        """
+        Creates the SQL string computing a new summary once from the
+        records which already exist.
+
+        Args:
+            agile_type (str): The type of the summary.
+            name (str): The name of the summary.
+            table (str): The table of the type.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        group_columns = self.get_group_columns(summary)
+        sum_columns = self.get_sum_columns(summary)
+        change = self.create_change_select(agile_type, summary, "data", "")
+        groups = change[:len(group_columns)]
+        select = list(groups)
+        select.append("COUNT(*)")
+        for index in range(len(sum_columns)):
+            select.append("SUM(" + change[len(group_columns) + 1 + index] + ")")
+        columns = [column for field, column in group_columns] + \
+            ["agile_count"] + [column for field, column in sum_columns]
+        return "INSERT INTO " + table_name + " (" + ", ".join(columns) + \
+            ") SELECT " + ", ".join(select) + " FROM " + table + \
+            " WHERE " + self.query.create_type_predicate(agile_type) + \
+            " GROUP BY " + ", ".join(groups)
+
+    def create_apply_sql(self, agile_type, summary, table_name, values):
+        """
+        Creates the statement adding one change to the row of its group.
+        """
+        group_columns = [
+            column for field, column in self.get_group_columns(summary)
+        ]
+        value_columns = ["agile_count"] + [
+            column for field, column in self.get_sum_columns(summary)
+        ]
+        columns = group_columns + value_columns
+        insert = "INSERT INTO " + table_name + " (" + ", ".join(columns) + \
+            ") VALUES (" + ", ".join(values) + ")"
+        if self.type == "postgres":
+            return insert + " ON CONFLICT (" + ", ".join(group_columns) + \
+                ") DO UPDATE SET " + ", ".join(
+                    column + " = " + table_name + "." + column +
+                    " + EXCLUDED." + column for column in value_columns
+                ) + ";"
+        return insert + " ON DUPLICATE KEY UPDATE " + ", ".join(
+            column + " = " + column + " + VALUES(" + column + ")"
+            for column in value_columns
+        ) + ";"
+
+    def get_trigger_name(self, agile_type, name):
+        """
+        Returns the name of the trigger of a summary. It has no hash, so
+        the triggers of a changed summary replace the old ones.
+        """
+        return self.get_base_name(agile_type, name) + "_trigger"
+
+    def create_trigger_sql(self, agile_type, name, table):
+        """
+        Creates the SQL strings creating or replacing the triggers keeping a
+        summary up to date.
+
+        Args:
+            agile_type (str): The type of the summary.
+            name (str): The name of the summary.
+            table (str): The table of the type.
+
+        Returns:
+            list: The SQL strings, executed one after another.
+        """
+        if self.type == "postgres":
+            return self.create_postgres_trigger_sql(agile_type, name, table)
+        if self.type == "mariaDb":
+            return self.create_maria_db_trigger_sql(agile_type, name, table)
+        return self.create_mssql_trigger_sql(agile_type, name, table)
+
+    def create_postgres_trigger_sql(self, agile_type, name, table):
+        """
+        Creates the Postgres triggers of a summary, one row level trigger function for all operations.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        trigger_name = self.get_trigger_name(agile_type, name)
+        type_literal = self.query.quote_literal(agile_type)
+        subtract = self.create_apply_sql(
+            agile_type, summary, table_name,
+            self.create_change_select(agile_type, summary, "OLD.data", "-")
+        )
+        add = self.create_apply_sql(
+            agile_type, summary, table_name,
+            self.create_change_select(agile_type, summary, "NEW.data", "")
+        )
+        function = f"""CREATE OR REPLACE FUNCTION {trigger_name}_function()
+        RETURNS trigger AS $agile$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.agile_type = {type_literal} THEN
+                {subtract}
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.agile_type = {type_literal} THEN
+                {add}
+            END IF;
+            RETURN NULL;
+        END
+        $agile$ LANGUAGE plpgsql;"""
+        return [
+            function,
+            f"DROP TRIGGER IF EXISTS {trigger_name} ON {table};",
+            f"""CREATE TRIGGER {trigger_name}
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {trigger_name}_function();""",
+        ]
+
+    def create_maria_db_trigger_sql(self, agile_type, name, table):
+        """
+        Creates the MariaDB triggers of a summary, one trigger per operation.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        trigger_name = self.get_trigger_name(agile_type, name)
+        type_literal = self.query.quote_literal(agile_type)
+        subtract = self.create_apply_sql(
+            agile_type, summary, table_name,
+            self.create_change_select(agile_type, summary, "OLD.data", "-")
+        )
+        add = self.create_apply_sql(
+            agile_type, summary, table_name,
+            self.create_change_select(agile_type, summary, "NEW.data", "")
+        )
+        return [
+            f"""CREATE OR REPLACE TRIGGER {trigger_name}_insert
+            AFTER INSERT ON {table} FOR EACH ROW
+            IF NEW.agile_type = {type_literal} THEN {add} END IF""",
+            f"""CREATE OR REPLACE TRIGGER {trigger_name}_update
+            AFTER UPDATE ON {table} FOR EACH ROW
+            BEGIN
+                IF OLD.agile_type = {type_literal} THEN {subtract} END IF;
+                IF NEW.agile_type = {type_literal} THEN {add} END IF;
+            END""",
+            f"""CREATE OR REPLACE TRIGGER {trigger_name}_delete
+            AFTER DELETE ON {table} FOR EACH ROW
+            IF OLD.agile_type = {type_literal} THEN {subtract} END IF""",
+        ]
+
+    def create_mssql_trigger_sql(self, agile_type, name, table):
+        """
+        Creates the MSSQL triggers of a summary, one statement level trigger merging the grouped changes.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        trigger_name = self.get_trigger_name(agile_type, name)
+        type_predicate = self.query.create_type_predicate(agile_type)
+        group_columns = [
+            column for field, column in self.get_group_columns(summary)
+        ]
+        value_columns = ["agile_count"] + [
+            column for field, column in self.get_sum_columns(summary)
+        ]
+        columns = group_columns + value_columns
+
+        def change_select(source, sign):
+            expressions = self.create_change_select(
+                agile_type, summary, "data", sign
+            )
+            return "SELECT " + ", ".join(
+                expression + " AS " + column
+                for expression, column in zip(expressions, columns)
+            ) + " FROM " + source + " WHERE " + type_predicate
+
+        sums = ", ".join(
+            "SUM(" + column + ") AS " + column for column in value_columns
+        )
+        on = " AND ".join(
+            "target." + column + " = source." + column
+            for column in group_columns
+        )
+        update = ", ".join(
+            column + " = target." + column + " + source." + column
+            for column in value_columns
+        )
+        return [
+            f"""CREATE OR ALTER TRIGGER {trigger_name} ON {table}
+            AFTER INSERT, UPDATE, DELETE AS
+            BEGIN
+                SET NOCOUNT ON;
+                MERGE {table_name} AS target
+                USING (
+                    SELECT {", ".join(group_columns)}, {sums} FROM (
+                        {change_select("inserted", "")}
+                        UNION ALL
+                        {change_select("deleted", "-")}
+                    ) AS changes GROUP BY {", ".join(group_columns)}
+                ) AS source
+                ON {on}
+                WHEN MATCHED THEN UPDATE SET {update}
+                WHEN NOT MATCHED THEN INSERT ({", ".join(columns)})
+                VALUES ({", ".join("source." + column for column in columns)});
+            END""",
+        ]
+
+    def create_lock_sql(self, agile_type, name, table):
+        """
+        Creates the SQL strings locking the table of a type against writes
+        until the summary is computed and its triggers exist, so no write of
+        a running server is missed in between. Postgres and MSSQL hold the
+        lock until the commit, MariaDB until UNLOCK TABLES.
+
+        Args:
+            agile_type (str): The type of the summary.
+            name (str): The name of the summary.
+            table (str): The table of the type.
+
+        Returns:
+            list: The SQL strings, executed one after another.
+        """
+        if self.type == "postgres":
+            # Reads go on, creating the trigger needs no stronger lock
+            return ["LOCK TABLE " + table + " IN SHARE ROW EXCLUSIVE MODE"]
+        if self.type == "mariaDb":
+            return [
+                "LOCK TABLES " + table + " WRITE, " +
+                self.get_table_name(agile_type, name) + " WRITE"
+            ]
+        return [
+            "DECLARE @agile_lock int; SELECT TOP 1 @agile_lock = 1 FROM " +
+            table + " WITH (TABLOCK, HOLDLOCK)"
+        ]
+
+    def create_is_empty_sql(self, agile_type, name):
+        """
+        Creates the SQL string checking if a summary table has no rows.
+        """
+        table_name = self.get_table_name(agile_type, name)
+        if self.type == "mssql":
+            return "SELECT TOP 1 agile_count FROM " + table_name
+        return "SELECT agile_count FROM " + table_name + " LIMIT 1"
+
+    def create_read_sql(self, agile_type, name):
+        """
+        Creates the SQL string reading all groups of a summary.
+        """
+        summary = self.get_summary(agile_type, name)
+        table_name = self.get_table_name(agile_type, name)
+        if self.type == "postgres":
+            float_type = "DOUBLE PRECISION"
+        elif self.type == "mariaDb":
+            float_type = "DOUBLE"
+        else:
+            float_type = "FLOAT"
+        select = [
+            column + " AS " + self.query.quote_alias(field)
+            if self.type == "mssql" else
+            column + ' AS "' + field + '"'
+            for field, column in self.get_group_columns(summary)
+        ]
+        select.append("agile_count")
+        for field, column in self.get_sum_columns(summary):
+            select.append(
+                "CAST(" + column + " AS " + float_type + ") AS " + column
+            )
+        return "SELECT " + ", ".join(select) + " FROM " + table_name + \
+            " WHERE agile_count > 0"
@@ -0,0 +1,247 @@
+import copy
+import re
+import threading
+from collections import OrderedDict
+from agiledb.admission import AdmittedBody
+from agiledb.drivers import Database
+
+
+class Tenant:
+    """
+    The database of one tenant and the number of requests using it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.database = None
+        self.error = None
+        self.users = 0
+        self.ready = threading.Event()
+
+
+class AgileTenants:
+    """
+    WSGI middleware routing the requests of tenants to their own database.
+
+    The tenant is taken from the ``header`` of a request or the ``bodyKey``
+    of its JSON body. Its database settings are the ``database`` settings
+    with the values of ``tenants.database`` applied, ``{tenant}`` replaced
+    by the tenant, e.g. a database ``name`` or on Postgres a ``schema`` per
+    tenant. A tenant is configured on its first request, so its tables are
+    provisioned by the drivers then and skipped by their schema
+    fingerprint afterwards. Requests without tenant use the configured
+    database unless ``required`` is set.
+
+    At most ``maxOpen`` tenants keep their database open. Opening another
+    tenant closes the least recently used tenants without running
+    requests, a tenant whose requests all run is closed after them.
+    """
+
+    environ_key = "agile.tenant"
+
+    def __init__(self, app, database, config):
+        """
+        Args:
+            app (function): The WSGI application.
+            database (Database): The configured database of the server.
+            config (dict): The server configuration.
+        """
+        self.app = app
+        self.database = database
+        self.config = config
+        self.tenants = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_options(self):
+        """
+        Returns the tenants setting or None if tenants are disabled.
+        """
+        options = self.config.get("tenants")
+        if not options:
+            return None
+        if not isinstance(options, dict):
+            options = {}
+        return options
+
+    def get_tenant(self, environ, body=None):
+        """
+        Reads the tenant of a request.
+
+        Args:
+            environ (dict): The WSGI environment of the request.
+            body (dict): The JSON body of the request or None.
+
+        Returns:
+            str: The tenant or None.
+
+        Raises:
+            ValueError: If the tenant is invalid or missing but required.
+        """
+        options = self.get_options()
+        if options is None:
+            return None
+        header = options.get("header", "X-Tenant")
+        tenant = environ.get("HTTP_" + header.upper().replace("-", "_"))
+        if not tenant and isinstance(body, dict):
+            tenant = body.get(options.get("bodyKey", "tenant"))
+        if not tenant:
+            if options.get("required") is True:
+                raise ValueError("The request has no tenant")
+            return None
+        tenant = str(tenant)
+        if re.match(options.get("pattern", "^[A-Za-z0-9_]{1,63}$"), tenant) is None:
+            raise ValueError("Invalid tenant: " + tenant)
+        return tenant
+
+    def create_config(self, tenant):
+        """
+        Creates the configuration of a tenant. It is a copy, as the drivers
+        store the tables of the types in it.
+        """
+        config = copy.deepcopy(self.config)
+        database = config["database"]
+        for key, value in (self.get_options().get("database") or {}).items():
+            if isinstance(value, str):
+                value = value.replace("{tenant}", tenant)
+            database[key] = value
+        return config
+
+    def acquire(self, tenant):
+        """
+        Returns the tenant with its configured database and counts the
+        request, the first request of a tenant configures its database.
+
+        Raises:
+            Exception: The error of configuring the database.
+        """
+        with self.lock:
+            entry = self.tenants.get(tenant)
+            opening = entry is None
+            if opening:
+                entry = Tenant(tenant)
+                self.tenants[tenant] = entry
+            else:
+                self.tenants.move_to_end(tenant)
+            entry.users += 1
+        if opening:
+            try:
+                database = Database()
+                database.configure(self.create_config(tenant))
+                entry.database = database
+                print("Opened tenant", tenant)
+            except Exception as error:
+                entry.error = error
+                with self.lock:
+                    if self.tenants.get(tenant) is entry:
+                        del self.tenants[tenant]
+            finally:
+                entry.ready.set()
+            self.evict()
+        else:
+            entry.ready.wait()
+        if entry.error is not None:
+            self.release(entry)
+            raise entry.error
+        return entry
+
+    def release(self, entry):
+        """
+        Ends a request of a tenant.
+        """
+        with self.lock:
+            entry.users -= 1
+        self.evict()
+
+    def evict(self):
+        """
+        Closes the least recently used tenants without running requests
+        while more than maxOpen tenants are open.
+        """
+        options = self.get_options() or {}
+        closing = []
+        with self.lock:
+            excess = len(self.tenants) - int(options.get("maxOpen", 100))
+            for tenant, entry in list(self.tenants.items()):
+                if excess <= 0:
+                    break
+                if entry.users > 0 or entry.database is None:
+                    continue
+                del self.tenants[tenant]
+                closing.append(entry)
+                excess -= 1
+        for entry in closing:
+            try:
+                entry.database.close()
+                print("Closed tenant", entry.name)
+            except Exception as error:
+                print("Closing tenant", entry.name, "failed:", error)
+
+    def get_database(self, environ, body=None):
+        """
+        Returns the database of the tenant of a request. The tenant is kept
+        open until the response is closed.
+
+        Args:
+            environ (dict): The WSGI environment of the request.
+            body (dict): The JSON body of the request or None.
+
+        Returns:
+            Database: The database of the tenant or the configured database.
+        """
+        if self.environ_key in environ:
+            return environ[self.environ_key].database
+        tenant = self.get_tenant(environ, body)
+        if tenant is None:
+            return self.database
+        entry = self.acquire(tenant)
+        environ[self.environ_key] = entry
+        return entry.database
+
+    def reload(self, new_config):
+        """
+        Applies a reloaded configuration to the open tenants, new tenants
+        are configured with it.
+        """
+        self.config = new_config
+        with self.lock:
+            entries = list(self.tenants.values())
+        for entry in entries:
+            if entry.database is None:
+                continue
+            try:
+                entry.database.reload(self.create_config(entry.name))
+            except Exception as error:
+                print("Reload of tenant", entry.name, "failed:", error)
+
+    def get_status(self):
+        """
+        Returns the open tenants with their running requests, the least
+        recently used first.
+        """
+        with self.lock:
+            return [
+                {"tenant": entry.name, "requests": entry.users}
+                for entry in self.tenants.values()
+            ]
+
+    def __call__(self, environ, start_response):
+        try:
+            body = self.app(environ, start_response)
+        except Exception:
+            if self.environ_key in environ:
+                self.release(environ.pop(self.environ_key))
+            raise
+        if self.environ_key not in environ:
+            return body
+        entry = environ[self.environ_key]
+        if isinstance(body, (list, tuple)):
+            # The response is complete, only streams keep reading the database
+            self.release(entry)
+            return body
+        released = []
+
+        def release():
+            if len(released) == 0:
+                released.append(True)
+                self.release(entry)
+        return AdmittedBody(body, release)
@@ -0,0 +1,207 @@
+import datetime
+import threading
+import time
+
+
+class AgileTtl:
+    """
+    Expires the records of types with a ``ttl`` setting.
+
+    Every record of such a type gets an expiry time in the column
+    ``agile_expires`` when it is written, either from its expiry field or
+    ``seconds`` after the write. Expired records are hidden from GET and a
+    background reaper deletes them in small batches through the index on
+    ``agile_expires``, pausing between the batches so the purge never
+    holds long locks. Times are stored as UTC without time zone.
+    """
+
+    def __init__(self, database):
+        """
+        Args:
+            database (Database): The configured database of the server.
+        """
+        self.database = database
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def get_ttl(self, agile_type):
+        """
+        Returns the ttl setting of a type or None.
+        """
+        types = self.database.config.get("types") or {}
+        ttl = (types.get(agile_type) or {}).get("ttl")
+        if ttl is None or ttl is False:
+            return None
+        if not isinstance(ttl, dict):
+            ttl = {"seconds": ttl}
+        return ttl
+
+    def has_ttl(self, agile_type):
+        """
+        Checks if the records of a type expire.
+        """
+        return self.get_ttl(agile_type) is not None
+
+    def now(self):
+        """
+        Returns the current UTC time without time zone.
+        """
+        return datetime.datetime.now(datetime.timezone.utc) \
+            .replace(tzinfo=None)
+
+    def parse_expiry(self, value):
+        """
+        Reads the value of an expiry field, an ISO timestamp or seconds
+        since the epoch.
+
+        Raises:
+            ValueError: If the value is no time.
+        """
+        if isinstance(value, bool):
+            raise ValueError("Invalid expiry: " + str(value))
+        if isinstance(value, (int, float)):
+            return datetime.datetime.fromtimestamp(
+                value, datetime.timezone.utc
+            ).replace(tzinfo=None)
+        expiry = datetime.datetime.fromisoformat(
+            str(value).replace("Z", "+00:00")
+        )
+        if expiry.tzinfo is not None:
+            expiry = expiry.astimezone(datetime.timezone.utc) \
+                .replace(tzinfo=None)
+        return expiry
+
+    def compute_expiry(self, agile_type, data):
+        """
+        Computes the expiry time of a record.
+
+        Args:
+            agile_type (str): The type of the record.
+            data (dict): The document of the record.
+
+        Returns:
+            datetime: The expiry time or None if the record doesn't expire.
+        """
+        ttl = self.get_ttl(agile_type)
+        if ttl is None:
+            return None
+        field = ttl.get("expiryField")
+        if field is not None and isinstance(data, dict) and \
+                data.get(field) is not None:
+            return self.parse_expiry(data[field])
+        if ttl.get("seconds") is None:
+            return None
+        return self.now() + datetime.timedelta(seconds=float(ttl["seconds"]))
+
+    def create_visible_predicate(self):
+        """
+        Builds the predicate hiding expired records.
+
+        Returns:
+            tuple: The SQL string and the tuple of parameters.
+        """
+        return "(agile_expires IS NULL OR agile_expires > %s)", (self.now(),)
+
+    def create_purge_sql(self, table_name, batch_size):
+        """
+        Creates the statement deleting one batch of expired records of a
+        type. It takes the type and the current time as parameters.
+        """
+        batch_size = str(int(batch_size))
+        if self.database.type == "postgres":
+            return "DELETE FROM " + table_name + " WHERE ctid IN (" \
+                "SELECT ctid FROM " + table_name + \
+                " WHERE agile_type=%s AND agile_expires < %s" \
+                " LIMIT " + batch_size + ")"
+        if self.database.type == "mariaDb":
+            return "DELETE FROM " + table_name + \
+                " WHERE agile_type=%s AND agile_expires < %s" \
+                " ORDER BY agile_expires LIMIT " + batch_size
+        return "DELETE TOP (" + batch_size + ") FROM " + table_name + \
+            " WHERE agile_type=%s AND agile_expires < %s"
+
+    def purge_type(self, agile_type):
+        """
+        Deletes the expired records of a type batch by batch.
+
+        Returns:
+            int: The number of deleted records.
+        """
+        ttl = self.get_ttl(agile_type)
+        batch_size = int(ttl.get("batchSize", 1000))
+        pause = float(ttl.get("batchPause", 0.1))
+        sql = self.create_purge_sql(
+            self.database.get_table_name(agile_type), batch_size
+        )
+        deleted = 0
+        while True:
+            with self.database.lock:
+                cursor = self.database.connection.cursor()
+                try:
+                    cursor.execute(sql, (agile_type, self.now()))
+                    count = cursor.rowcount
+                    self.database.connection.commit()
+                except Exception:
+                    self.database.connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+                if count > 0:
+                    self.database.coalescer.invalidate(agile_type)
+            deleted += max(count, 0)
+            if count < batch_size:
+                return deleted
+            time.sleep(pause)
+
+    def purge(self):
+        """
+        Deletes the expired records of all types with a ttl.
+        """
+        for agile_type in self.database.config.get("types") or {}:
+            if not self.has_ttl(agile_type):
+                continue
+            try:
+                deleted = self.purge_type(agile_type)
+                if deleted > 0:
+                    print("Purged", deleted, "expired records of", agile_type)
+            except Exception as error:
+                print("Purge of", agile_type, "failed:", error)
+
+    def get_interval(self):
+        """
+        Returns the shortest purge interval of all types with a ttl.
+        """
+        intervals = [
+            float(self.get_ttl(agile_type).get("purgeInterval", 60))
+            for agile_type in self.database.config.get("types") or {}
+            if self.has_ttl(agile_type)
+        ]
+        if len(intervals) == 0:
+            return None
+        return min(intervals)
+
+    def run(self, interval):
+        """
+        Purges expired records until the reaper is stopped.
+        """
+        while not self.stopped.wait(interval):
+            self.purge()
+
+    def start(self):
+        """
+        Starts the reaper if any type has a ttl.
+        """
+        interval = self.get_interval()
+        if interval is None or self.thread is not None or self.stopped.is_set():
+            return
+        self.thread = threading.Thread(
+            target=self.run, args=(interval,),
+            name="agile_ttl_reaper", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the reaper after its current purge.
+        """
+        self.stopped.set()
@@ -0,0 +1,198 @@
+import threading
+import time
+
+
+class PendingWrite:
+    """
+    A write waiting in a write buffer for its group commit.
+    """
+
+    def __init__(self, operation, json_object):
+        self.operation = operation
+        self.json_object = json_object
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class AgileWriteBuffer:
+    """
+    Gathers the writes of one type into micro batches which are executed
+    in one transaction, so a burst of small writes costs one commit per
+    batch instead of one per write.
+
+    A batch is flushed when it reaches ``maxBatch`` writes or
+    ``flushInterval`` seconds after its first write. Every caller waits
+    until its batch is committed and gets its own result. If a batch
+    fails, its writes are repeated one by one, so only the failing write
+    returns an error.
+
+    With ``synchronousCommit`` set to false the batches are committed
+    with ``synchronous_commit=off`` on Postgres. The other backends
+    ignore the setting.
+    """
+
+    def __init__(self, database, agile_type, options):
+        """
+        Args:
+            database (Database): The configured database of the server.
+            agile_type (str): The buffered type.
+            options (dict): The writeBuffer setting of the type.
+        """
+        if not isinstance(options, dict):
+            options = {}
+        self.database = database
+        self.agile_type = agile_type
+        self.flush_interval = float(options.get("flushInterval", 0.01))
+        self.max_batch = int(options.get("maxBatch", 500))
+        self.synchronous_commit = options.get("synchronousCommit", True)
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def submit(self, operation, json_object):
+        """
+        Adds a write to the buffer and waits until it is committed.
+
+        Args:
+            operation (str): post, put, delete or upsert.
+            json_object (dict): The body of the request.
+
+        Returns:
+            obj: The result of the write, the new ID for posts.
+
+        Raises:
+            Exception: The error of the write.
+        """
+        write = PendingWrite(operation, json_object)
+        with self.condition:
+            stopped = self.stopped
+            if not stopped:
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self.run,
+                        name="agile_write_buffer_" + self.agile_type,
+                        daemon=True
+                    )
+                    self.thread.start()
+                self.pending.append(write)
+                self.condition.notify()
+        if stopped:
+            # A write which found the buffer of a replaced configuration
+            # is committed on its own
+            self.flush([write])
+        else:
+            write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def take_batch(self):
+        """
+        Waits for the first write and then until the batch is full or the
+        flush interval is over.
+
+        Returns:
+            list: The writes of the batch, None if the buffer is stopped.
+        """
+        with self.condition:
+            while len(self.pending) == 0:
+                if self.stopped:
+                    return None
+                self.condition.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            batch = self.pending[:self.max_batch]
+            self.pending = self.pending[self.max_batch:]
+        return batch
+
+    def run(self):
+        """
+        Flushes batches until the buffer is stopped and empty.
+        """
+        while True:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            try:
+                self.flush(batch)
+            except Exception as error:
+                for write in batch:
+                    if write.error is None and not write.done.is_set():
+                        write.error = error
+            for write in batch:
+                write.done.set()
+
+    def begin_batch(self):
+        """
+        Prepares the transaction of a batch.
+        """
+        if self.synchronous_commit is False and \
+                self.database.type == "postgres":
+            self.database.cursor.execute(
+                "SET LOCAL synchronous_commit TO OFF"
+            )
+
+    def flush(self, batch):
+        """
+        Executes the writes of a batch and commits them together.
+        """
+        database = self.database
+        with database.lock:
+            try:
+                self.execute_batch(batch)
+            finally:
+                database.coalescer.invalidate(self.agile_type)
+
+    def execute_batch(self, batch):
+        database = self.database
+        with database.lock:
+            try:
+                self.begin_batch()
+                for write in batch:
+                    write.result = database.execute_write(
+                        write.operation, write.json_object
+                    )
+                database.connection.commit()
+                return
+            except Exception as error:
+                print("Write batch of", self.agile_type, "failed:", error)
+                database.connection.rollback()
+            for write in batch:
+                try:
+                    self.begin_batch()
+                    write.result = database.execute_write(
+                        write.operation, write.json_object
+                    )
+                    database.connection.commit()
+                except Exception as error:
+                    database.connection.rollback()
+                    write.result = None
+                    write.error = error
+
+    def stop(self):
+        """
+        Stops the flushing thread once the pending writes are committed.
+        Writes submitted afterwards are committed one by one.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def join(self, timeout=None):
+        """
+        Waits until the pending writes of a stopped buffer are committed.
+
+        Returns:
+            bool: True if the buffer is drained.
+        """
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
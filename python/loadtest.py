@@ -0,0 +1,681 @@
+"""
+Load generator for a running AgileDb server.
+
+Replays a request log written with the ``requestLog`` setting of the
+server or sends a synthetic mix of GET, POST, PUT, DELETE and PATCH
+requests on the types of a config file. Requests are sent by a fixed
+number of workers over keep-alive connections, either back to back
+(closed loop) or at a fixed rate (open loop). In the open loop the
+latency is measured from the time a request was scheduled, so a
+stalling server shows up in the percentiles instead of silently
+lowering the rate.
+
+Examples:
+    python loadtest.py --config config.json --duration 30 --concurrency 16
+    python loadtest.py --config config.json --rate 500 --mix GET=70,POST=20,PUT=10
+    python loadtest.py --replay requests.log --speed 2 --hgrm latency.hgrm
+"""
+import argparse
+import datetime
+import http.client
+import json
+import math
+import random
+import string
+import threading
+import time
+import urllib.parse
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in microseconds with logarithmic buckets of
+    linear sub buckets like an HDR histogram, so every recorded value
+    keeps ``significant_digits`` digits of precision in constant memory.
+    """
+
+    def __init__(self, significant_digits=3):
+        """
+        Args:
+            significant_digits (int): The precision of the recorded values.
+        """
+        sub_bucket_count = 2 * 10 ** significant_digits
+        self.sub_bucket_bits = int(math.ceil(math.log2(sub_bucket_count)))
+        self.sub_bucket_half = 1 << (self.sub_bucket_bits - 1)
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def get_index(self, value):
+        """
+        Returns the bucket index of a value.
+        """
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return shift * self.sub_bucket_half + (value >> shift)
+
+    def get_value(self, index):
+        """
+        Returns the highest value counted in a bucket.
+        """
+        if index < 2 * self.sub_bucket_half:
+            return index
+        shift = index // self.sub_bucket_half - 1
+        sub_bucket = index - shift * self.sub_bucket_half
+        return ((sub_bucket + 1) << shift) - 1
+
+    def record(self, seconds):
+        """
+        Records one latency.
+        """
+        value = max(int(seconds * 1000000), 0)
+        index = self.get_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    def merge(self, other):
+        """
+        Adds the values of another histogram.
+        """
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+
+    def value_at_percentile(self, percentile):
+        """
+        Returns the latency in microseconds below which the given percent
+        of the values are.
+        """
+        if self.total == 0:
+            return 0
+        target = max(int(math.ceil(percentile / 100.0 * self.total)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self.get_value(index), self.max)
+        return self.max
+
+    def mean(self):
+        if self.total == 0:
+            return 0
+        return self.sum / self.total
+
+    def percentile_distribution(self, ticks_per_half_distance=5):
+        """
+        Renders the percentile distribution in the text format of
+        HdrHistogram, values in milliseconds.
+        """
+        lines = ["%12s %14s %10s %14s" % (
+            "Value", "Percentile", "TotalCount", "1/(1-Percentile)"
+        ), ""]
+        percentile = 0.0
+        while self.total > 0:
+            value = self.value_at_percentile(percentile)
+            if value >= self.max:
+                lines.append("%12.3f %2.12f %10d" % (value / 1000.0, 1.0, self.total))
+                break
+            count = int(math.ceil(percentile / 100.0 * self.total))
+            lines.append("%12.3f %2.12f %10d %14.2f" % (
+                value / 1000.0, percentile / 100.0, count,
+                1 / (1 - percentile / 100.0)
+            ))
+            half_distance = math.pow(
+                2, int(math.log2(100.0 / (100.0 - percentile))) + 1
+            )
+            percentile += 100.0 / (half_distance * ticks_per_half_distance)
+        lines.append("#[Mean    = %12.3f, StdDeviation   = %12.3f]" % (
+            self.mean() / 1000.0, self.standard_deviation() / 1000.0
+        ))
+        lines.append("#[Max     = %12.3f, Total count    = %12d]" % (
+            self.max / 1000.0, self.total
+        ))
+        return "\n".join(lines) + "\n"
+
+    def standard_deviation(self):
+        if self.total == 0:
+            return 0
+        mean = self.mean()
+        variance = sum(
+            count * (self.get_value(index) - mean) ** 2
+            for index, count in self.counts.items()
+        ) / self.total
+        return math.sqrt(variance)
+
+
+class Stats:
+    """
+    Latencies and errors of one worker per operation.
+    """
+
+    def __init__(self):
+        self.latency = {}
+        self.service = {}
+        self.errors = {}
+        self.statuses = {}
+
+    def record(self, operation, latency, service, status, error):
+        if operation not in self.latency:
+            self.latency[operation] = LatencyHistogram()
+            self.service[operation] = LatencyHistogram()
+            self.errors[operation] = 0
+        self.latency[operation].record(latency)
+        self.service[operation].record(service)
+        if error:
+            self.errors[operation] += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def merge(self, other):
+        for operation in other.latency:
+            if operation not in self.latency:
+                self.latency[operation] = LatencyHistogram()
+                self.service[operation] = LatencyHistogram()
+                self.errors[operation] = 0
+            self.latency[operation].merge(other.latency[operation])
+            self.service[operation].merge(other.service[operation])
+            self.errors[operation] += other.errors[operation]
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+
+class SyntheticWorkload:
+    """
+    Creates random requests on the types of a config file. PUTs and
+    DELETEs use the ids returned by earlier POSTs and are sent as POSTs
+    while no ids are known.
+    """
+
+    def __init__(self, config, mix, types=None, limit=20, payload_size=64,
+                 patch_sql=None, seed=None):
+        """
+        Args:
+            config (dict): The config of the server.
+            mix (dict): The weight of every method.
+            types (list): The used types, all configured types by default.
+            limit (int): The limit of the GETs.
+            payload_size (int): The length of the random text of every record.
+            patch_sql (str): The raw SQL of the PATCHes.
+            seed (int): The seed of the random generator.
+        """
+        self.config = config
+        self.types = types or list((config.get("types") or {}).keys())
+        if len(self.types) == 0:
+            raise ValueError("No types configured")
+        self.mix = [(method, weight) for method, weight in mix.items() if weight > 0]
+        if patch_sql is None:
+            self.mix = [(method, weight) for method, weight in self.mix if method != "PATCH"]
+        self.limit = limit
+        self.payload_size = payload_size
+        self.patch_sql = patch_sql
+        self.random = random.Random(seed)
+        self.ids = {agile_type: [] for agile_type in self.types}
+        self.lock = threading.Lock()
+
+    def create_value(self, declared_type):
+        declared_type = (declared_type or "TEXT").strip().upper().split("(")[0]
+        if declared_type in ["INTEGER", "INT", "BIGINT", "SMALLINT"]:
+            return self.random.randint(0, 100000)
+        if declared_type in ["FLOAT", "DOUBLE", "REAL", "NUMERIC", "DECIMAL"]:
+            return round(self.random.uniform(0, 100000), 2)
+        if declared_type in ["BOOL", "BOOLEAN", "BIT"]:
+            return self.random.random() < 0.5
+        if declared_type == "DATE":
+            return (datetime.date(2000, 1, 1) + datetime.timedelta(
+                days=self.random.randint(0, 9000)
+            )).isoformat()
+        if declared_type in ["DATETIME", "DATETIME2", "TIMESTAMP"]:
+            return (datetime.datetime(2000, 1, 1) + datetime.timedelta(
+                seconds=self.random.randint(0, 800000000)
+            )).isoformat()
+        if declared_type == "JSON":
+            return {"value": self.random.randint(0, 100)}
+        return "".join(self.random.choice(string.ascii_lowercase) for _ in range(8))
+
+    def create_data(self, agile_type):
+        type_config = (self.config.get("types") or {}).get(agile_type) or {}
+        data = {}
+        declared = dict(type_config.get("fields") or {})
+        declared.update(type_config.get("columns") or {})
+        for field, declared_type in declared.items():
+            if "." in field or "[" in field:
+                continue
+            data[field] = self.create_value(declared_type)
+        data["payload"] = "".join(
+            self.random.choice(string.ascii_letters) for _ in range(self.payload_size)
+        )
+        return data
+
+    def add_id(self, agile_type, agile_id):
+        with self.lock:
+            ids = self.ids[agile_type]
+            ids.append(agile_id)
+            if len(ids) > 100000:
+                del ids[:50000]
+
+    def take_id(self, agile_type, remove):
+        with self.lock:
+            ids = self.ids[agile_type]
+            if len(ids) == 0:
+                return None
+            index = self.random.randrange(len(ids))
+            if remove:
+                ids[index] = ids[-1]
+                return ids.pop()
+            return ids[index]
+
+    def next_request(self):
+        """
+        Returns:
+            tuple: The method, the path, the body and the type of the request.
+        """
+        with self.lock:
+            method = self.random.choices(
+                [method for method, weight in self.mix],
+                [weight for method, weight in self.mix]
+            )[0]
+            agile_type = self.random.choice(self.types)
+        if method == "GET":
+            return "GET", "/", {"type": agile_type, "limit": self.limit}, agile_type
+        if method == "PATCH":
+            return "PATCH", "/", {"sql": self.patch_sql}, agile_type
+        if method in ["PUT", "DELETE"]:
+            agile_id = self.take_id(agile_type, method == "DELETE")
+            if agile_id is not None:
+                if method == "PUT":
+                    return "PUT", "/", {
+                        "type": agile_type, "agile_id": agile_id,
+                        "data": self.create_data(agile_type)
+                    }, agile_type
+                return "DELETE", "/", {"type": agile_type, "agile_id": agile_id}, agile_type
+        return "POST", "/", {"type": agile_type, "data": self.create_data(agile_type)}, agile_type
+
+    def handle_response(self, method, agile_type, body):
+        if method != "POST":
+            return
+        try:
+            agile_id = json.loads(body).get("id")
+        except (ValueError, AttributeError):
+            return
+        if agile_id is not None:
+            self.add_id(agile_type, agile_id)
+
+
+class ReplayWorkload:
+    """
+    Replays the lines of a request log in their order. Without a rate the
+    original gaps between the requests are kept, divided by ``speed``.
+    """
+
+    def __init__(self, path, loop=False):
+        """
+        Args:
+            path (str): The request log, one JSON object per line.
+            loop (bool): Starts again at the first request after the last one.
+        """
+        self.requests = []
+        with open(path, "r", encoding="utf-8") as log:
+            for line in log:
+                if line.strip() == "":
+                    continue
+                entry = json.loads(line)
+                self.requests.append(entry)
+        if len(self.requests) == 0:
+            raise ValueError("The request log is empty")
+        self.loop = loop
+        self.start = self.requests[0].get("time", 0)
+        self.duration = self.requests[-1].get("time", 0) - self.start
+
+    def get_request(self, number):
+        """
+        Returns:
+            tuple: The method, path, body and type of a request, or None after
+            the last request.
+        """
+        if number >= len(self.requests) and not self.loop:
+            return None
+        entry = self.requests[number % len(self.requests)]
+        path = entry.get("path", "/")
+        if entry.get("query"):
+            path += "?" + entry["query"]
+        body = entry.get("body")
+        agile_type = None
+        if isinstance(body, dict):
+            agile_type = body.get("type")
+        return entry.get("method", "GET"), path, body, agile_type
+
+    def get_offset(self, number):
+        """
+        Returns the time of a request in seconds after the first request.
+        """
+        rounds = number // len(self.requests)
+        entry = self.requests[number % len(self.requests)]
+        return rounds * (self.duration + 1) + entry.get("time", 0) - self.start
+
+
+class LoadTest:
+    """
+    Sends the requests of a workload with a pool of worker threads.
+    """
+
+    def __init__(self, url, workload, concurrency=8, rate=None, poisson=False,
+                 duration=None, requests=None, speed=1.0, timeout=30):
+        """
+        Args:
+            url (str): The base URL of the server.
+            workload (obj): A SyntheticWorkload or ReplayWorkload.
+            concurrency (int): The number of workers and connections.
+            rate (float): Requests per second of the open loop, None for a
+            closed loop.
+            poisson (bool): Schedules the requests with exponential gaps.
+            duration (float): The maximum run time in seconds.
+            requests (int): The maximum number of requests.
+            speed (float): The replay speed of request logs without rate.
+            timeout (float): The socket timeout in seconds.
+        """
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.base_path = parsed.path.rstrip("/")
+        self.workload = workload
+        self.concurrency = concurrency
+        self.rate = rate
+        self.poisson = poisson
+        self.duration = duration
+        self.requests = requests
+        self.speed = speed
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.number = 0
+        self.next_time = None
+        self.random = random.Random()
+        self.stats = []
+        self.started = None
+        self.finished = None
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def schedule(self):
+        """
+        Takes the next request and the time it is due.
+
+        Returns:
+            tuple: The request and its due time or None at the end of the run.
+        """
+        with self.lock:
+            number = self.number
+            if self.requests is not None and number >= self.requests:
+                return None
+            if isinstance(self.workload, ReplayWorkload):
+                request = self.workload.get_request(number)
+                if request is None:
+                    return None
+            else:
+                request = None
+            if self.rate is not None:
+                if self.next_time is None:
+                    self.next_time = self.started
+                due = self.next_time
+                gap = 1.0 / self.rate
+                if self.poisson:
+                    gap = self.random.expovariate(self.rate)
+                self.next_time += gap
+            elif isinstance(self.workload, ReplayWorkload) and self.speed > 0:
+                due = self.started + self.workload.get_offset(number) / self.speed
+            else:
+                due = time.monotonic()
+            if self.duration is not None and due - self.started >= self.duration:
+                return None
+            self.number += 1
+        if request is None:
+            request = self.workload.next_request()
+        return request, due
+
+    def is_error(self, method, path, status, body):
+        """
+        Checks the status and, as the server reports errors with status 200,
+        the body of a response.
+        """
+        if status >= 400:
+            return True
+        if not path.startswith("/") or path.split("?")[0] not in ["/", "/upsert"]:
+            return False
+        if method in ["POST", "PUT", "DELETE"]:
+            return b'"OK"' not in body
+        if method in ["GET", "PATCH"]:
+            # JSON, an Arrow stream or a Parquet file
+            return len(body) > 0 and body[:1] not in [b"[", b"{", b"\xff"] and \
+                body[:4] != b"PAR1"
+        return False
+
+    def send(self, connection, method, path, body):
+        """
+        Sends one request and reads the complete response.
+
+        Returns:
+            tuple: The status, the body and the connection to use next.
+        """
+        if body is None:
+            data = None
+        elif isinstance(body, str):
+            data = body.encode("utf-8")
+        else:
+            data = json.dumps(body).encode("utf-8")
+        headers = {"Connection": "keep-alive"}
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            try:
+                connection.request(method, self.base_path + path, data, headers)
+                response = connection.getresponse()
+                content = response.read()
+                if response.getheader("Connection", "").lower() == "close":
+                    connection.close()
+                    connection = self.connect()
+                return response.status, content, connection
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                # the server closed an idle keep-alive connection
+                connection.close()
+                connection = self.connect()
+                if attempt == 1:
+                    raise
+        return 0, b"", connection
+
+    def work(self, stats):
+        connection = self.connect()
+        try:
+            while True:
+                scheduled = self.schedule()
+                if scheduled is None:
+                    return
+                (method, path, body, agile_type), due = scheduled
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                sent = time.monotonic()
+                try:
+                    status, content, connection = self.send(connection, method, path, body)
+                    error = self.is_error(method, path, status, content)
+                except Exception as exception:
+                    status = type(exception).__name__
+                    content = b""
+                    error = True
+                    connection.close()
+                    connection = self.connect()
+                done = time.monotonic()
+                operation = method if path == "/" else method + " " + path.split("?")[0]
+                stats.record(operation, done - min(due, sent), done - sent, status, error)
+                if not error and isinstance(self.workload, SyntheticWorkload):
+                    self.workload.handle_response(method, agile_type, content)
+        finally:
+            connection.close()
+
+    def run(self):
+        """
+        Runs the load test until the duration, the number of requests or the
+        request log is over.
+
+        Returns:
+            Stats: The merged statistics of all workers.
+        """
+        self.started = time.monotonic()
+        threads = []
+        for number in range(self.concurrency):
+            stats = Stats()
+            self.stats.append(stats)
+            thread = threading.Thread(
+                target=self.work, args=(stats,), name="agile_load_" + str(number), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.finished = time.monotonic()
+        result = Stats()
+        for stats in self.stats:
+            result.merge(stats)
+        return result
+
+
+def parse_mix(mix):
+    """
+    Parses a mix like ``GET=70,POST=20,PUT=5,DELETE=5``.
+    """
+    weights = {}
+    for part in mix.split(","):
+        if part.strip() == "":
+            continue
+        method, weight = part.split("=")
+        method = method.strip().upper()
+        if method not in ["GET", "POST", "PUT", "DELETE", "PATCH"]:
+            raise ValueError("Unknown method in mix: " + method)
+        weights[method] = float(weight)
+    return weights
+
+
+def create_report(stats, elapsed):
+    """
+    Summarizes the statistics as dict.
+    """
+    report = {"elapsed": elapsed, "operations": {}, "statuses": {}}
+    total = LatencyHistogram()
+    errors = 0
+    for operation, histogram in sorted(stats.latency.items()):
+        total.merge(histogram)
+        errors += stats.errors[operation]
+        report["operations"][operation] = create_histogram_report(
+            histogram, stats.errors[operation], elapsed
+        )
+        report["operations"][operation]["service_p99_ms"] = \
+            stats.service[operation].value_at_percentile(99) / 1000.0
+    report["total"] = create_histogram_report(total, errors, elapsed)
+    report["statuses"] = {str(status): count for status, count in stats.statuses.items()}
+    return report, total
+
+
+def create_histogram_report(histogram, errors, elapsed):
+    report = {
+        "count": histogram.total,
+        "errors": errors,
+        "error_rate": errors / histogram.total if histogram.total > 0 else 0,
+        "throughput": histogram.total / elapsed if elapsed > 0 else 0,
+        "mean_ms": histogram.mean() / 1000.0,
+        "max_ms": histogram.max / 1000.0,
+    }
+    for percentile in [50, 90, 99, 99.9]:
+        report["p" + str(percentile) + "_ms"] = histogram.value_at_percentile(percentile) / 1000.0
+    return report
+
+
+def print_report(report):
+    print("Elapsed %.2fs" % report["elapsed"])
+    print("%-16s %9s %8s %9s %10s %10s %10s %10s %10s" % (
+        "operation", "count", "errors", "req/s", "p50 ms", "p90 ms", "p99 ms", "p99.9 ms", "max ms"
+    ))
+    rows = list(report["operations"].items()) + [("total", report["total"])]
+    for operation, values in rows:
+        print("%-16s %9d %7.2f%% %9.1f %10.2f %10.2f %10.2f %10.2f %10.2f" % (
+            operation, values["count"], values["error_rate"] * 100, values["throughput"],
+            values["p50_ms"], values["p90_ms"], values["p99_ms"], values["p99.9_ms"],
+            values["max_ms"]
+        ))
+    print("Statuses:", ", ".join(
+        status + "=" + str(count) for status, count in sorted(report["statuses"].items())
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for a running AgileDb server.")
+    parser.add_argument("--url", default=None, help="Base URL, default http://localhost:<server.port>")
+    parser.add_argument("--config", default="config.json", help="Config file with the types")
+    parser.add_argument("--replay", default=None, help="Request log to replay instead of the synthetic mix")
+    parser.add_argument("--loop", action="store_true", help="Repeat the request log")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed, 0 sends the log as fast as possible")
+    parser.add_argument("--mix", default="GET=60,POST=20,PUT=10,DELETE=10", help="Weights of the synthetic methods")
+    parser.add_argument("--types", default=None, help="Comma separated types, all configured types by default")
+    parser.add_argument("--limit", type=int, default=20, help="Limit of the synthetic GETs")
+    parser.add_argument("--payload-size", type=int, default=64, help="Random text per synthetic record")
+    parser.add_argument("--patch-sql", default=None, help="Raw SQL of synthetic PATCHes")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of workers and connections")
+    parser.add_argument("--rate", type=float, default=None, help="Requests per second (open loop)")
+    parser.add_argument("--poisson", action="store_true", help="Exponential gaps between the requests of the open loop")
+    parser.add_argument("--duration", type=float, default=None, help="Run time in seconds")
+    parser.add_argument("--requests", type=int, default=None, help="Number of requests")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the synthetic workload")
+    parser.add_argument("--hgrm", default=None, help="Write the latency percentile distribution to this file")
+    parser.add_argument("--json", default=None, help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    config = {}
+    if args.replay is None or args.url is None:
+        with open(args.config, "r") as config_file:
+            config = json.load(config_file)
+    url = args.url or "http://localhost:" + str(config["server"]["port"])
+    if args.replay is not None:
+        workload = ReplayWorkload(args.replay, args.loop)
+    else:
+        if args.duration is None and args.requests is None:
+            args.duration = 10
+        types = args.types.split(",") if args.types else None
+        workload = SyntheticWorkload(
+            config, parse_mix(args.mix), types, args.limit, args.payload_size,
+            args.patch_sql, args.seed
+        )
+    load_test = LoadTest(
+        url, workload, args.concurrency, args.rate, args.poisson,
+        args.duration, args.requests, args.speed
+    )
+    if args.rate:
+        mode = "at " + str(args.rate) + " req/s"
+    elif args.replay is not None and args.speed > 0:
+        mode = "replaying at speed " + str(args.speed)
+    else:
+        mode = "in a closed loop"
+    print("Load test against", url, "with", args.concurrency, "workers", mode)
+    stats = load_test.run()
+    report, total = create_report(stats, load_test.finished - load_test.started)
+    print_report(report)
+    if args.hgrm is not None:
+        with open(args.hgrm, "w") as hgrm_file:
+            hgrm_file.write(total.percentile_distribution())
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
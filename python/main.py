@@ -1,103 +1,361 @@
-import psycopg2
-import json
-import agiledb.drivers
-from bottle import route, run, request
-
-# Load the configuration file and initialize the database
-config_file = open("config.json", "r").read()
-config_file_dict = json.loads(config_file)
-db_type = config_file_dict["database"]["type"]
-port = config_file_dict["server"]["port"]
-db = agiledb.drivers.Database()
-db.configure(config_file_dict)
-
-def check_if_set_and_true(lookup_str, config):
-    """
-    This function checks if a given key exists in the configuration and if it's set to True.
-    
-    Parameters:
-    lookup_str (str): The key to look for in the configuration.
-    config (dict): The configuration dictionary.
-
-    Returns:
-    bool: True if the key exists and its value is True, False otherwise.
-    """
-    return lookup_str in config and config[lookup_str]
-
-@route('/', method="GET")
-def get():
-    """
-    This function handles GET requests to the root URL. It tries to get data from the database.
-    
-    Returns:
-    str: The data retrieved from the database or an error message.
-    """
-    try:
-        return db.get(request.json)
-    except Exception as error:
-        print("Error", error)
-        if check_if_set_and_true("showDbErrors", db.config["server"]):
-            return str(error)
-
-@route('/', method="POST")
-def post():
-    """
-    This function handles POST requests to the root URL. It tries to post data to the database.
-    
-    Returns:
-    str: A success message with the ID of the created record or an error message.
-    """
-    try:
-        return_id = db.post(request.json)
-        return json.dumps({"result": "OK", "id": return_id})
-    except Exception as error:
-        print(error)
-        if check_if_set_and_true("showDbErrors", db.config["server"]):
-            return str(error)
-
-@route('/', method="PUT")
-def put():
-    """
-    This function handles PUT requests to the root URL. It tries to update a record in the database.
-    
-    Returns:
-    str: A success message or an error message.
-    """
-    try:
-        db.put(request.json)
-        return json.dumps({"result": "OK"})
-    except Exception as error:
-        if check_if_set_and_true("showDbErrors", db.config["server"]):
-            return str(error)
-
-@route('/', method="PATCH")
-def patch():
-    """
-    This function handles PATCH requests to the root URL. It tries to partially update a record in the database.
-    
-    Returns:
-    str: The updated data or an error message.
-    """
-    try:
-        return db.patch(request.json)
-    except Exception as error:
-        if check_if_set_and_true("showDbErrors", db.config["server"]):
-            return str(error)
-
-@route('/', method="DELETE")
-def delete():
-    """
-    This function handles DELETE requests to the root URL. It tries to delete a record from the database.
-    
-    Returns:
-    str: A success message or an error message.
-    """
-    try:
-        db.delete(request.json)
-        return json.dumps({"result": "OK"})
-    except Exception as error:
-        if check_if_set_and_true("showDbErrors", db.config["server"]):
-            return str(error)
-
-# Start the server
-run(host='localhost', port=port, debug=True)
\ No newline at end of file
+import psycopg2
+import json
+import signal
+import threading
+import time
+import agiledb.drivers
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
+from bottle import route, run, request, response, default_app, hook
+from agiledb.compression import AgileCompression
+from agiledb.admission import AgileAdmission
+from agiledb.tenants import AgileTenants
+from agiledb.profiler import AgileProfiler
+
+# Load the configuration file and initialize the database
+config_file = open("config.json", "r").read()
+config_file_dict = json.loads(config_file)
+db_type = config_file_dict["database"]["type"]
+port = config_file_dict["server"]["port"]
+db = agiledb.drivers.Database()
+db.configure(config_file_dict)
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """
+    WSGI server handling every request in its own thread.
+    """
+    daemon_threads = True
+
+def check_if_set_and_true(lookup_str, config):
+    """
+    This function checks if a given key exists in the configuration and if it's set to True.
+    
+    Parameters:
+    lookup_str (str): The key to look for in the configuration.
+    config (dict): The configuration dictionary.
+
+    Returns:
+    bool: True if the key exists and its value is True, False otherwise.
+    """
+    return lookup_str in config and config[lookup_str]
+
+def get_database(body=True):
+    """
+    This function returns the database of the tenant of the request, the configured database
+    for requests without tenant.
+
+    Parameters:
+    body (bool): Read the tenant from the JSON body too, not only from the header.
+
+    Returns:
+    Database: The database of the request.
+    """
+    return tenants.get_database(request.environ, request.json if body else None)
+
+request_log = None
+request_log_lock = threading.Lock()
+if "requestLog" in config_file_dict["server"]:
+    request_log = open(config_file_dict["server"]["requestLog"], "a", encoding="utf-8")
+
+@hook('before_request')
+def log_request():
+    """
+    This function writes every request to the request log of the server, one JSON object per line,
+    so the traffic can be replayed with loadtest.py. Bodies larger than 1 MB are not logged.
+    """
+    if request_log is None:
+        return
+    body = None
+    if request.content_length <= 1024 * 1024:
+        body = request.body.read().decode("utf-8", "replace")
+        try:
+            body = json.loads(body) if body != "" else None
+        except ValueError:
+            pass
+    line = json.dumps({
+        "time": time.time(),
+        "method": request.method,
+        "path": request.path,
+        "query": request.query_string,
+        "body": body
+    })
+    with request_log_lock:
+        request_log.write(line + "\n")
+        request_log.flush()
+
+@route('/', method="GET")
+def get():
+    """
+    This function handles GET requests to the root URL. It tries to get data from the database.
+    
+    Requests with the format arrow or parquet are answered with an Arrow IPC stream
+    or a Parquet file.
+    
+    Returns:
+    str: The data retrieved from the database or an error message.
+    """
+    try:
+        json_object = request.json
+        database = get_database()
+        if database.columnar.is_columnar(json_object):
+            response.content_type = database.columnar.get_content_type(json_object["format"])
+            return database.get_columnar(json_object)
+        return database.get(json_object)
+    except Exception as error:
+        print("Error", error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/', method="POST")
+def post():
+    """
+    This function handles POST requests to the root URL. It tries to post data to the database.
+    
+    Returns:
+    str: A success message with the ID of the created record or an error message.
+    """
+    try:
+        return_id = get_database().post(request.json)
+        return json.dumps({"result": "OK", "id": return_id})
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/', method="PUT")
+def put():
+    """
+    This function handles PUT requests to the root URL. It tries to update a record in the database.
+    
+    Returns:
+    str: A success message or an error message.
+    """
+    try:
+        get_database().put(request.json)
+        return json.dumps({"result": "OK"})
+    except Exception as error:
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/', method="PATCH")
+def patch():
+    """
+    This function handles PATCH requests to the root URL. It tries to partially update a record in the database.
+    
+    Returns:
+    str: The updated data or an error message.
+    """
+    try:
+        return get_database().patch(request.json)
+    except Exception as error:
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/', method="DELETE")
+def delete():
+    """
+    This function handles DELETE requests to the root URL. It tries to delete a record from the database.
+    
+    Returns:
+    str: A success message or an error message.
+    """
+    try:
+        get_database().delete(request.json)
+        return json.dumps({"result": "OK"})
+    except Exception as error:
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/upsert', method="POST")
+def upsert():
+    """
+    This function handles POST requests to the upsert URL. It inserts or updates records
+    identified by the natural key of their type.
+    
+    Returns:
+    str: A success message with the ID or IDs of the records or an error message.
+    """
+    try:
+        return_id = get_database().upsert(request.json)
+        return json.dumps({"result": "OK", "id": return_id})
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/summary', method="GET")
+def summary():
+    """
+    This function handles GET requests to the summary URL. It reads a summary of a type.
+    
+    Returns:
+    str: The groups of the summary or an error message.
+    """
+    try:
+        return get_database().get_summary(request.json)
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/explain', method="GET")
+def explain():
+    """
+    This function handles GET requests to the explain URL. It takes the body of a GET request
+    and returns the query plan of the database with a summary of full scans and missing indexes.
+    
+    Returns:
+    str: The SQL, the plan and the summary or an error message.
+    """
+    try:
+        return get_database().explain(request.json)
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/migrations', method="GET")
+def migrations():
+    """
+    This function handles GET requests to the migrations URL. It shows the types which are
+    moving to their table and the number of moved records.
+    
+    Returns:
+    str: The pending migrations.
+    """
+    try:
+        return get_database(False).get_migrations()
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/advisor', method="GET")
+def advisor():
+    """
+    This function handles GET requests to the advisor URL. It shows the columns and indexes
+    suggested by the GETs of the server, ranked by their estimated savings.
+
+    Returns:
+    str: The suggestions or an error message.
+    """
+    try:
+        return get_database(False).get_advice()
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/export', method="GET")
+def export():
+    """
+    This function handles GET requests to the export URL. It streams all records of a type
+    as NDJSON or in the COPY text format.
+    
+    Returns:
+    generator: The exported lines or an error message.
+    """
+    try:
+        json_object = request.json
+        if json_object.get("format", "ndjson") == "copy":
+            response.content_type = "text/tab-separated-values; charset=utf-8"
+        else:
+            response.content_type = "application/x-ndjson; charset=utf-8"
+        return get_database().export(json_object)
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+@route('/import', method="POST")
+def import_data():
+    """
+    This function handles POST requests to the import URL. The body holds one record per line,
+    the type, format and chunk size are taken from the query string.
+    
+    Returns:
+    str: The number of imported records or an error message.
+    """
+    try:
+        # The body holds the records, so the tenant is only read from the header
+        result = get_database(False).import_data(
+            request.query.type,
+            request.body,
+            request.query.format or "ndjson",
+            int(request.query.chunk_size or 5000)
+        )
+        return json.dumps({"result": "OK", "imported": result["imported"], "chunks": result["chunks"]})
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+def reload_config():
+    """
+    This function reads the configuration file again and applies the changes without a restart.
+    
+    Returns:
+    dict: The applied changes.
+    """
+    new_config = json.loads(open("config.json", "r").read())
+    changes = db.reload(new_config)
+    tenants.reload(new_config)
+    return changes
+
+def reload_in_background():
+    """
+    This function reloads the configuration and logs errors, it runs in its own thread.
+    """
+    try:
+        reload_config()
+    except Exception as error:
+        print("Reload failed:", error)
+
+@route('/reload', method="POST")
+def reload():
+    """
+    This function handles POST requests to the reload URL. It applies the changes of the
+    configuration file, the requests keep being served meanwhile.
+    
+    Returns:
+    str: The applied changes or an error message.
+    """
+    if not check_if_set_and_true("enableReload", db.config):
+        return json.dumps({"error": "Reload is not enabled!"})
+    try:
+        return json.dumps({"result": "OK", "changes": reload_config()})
+    except Exception as error:
+        print(error)
+        if check_if_set_and_true("showDbErrors", db.config["server"]):
+            return str(error)
+
+# Reload the configuration on SIGHUP, the DDL runs in its own thread
+if hasattr(signal, "SIGHUP"):
+    signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_in_background, daemon=True).start())
+
+@route('/tenants', method="GET")
+def open_tenants():
+    """
+    This function handles GET requests to the tenants URL. It shows the tenants with an open
+    database and their running requests.
+
+    Returns:
+    str: The open tenants.
+    """
+    return json.dumps(tenants.get_status())
+
+# Start the server
+app = default_app()
+tenants = AgileTenants(app, db, config_file_dict)
+app = tenants
+if "compression" in config_file_dict["server"]:
+    app = AgileCompression(app, config_file_dict["server"]["compression"])
+if "admission" in config_file_dict["server"]:
+    app = AgileAdmission(app, config_file_dict["server"]["admission"])
+if "profiler" in config_file_dict["server"]:
+    # Outermost, so the profiling endpoints answer while the server is overloaded
+    app = AgileProfiler(app, config_file_dict["server"]["profiler"])
+if check_if_set_and_true("threaded", config_file_dict["server"]):
+    run(app=app, host='localhost', port=port, debug=True, server_class=ThreadingWSGIServer)
+else:
+    run(app=app, host='localhost', port=port, debug=True)
\ No newline at end of file